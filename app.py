@@ -1,26 +1,41 @@
 
 import dash
+import flask
 from dash import dcc  # https://dash.plotly.com/dash-core-components
 from dash import html  # https://dash.plotly.com/dash-html-components
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash import Patch
+from dash.exceptions import PreventUpdate
 
-import plotly.express as px  # express plot
-from plotly.tools import mpl_to_plotly  # matplot
+# plotly.express (express plots) and matplotlib are imported in the functions that use them, they take more than
+# a second to import and the server answers before the data is loaded (see load_data, benchmarks/bench_startup.py)
 import plotly.graph_objects as go  # graph objects  # https://plotly.com/python/graph-objects/
 
 from plotly.subplots import make_subplots  # Make Subplots with go https://plotly.com/python/creating-and-updating-figures/
 
-import matplotlib.pyplot as plt
 import pandas as pd
-from pandas.tseries.offsets import MonthEnd
 import os
 import numpy as np
-import matplotlib.dates as mdates
-import datetime
 import logging
 
 import time
 import threading
+import re
+import json
+
+from archive import archive_exists, archive_window_start, read_archive, ARCHIVE_DIR, ARCHIVE_MANIFEST
+from data_loader import IncrementalCsvReader
+from snapshot import CsvSnapshot
+from shared_store import create_store
+from time_index import TimeIndexedFrame
+from calendar_index import CalendarIndex
+from rollup import RollupTiers, ROLLUP_TIERS, AUTO
+from downsample import downsample
+from cell_heatmap import bin_time_cells, deviation_from_module_mean
+from figure_cache import FigureCache
+from single_flight import SharedResults
+from browser_payload import encode_figure, encode_values, PayloadStats
+from timings import CallbackTimings, format_table
 
 data_path = os.path.abspath( os.path.join( os.path.dirname(os.path.realpath(__file__)), "data"))
 #logging.basicConfig(filename=os.path.join(data_path, 'DashboardLog.log'), encoding='utf-8', level=logging.DEBUG,
@@ -29,92 +44,220 @@ data_path = os.path.abspath( os.path.join( os.path.dirname(os.path.realpath(__fi
 logging.basicConfig(filename=os.path.join(data_path, 'DashboardLog.log'), level=logging.DEBUG,
                     format='app.py %(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
-# TODO use plotly-resampler for faster graph generation (prefered with chaching so it is user independent)
-#  https://github.com/predict-idlab/plotly-resampler/blob/main/examples/dash_apps/01_minimal_global.py
+# every line trace is downsampled before it is sent to the browser (see downsample.py), zooming into a graph
+# downsamples the visible time range again (like plotly-resampler)
 
 # Typehint: https://docs.python.org/3/library/typing.html
 
 # initial callback duplicates need to be prevented
-app = dash.Dash(__name__, prevent_initial_callbacks="initial_duplicate")  # default: http://127.0.0.1:8050
+# the graphs are only added to the layout when the data is loaded (see serve_layout), so the callbacks refer to
+# components that are not in the first layout
+app = dash.Dash(__name__, prevent_initial_callbacks="initial_duplicate",
+                suppress_callback_exceptions=True)  # default: http://127.0.0.1:8050
 # Dash automatically loads CSS files that are in the assets folder
 
 VERSION = "0.3.0"
 filename: str = "fenecon_voltage_data.csv"   # "REP_fenecon_voltage_data_v5_test.csv"
 timecolumn = 'Zeitstempel'  # x-axis in most plots
+# "pyarrow" parses the csv file multithreaded with typed columns (faster and about half the memory of "pandas"),
+# compare both with benchmarks/bench_csv_parse.py
+CSV_PARSER = os.environ.get("CSV_PARSER", "pyarrow")
+# one process (gunicorn worker) reads the data and shares it with the others, see shared_store.py
+SHARED_STORE = os.environ.get("SHARED_STORE", "1") == "1"
+STORE_WAIT_TIME = 25  # seconds a worker waits at startup for the loader
+# seconds between the checks for new data, every process checks on its own (the loader publishes the new rows to the
+# shared store, the other processes attach to them), not only when a browser refresh interval reaches it
+DATA_REFRESH_INTERVAL = int(os.environ.get("DATA_REFRESH_INTERVAL", "30"))
+# without shared store, the parsed csv file is saved as snapshot in data/snapshot, so a restart only parses the rows
+# appended since (see snapshot.py)
+SNAPSHOT = os.environ.get("SNAPSHOT", "1") == "1"
+# the data is loaded in a background thread, the server answers at once and shows "loading" until the data is there
+LOAD_IN_BACKGROUND = os.environ.get("LOAD_IN_BACKGROUND", "1") == "1"
+DATA_WAIT_INTERVAL = 10  # seconds between the checks for the data file if it doesnt exist yet
+# the dashboard shows at most the last 180 days (lastxdays_input), only these days are read from the parquet archive
+# (whole days, the daily rollup bucket at the start of the range needs the whole day)
+MAX_DAYS = 6 * 30
+BATTERY_LAYOUT_FILE = "battery_layout.json"  # towers, modules and cells found by the data collection
+CELL_COLUMN = re.compile(r"^Voltage Module(\d+) Cell(\d+)$")
+# long time ranges are plotted from buckets (min, max, mean and last value per 1 minute, 15 minutes, ...),
+# "auto" chooses the widths for the time between samples, an empty value plots every sample. See rollup.py
+ROLLUP_TIER_NAMES = os.environ.get("ROLLUP_TIERS", ROLLUP_TIERS)
+if ROLLUP_TIER_NAMES != AUTO:
+    ROLLUP_TIER_NAMES = [name for name in ROLLUP_TIER_NAMES.split(",") if name]
+DEFAULT_GRAPH_WIDTH = 1500  # pixel, until the browser sent the width of the window
+# "minmax" keeps the lowest and highest value of every bucket (no voltage spike is lost), "lttb" looks closer to the
+# original line, "off" sends every point
+DOWNSAMPLING = os.environ.get("DOWNSAMPLING", "minmax")
+TRACE_POINTS = int(os.environ.get("TRACE_POINTS", "2000"))  # points per line trace
+# time buckets (columns) of the heatmap of all cells, the mean of every cell per bucket is shown (see cell_heatmap.py)
+HEATMAP_BUCKETS = int(os.environ.get("HEATMAP_BUCKETS", "300"))
+FIGURE_CACHE_MB = float(os.environ.get("FIGURE_CACHE_MB", "100"))  # memory limit of the figure cache per process
+# "webgl" draws the line traces with WebGL (Scattergl) and sends their values as base64 encoded typed arrays
+# (see browser_payload.py), "svg" draws them as SVG and sends JSON lists
+RENDER_MODE = os.environ.get("RENDER_MODE", "svg")
+# time of the stages (load, slice, transform, figure build, serialize) of every callback, see /debug/timings
+TIMINGS = os.environ.get("TIMINGS", "1") == "1"
+TIMINGS_PANEL = os.environ.get("TIMINGS_PANEL", "0") == "1"  # collapsed table of the timings below the graphs
+DEFAULT_SECONDARY_COLUMN = "Ladezustand [%]"  # selected value for the secondary y-axis
+# same as the ids of the graphs
+FIGURE_NAMES = ("linefig", "barfig", "cell_line_fig", "cell_bar_fig", "delta_fig", "cell_heatmap_fig")
+HEATMAP_MODES = ("mV", "Deviation from module mean")  # options of the cell heatmap
 colors = {"background_plot": "#DEDEDE", "text": "#cce7e8", "text_disabled": "#779293", "background_area": "#1d2c45"}
 GLOBAL_GRAPH_MARGINS = {"l":80, "r":30, "t":5, "b":10}
 
 global_df = None  # global var for dataframe to be used in callbacks
+global_data = None  # global var for all data, indexed by time (TimeIndexedFrame) to get time ranges in callbacks
+global_data_source = None  # the dataframe global_data was built from (before sorting), to see if the data changed
 global_module_names = None  # global var for the module names to be used in callbacks to update plots
-global_cell_names = None  # global var for the column names for all cells
+global_cell_names = None  # global var for the column names of the cells of every module (list of lists)
 global_secondary_column_names = None  # global var for column names that are not modules or cells
+global_rollups = RollupTiers(timecolumn, ROLLUP_TIER_NAMES)  # rollup tiers of global_data
+figure_cache = FigureCache(int(FIGURE_CACHE_MB * 1e6))  # figures of all callbacks, see get_figures
+view_results = SharedResults()  # data and rangeslider of the last x days, shared by the callbacks, see get_view
+payload_stats = PayloadStats()  # bytes sent to the browser per callback and per trace, see /debug/payload
+timings = CallbackTimings(TIMINGS)  # time per callback and stage of this process, see /debug/timings
+csv_readers = {}  # IncrementalCsvReader per csv file
+data_loaded = threading.Event()  # set when the data is loaded (see load_data)
+refresh_lock = threading.Lock()  # one refresh of global_data at a time (refresh timer and interval callback)
+shared_store = create_store(os.path.join(os.getcwd(), "data", "dashboard_store"), timecolumn) if SHARED_STORE else None
 
 debug_run = True  # flask runs the main code twice when in debugging
 
 
-def read_data_as_df(filename):
-    df = pd.read_csv(
-        # read the filename in directory "data" within current directory
-        os.path.join(os.path.join(os.getcwd(), "data"), filename), sep=";"
-    )
-    # convert time form string to timedate object
-    df[timecolumn] = pd.to_datetime(df[timecolumn],
-                                       format='%Y-%m-%d %H:%M:%S.%f')  # Year month day hour minute second microseconds
-    return df
+def data_exists(filename) -> bool:
+    data_dir = os.path.join(os.getcwd(), "data")
+    return os.path.exists(os.path.join(data_dir, filename)) or archive_exists(data_dir)
+
+
+def get_csv_reader(filename) -> IncrementalCsvReader:
+    # the csv file is parsed once, after that only the rows added since the last call are parsed
+    path = os.path.join(os.getcwd(), "data", filename)
+    if path not in csv_readers:
+        # the shared store keeps the parsed data over restarts itself (see publish_shared_data)
+        snapshot = CsvSnapshot(os.path.join(os.getcwd(), "data", "snapshot")) if SNAPSHOT and shared_store is None \
+            else None
+        csv_readers[path] = IncrementalCsvReader(path, timecolumn, '%Y-%m-%d %H:%M:%S.%f', parser=CSV_PARSER,
+                                                 snapshot=snapshot)
+    return csv_readers[path]
 
 
-def get_list_of_cell_voltage_values(df) -> list:
+def publish_shared_data(filename):
     """
-    return a list of lists containing the voltage value per cell.
-    Every 14 cells are one module. Also returns cell names
-    :param df:
-    :type df:
-    :return:
-    :rtype:
+    Only called in the loader process: read the data that changed since the last published version and publish it.
+    Rows added to the data are appended to the published rows, everything is only published again if older rows
+    changed (i.e. the csv file was replaced or a day of the archive is no longer shown).
     """
-    all_cells = []
-    for m in range(10):
-        for c in range(14):
-            if c < 10:
-                all_cells.append(f"Voltage Module{m} Cell00{c}")
-            else:
-                all_cells.append(f"Voltage Module{m} Cell0{c}")
+    data_dir = os.path.join(os.getcwd(), "data")
+    meta = shared_store.read_meta()
+    source = meta["source"] if meta else {}
+    if archive_exists(data_dir):
+        manifest = os.stat(os.path.join(data_dir, ARCHIVE_DIR, ARCHIVE_MANIFEST))
+        signature = [manifest.st_ino, manifest.st_size, manifest.st_mtime_ns]
+        if source.get("archive") == signature:
+            return
+        published = shared_store.attach() if "archive" in source else None
+        if published is not None and len(published) \
+                and published[timecolumn].iloc[0] == archive_window_start(data_dir, MAX_DAYS):
+            rows = read_archive(data_dir, MAX_DAYS, whole_days=True, after=published[timecolumn].iloc[-1])
+            shared_store.append(rows, {"archive": signature})
+        else:
+            shared_store.publish(read_archive(data_dir, MAX_DAYS, whole_days=True), {"archive": signature})
+        return
+
+    reader = get_csv_reader(filename)
+    if reader.df is None and source.get("path") == reader.path and shared_store.attach() is not None:
+        # continue where the last loader (i.e. a restarted worker) stopped instead of parsing the whole file
+        reader.resume(shared_store.df, source)
+    rows, complete = reader.read_new_rows()
+    if rows is None:
+        return
+    if complete:
+        if not rows[timecolumn].is_monotonic_increasing:
+            # sorted once here, so the other processes don't need to sort (see TimeIndexedFrame)
+            rows = rows.sort_values(timecolumn, kind="stable", ignore_index=True)
+        shared_store.publish(rows, reader.state())
+    else:
+        shared_store.append(rows, reader.state())
+    # keep only the shared (memory mapped) copy
+    reader.resume(shared_store.attach(), reader.state())
+
 
-    # Save all columns from the cells as lists and the dates
-    all_cell_values = []
-    for name in all_cells:
-        all_cell_values.append(df[name].tolist())
-    return all_cell_values, all_cells
+def read_shared_data(filename):
+    """
+    Get all data from the shared store. The loader process publishes new data first, the other processes only
+    attach to the latest version.
+    """
+    if shared_store.try_become_loader():
+        publish_shared_data(filename)
+        return shared_store.attach()
+    df = shared_store.attach()
+    if df is None:
+        # the loader is still reading the data (startup)
+        df = shared_store.wait_for_version(STORE_WAIT_TIME)
+    if df is None:
+        logging.warning("no shared data from the loader process yet, reading the data in this process")
+        df = read_data_as_df(filename, use_store=False)
+    return df
 
 
-def get_list_of_avg_module_voltage_values(all_cell_values) -> list:
+def read_data_as_df(filename, last_x_days=None, columns=None, use_store=True):
     """
-    return a list of lists containing the avg voltage value per module.
-    Also returns the list of module names
-    :param df:
-    :type df:
-    :return:
-    :rtype:
+    Read the collected data. If the data collection writes the parquet archive (data/archive), only the partitions
+    and columns that are needed are read from there. Otherwise the csv file is read (the whole file, it can't be
+    read from a time on).
+    With the shared store, the data is read once by the loader process and the other processes use its copy.
+    :param filename: name of the csv file in directory "data"
+    :param last_x_days: only return the last x days (relative to the newest row), None for all data that can be
+        shown (the whole days of the last MAX_DAYS days from the archive, all rows from the csv file)
+    :param columns: columns to read (the time column is always included), None for all columns
+    :param use_store: use the shared store (if enabled)
+    :return: dataframe with the time column as datetime (not to be changed in place, it is shared with the next calls)
     """
-    # Create AVG mV per plot
-    module_lists = []
-    # loop über alle werte in 14er schritten
-    for i in range(0, len(all_cell_values) - 13, 14):
-        cells_per_module = []
-        # take values
-        for n in range(14):
-            cells_per_module.append(all_cell_values[i + n])
-        module_lists.append(np.asarray(cells_per_module))
+    # read the filename in directory "data" within current directory
+    data_dir = os.path.join(os.getcwd(), "data")
+    if shared_store is not None and use_store:
+        df = read_shared_data(filename)
+    elif archive_exists(data_dir):
+        return read_archive(data_dir, last_x_days or MAX_DAYS, columns, whole_days=last_x_days is None)
+    else:
+        df = get_csv_reader(filename).read()
+    if columns is not None:
+        df = df[[timecolumn] + [c for c in columns if c != timecolumn and c in df.columns]]
+    if last_x_days is not None:
+        df = df.loc[df[timecolumn] >= df[timecolumn].max() - pd.Timedelta(days=last_x_days)]
+    return df
 
-    # Create labels and Avg values
-    avg_values_per_module = []
-    for l in module_lists:
-        avg_values_per_module.append(np.average(l, axis=0))
 
-    avg_labels = []
-    for i in range(10):
-        avg_labels.append(f"Module_{i}")  # from top to bottom in the tower? Seems like it not sure yet
-    return avg_values_per_module, avg_labels
+def get_cell_and_module_names(df) -> tuple:
+    """
+    Find the columns of the modules and cells. The battery layout discovered by the data collection
+    (data/battery_layout.json) is used if it exists, otherwise the cell columns are taken from the header
+    ("Voltage Module<i> Cell<nnn>"). Columns that are not in the dataframe are left out.
+    :param df: the collected data
+    :return: list of the module columns ("Module_<i>") and a list with the cell columns of every module
+    """
+    layout_file = os.path.join(os.getcwd(), "data", BATTERY_LAYOUT_FILE)
+    modules = {}  # module column -> cell columns
+    if os.path.exists(layout_file):
+        with open(layout_file, "r") as f:
+            layout = json.loads(f.read())
+        modules = {module["avg_column"]: module["cell_columns"] for module in layout["modules"]}
+    if not any(name in df.columns for name in modules):
+        # no layout or a layout that doesnt fit the data (i.e. an older csv file)
+        modules = {}
+        for name in df.columns:
+            match = CELL_COLUMN.match(name)
+            if match:
+                modules.setdefault(f"Module_{int(match.group(1))}", []).append(name)
+
+    module_names = []
+    cell_names = []
+    for module_name in sorted(modules, key=lambda m: int(m.split("_")[-1])):
+        cells = [c for c in modules[module_name] if c in df.columns]
+        if module_name in df.columns and cells:
+            module_names.append(module_name)
+            cell_names.append(cells)
+    return module_names, cell_names
 
 
 def add_avg_module_to_df(avg_module_values, module_names, df):
@@ -134,14 +277,19 @@ def add_avg_module_to_df(avg_module_values, module_names, df):
     return new_df
 
 
-def create_fig_matplot(avg_module_values, avg_labels) -> plt:
+def create_fig_matplot(avg_module_values, avg_labels) -> go.Figure:
+    # matplotlib and plotly.tools take about a second to import and only this (unused) plot needs them
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    from plotly.tools import mpl_to_plotly
+
     # PLOT mV per Module
     # figsize defines width and height of plot
     px = 1 / plt.rcParams['figure.dpi']
 
     fig, ax = plt.subplots(figsize=(960*px, 540*px), facecolor='white')
     for i in range(len(avg_module_values)):
-        plt.plot(df[timecolumn], avg_module_values[i], marker='',  # color=colors[i*14+6],
+        plt.plot(global_df[timecolumn], avg_module_values[i], marker='',  # color=colors[i*14+6],
                  linewidth=0.8, alpha=0.9, label=avg_labels[i], zorder=15 - i)
     #plt.title("Voltage per Module over time")
     leg = ax.legend(loc='upper right')
@@ -159,6 +307,7 @@ def create_fig_matplot(avg_module_values, avg_labels) -> plt:
 
 
 def create_fig_express(df, module_names):
+    import plotly.express as px
     # Melt pandas dataframe to make long format: https://pandas.pydata.org/docs/reference/api/pandas.melt.html
     # the long format seems to be intended for express plots like example data from:
     # "https://raw.githubusercontent.com/ThuwarakeshM/geting-started-with-plottly-dash/main/life_expectancy.csv"
@@ -180,13 +329,82 @@ def create_fig_express(df, module_names):
     return fig
 
 
+def scatter_trace(**kwargs):
+    """
+    A line trace, drawn with WebGL if RENDER_MODE is "webgl" (faster with many points, i.e. on mobile devices).
+    """
+    if RENDER_MODE == "webgl":
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
+
+
+def browser_figure(name, fig):
+    """
+    The figure as it is sent to the browser (into the store of the graph, see create_graph): with the values of the
+    traces as typed arrays if RENDER_MODE is "webgl" (decoded by assets/typed_arrays.js), else unchanged.
+    """
+    if RENDER_MODE != "webgl":
+        return fig
+    fig_dict = encode_figure(fig)
+    payload_stats.add_figure(name, fig_dict)
+    return fig_dict
+
+
+def browser_values(values):
+    return encode_values(values) if RENDER_MODE == "webgl" else values
+
+
+def create_graph(name, fig) -> list:
+    """
+    The graph and the store with its figure as sent by the server (see browser_figure). The callbacks update the
+    store, the browser decodes the figure into the graph (clientside callback, see assets/typed_arrays.js).
+    """
+    return [dcc.Store(id=f"{name}_store", data=fig), dcc.Graph(id=name)]
+
+
+def create_secondary_trace(df, secondary_col, use_delta=False, linemode="lines"):
+    """
+    The trace of the secondary y-axis (the same in the line and the delta figure).
+    :param use_delta: show the difference to the previous value (i.e. energy per sample of an energy counter)
+    """
+    # handle too long names for legend
+    legend_name = secondary_col
+    if len(legend_name) > 15:
+        legend_name = legend_name.split(" ")[0]
+    if len(legend_name) > 15:
+        legend_name = "Secondary"
+
+    if use_delta:
+        y_axis = df[secondary_col].diff().fillna(0)
+    else:
+        y_axis = df[secondary_col]
+    [(x, y_axis)] = downsample(df[timecolumn], [y_axis], TRACE_POINTS, DOWNSAMPLING)
+
+    return scatter_trace(x=x, y=y_axis, name=legend_name, mode=linemode,
+                      line=dict(width=1.4, color="red", dash='dot'),
+                      hovertemplate="%s<br>Date=%%{x}<br>value=%%{y}<extra></extra>"%secondary_col)
+
+
+def set_secondary_axis_visible(fig, trace_index, visible: bool):
+    """
+    Show or hide the secondary trace and its y-axis. Works on a figure and on a dash Patch of a figure.
+    :param trace_index: index of the secondary trace in the figure
+    """
+    fig["data"][trace_index]["visible"] = visible
+    fig["layout"]["yaxis2"]["visible"] = visible
+    # the x-axis leaves space for the secondary y-axis on the right (same as make_subplots)
+    fig["layout"]["xaxis"]["domain"] = [0.0, 0.94] if visible else [0.0, 1.0]
+
+
 def create_fig_graphobject(df, module_names, add_secondary_y: bool = False, secondary_col: str = "Ladezustand [%]",
                            use_delta=False, show_marker=False):
     # https://plotly.com/python/graph-objects/
     # https://plotly.com/python-api-reference/
 
-    # Create figure with secondary y-axis
-    if add_secondary_y:
+    # Create figure with secondary y-axis (the secondary trace is always added, hidden if not selected, so the
+    # checkbox only changes its visibility, see update_secondary_axis_in_lineplot)
+    has_secondary_trace = secondary_col in df.columns
+    if has_secondary_trace:
         fig = make_subplots(specs=[[{"secondary_y": True}]]) #, "r":-0.01}]])  # 1% weniger abstand zur legende
     else:
         fig = go.Figure()
@@ -197,31 +415,16 @@ def create_fig_graphobject(df, module_names, add_secondary_y: bool = False, seco
         linemode = "lines"
 
     # mV plot lines
-    for name in module_names:
-        fig.add_trace(go.Scatter(x=df[timecolumn], y=df[name], mode=linemode,
+    traces = downsample(df[timecolumn], [df[name] for name in module_names], TRACE_POINTS, DOWNSAMPLING)
+    for name, (x, y) in zip(module_names, traces):
+        fig.add_trace(scatter_trace(x=x, y=y, mode=linemode,
                                  showlegend=True, line=dict(width=0.9), name=name,
                                  hovertemplate="%s<br>Date=%%{x}<br>mV=%%{y}<extra></extra>"%name
                                  ))
-    if add_secondary_y:
-        # handle too long names for legend
-        legend_name = secondary_col
-        if len(legend_name) > 15:
-            legend_name = legend_name.split(" ")[0]
-        if len(legend_name) > 15:
-            legend_name = "Secondary"
-
-        if use_delta:
-            y_axis = df[secondary_col].diff().fillna(0)
-        else:
-            y_axis = df[secondary_col]
-
-        fig.add_trace(
-            go.Scatter(x=df[timecolumn], y=y_axis, name=legend_name, mode=linemode,
-                       line=dict(width=1.4, color="red", dash='dot'),
-                       hovertemplate="%s<br>Date=%%{x}<br>value=%%{y}<extra></extra>"%secondary_col),
-            secondary_y=True
-        )
+    if has_secondary_trace:
+        fig.add_trace(create_secondary_trace(df, secondary_col, use_delta, linemode), secondary_y=True)
         fig.update_yaxes(title_text=secondary_col, secondary_y=True, color="red")#, tickfont_family="Arial Black")
+        set_secondary_axis_visible(fig, len(fig.data) - 1, add_secondary_y)
         fig.update_yaxes(title_text="mV", secondary_y=False)
         #fig.update_traces(marker=dict(size=3, line=dict(width=0, color='black')))
     else:
@@ -246,10 +449,8 @@ def create_fig_graphobject(df, module_names, add_secondary_y: bool = False, seco
 
 
 def create_bar_fig(df, module_names):
-    avg_per_mod = []
-
-    for mod in module_names:
-        avg_per_mod.append(np.average( np.asarray(df[mod].tolist()) ))
+    import plotly.express as px
+    avg_per_mod = df[module_names].mean().tolist()
 
     fig = px.bar(x=module_names, y=avg_per_mod, range_y=[min(avg_per_mod)-100, max(avg_per_mod)+100])
 
@@ -269,9 +470,29 @@ def create_bar_fig(df, module_names):
     return fig
 
 
+def get_module_avg_delta(df, module_names):
+    """
+    Returns the delta mV (value between min mV and max mV over all modules) at every timestep.
+    Uses the column "Module Avg Delta" calculated by the data collection, only rows without it
+    (collected by older versions) are calculated here.
+    :param df:
+    :param module_names:
+    :return: pandas series with the delta per row
+    """
+    if "Module Avg Delta" not in df.columns:
+        return df[module_names].max(axis=1) - df[module_names].min(axis=1)
+    absolute_delta = df["Module Avg Delta"]
+    missing = absolute_delta.isna()
+    if missing.any():
+        absolute_delta = absolute_delta.copy()
+        absolute_delta[missing] = df.loc[missing, module_names].max(axis=1) - df.loc[missing, module_names].min(axis=1)
+    return absolute_delta
+
+
 def create_delta_overtime_fig(df, module_names, add_secondary_y: bool = False, secondary_col: str = "Ladezustand [%]",
                               use_delta=False, show_marker=False):
-    if add_secondary_y:
+    has_secondary_trace = secondary_col in df.columns
+    if has_secondary_trace:
         fig = make_subplots(specs=[[{"secondary_y": True}]]) #, "r":-0.01}]])  # 1% weniger abstand zur legende
     else:
         fig = go.Figure()
@@ -281,35 +502,17 @@ def create_delta_overtime_fig(df, module_names, add_secondary_y: bool = False, s
     else:
         linemode = "lines"
 
-    # get the lowest and highest value betwwen all modules at every timestep
-    # Add delta mV values (value between min mV and max mV over all modules) to df
-    tmp_df = df.copy()
-    tmp_df["absolute_delta"] = tmp_df[module_names].max(axis=1) - tmp_df[module_names].min(axis=1)
+    absolute_delta = get_module_avg_delta(df, module_names)
+    [(x, absolute_delta)] = downsample(df[timecolumn], [absolute_delta], TRACE_POINTS, DOWNSAMPLING)
 
-    fig.add_trace(go.Scatter(x=tmp_df[timecolumn], y=tmp_df["absolute_delta"], mode=linemode,
+    fig.add_trace(scatter_trace(x=x, y=absolute_delta, mode=linemode,
                              showlegend=True, line=dict(width=1.2), name="mV delta",  # line=dict(width=1.2, color="#26874a")
                              hovertemplate="%s<br>Date=%%{x}<br>delta mV=%%{y}<extra></extra>"%"mV delta"
                              ))
-    if add_secondary_y:
-        # handle too long names for legend
-        legend_name = secondary_col
-        if len(legend_name) > 15:
-            legend_name = legend_name.split(" ")[0]
-        if len(legend_name) > 15:
-            legend_name = "Secondary"
-
-        if use_delta:
-            y_axis = df[secondary_col].diff().fillna(0)
-        else:
-            y_axis = df[secondary_col]
-
-        fig.add_trace(
-            go.Scatter(x=df[timecolumn], y=y_axis, name=legend_name, mode=linemode,
-                       line=dict(width=1.4, color="red", dash='dot'),
-                       hovertemplate="%s<br>Date=%%{x}<br>value=%%{y}<extra></extra>"%secondary_col),
-            secondary_y=True
-        )
+    if has_secondary_trace:
+        fig.add_trace(create_secondary_trace(df, secondary_col, use_delta, linemode), secondary_y=True)
         fig.update_yaxes(title_text=secondary_col, secondary_y=True, color="red")#, tickfont_family="Arial Black")
+        set_secondary_axis_visible(fig, len(fig.data) - 1, add_secondary_y)
         fig.update_yaxes(title_text="mV delta", secondary_y=False)
         #fig.update_traces(marker=dict(size=3, line=dict(width=0, color='black')))
     else:
@@ -350,6 +553,18 @@ def create_headerdiv():
     ], id="header_div", className="container")
 
 
+def create_loading_layout():
+    """
+    Layout until the data is loaded: the header and a message. The interval checks if the data is loaded and replaces
+    the message by the graphs (show_layout_when_loaded).
+    """
+    return html.Div([
+        create_headerdiv(),
+        html.H2("Loading data...", style={"margin": f"50px 5px 20px {GLOBAL_GRAPH_MARGINS['l']}px"}),
+        dcc.Interval(id="loading_interval", interval=2 * 1000, n_intervals=0)
+    ], id="loading_div", className="div_class")
+
+
 def create_module_selection_div(module_names):
     return html.Div([
 
@@ -376,7 +591,7 @@ def create_settingsdiv(secondary_column_names):
         html.Div([
             dcc.Checklist(options=["Show secondary y-axis", "Use delta value"], id="secondary_y_checkbox",
                           value=[], style={}),
-            # todo is there a way to directly adress the marker in the figs via callback and only change those (without new fig generation)?
+            # the marker and the secondary axis are changed in the figures without building them again
             dcc.Checklist(options=["Show line-marker"], id="showmarker_checkbox",
                           value=[], style={}),
 
@@ -387,7 +602,7 @@ def create_settingsdiv(secondary_column_names):
         dcc.Dropdown(
             id="secondary_y_dropdown",
             options=[{"label": y, "value": y} for y in secondary_column_names],
-            value="Ladezustand [%]",
+            value=DEFAULT_SECONDARY_COLUMN,
             className="dropdown",
             style={"padding-right":f"{GLOBAL_GRAPH_MARGINS['r']}px"}
         )
@@ -397,10 +612,10 @@ def create_settingsdiv(secondary_column_names):
     ], id="settings_div", className="div_class")
 
 
-def create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names, module_id: int = 0):
+def create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names, module_id: int = 0, _bar_df=None):
     """
 
-    :param _df:
+    :param _df: data for the line figure
     :type _df:
     :param _module_names:  Only to be used as label for the legend of the cell plot.
     :type _module_names:
@@ -408,20 +623,22 @@ def create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names,
     :type all_cell_names:
     :param module_id:
     :type module_id:
+    :param _bar_df: data for the averages in the bar figure (i.e. all samples if _df are rollup buckets), None to use _df
     :return:
     :rtype:
     """
-    # Every module has 14 cells
-    module_cell_values_names = all_cell_names[0 + (module_id * 14):14 + (module_id * 14)]
+    import plotly.express as px
+    module_cell_values_names = all_cell_names[module_id]
     shortened_cell_names = [i.split()[-1][:-3]+"_"+i.split()[-1][-3:] for i in module_cell_values_names]
 
     # Create line figure for cell mV
     fig = go.Figure()
+    traces = downsample(_df[timecolumn], [_df[name] for name in module_cell_values_names], TRACE_POINTS, DOWNSAMPLING)
     i = -1
-    for name in module_cell_values_names:
+    for x, y in traces:
         i+=1
         short_name = shortened_cell_names[i]
-        fig.add_trace(go.Scatter(x=_df[timecolumn], y=_df[name], mode='lines',
+        fig.add_trace(scatter_trace(x=x, y=y, mode='lines',
                                  showlegend=True, line=dict(width=0.8), name=short_name,
                                  hovertemplate="%s<br>Date=%%{x}<br>mV=%%{y}<extra></extra>" % short_name
                                  ))
@@ -442,9 +659,9 @@ def create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names,
     #fig.update_layout(showlegend=True)
 
     # Create bar plot for avg cell mV
-    avg_per_cell = []
-    for cell in module_cell_values_names:
-        avg_per_cell.append(np.average(np.asarray(_df[cell].tolist())))
+    if _bar_df is None:
+        _bar_df = _df
+    avg_per_cell = _bar_df[module_cell_values_names].mean().tolist()
 
     # create bar figure with shortened cell names
     fig_bar = px.bar(x=shortened_cell_names,
@@ -465,8 +682,55 @@ def create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names,
     return fig, fig_bar
 
 
-def create_module_cell_plots_div(_df, _module_names, all_cell_names):
-    fig1, fig2 = create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names)
+def create_cell_heatmap_fig(_df, _module_names, all_cell_names, deviation: bool = False):
+    """
+    Heatmap of all cells (rows) over time (columns), one trace instead of a line per cell: the mean mV of every cell
+    per time bucket, or its deviation from the mean of its module.
+    :param _df: data of the time range (samples or rollup buckets)
+    :param _module_names: labels of the modules on the y-axis
+    :param all_cell_names: column names of the cells of every module (list of lists)
+    :param deviation: show the deviation from the module mean instead of the mV
+    """
+    cell_columns = [name for module_cells in all_cell_names for name in module_cells]
+    times, matrix = bin_time_cells(_df[timecolumn].to_numpy(), _df[cell_columns].to_numpy(), HEATMAP_BUCKETS)
+    if deviation:
+        matrix = deviation_from_module_mean(matrix, [len(module_cells) for module_cells in all_cell_names])
+    labels = [f"{module_name} {name.split()[-1][:-3]}_{name.split()[-1][-3:]}"
+              for module_name, module_cells in zip(_module_names, all_cell_names) for name in module_cells]
+    unit = "mV from module mean" if deviation else "mV"
+
+    fig = go.Figure(go.Heatmap(
+        x=times, y=labels, z=np.round(matrix.T, 1),  # cells x buckets, 0.1 mV is enough for the colors
+        colorscale="RdBu_r" if deviation else "Viridis", zmid=0 if deviation else None,
+        colorbar=dict(title=unit), hoverongaps=False,
+        hovertemplate="%%{y}<br>Date=%%{x}<br>%s=%%{z}<extra></extra>" % unit))
+    # one tick per module (the first of its cells), the first cell at the top
+    fig.update_yaxes(tickvals=[labels[i] for i in np.cumsum([0] + [len(c) for c in all_cell_names[:-1]])],
+                     ticktext=_module_names, autorange="reversed")
+    fig.update_xaxes(title_text="Date")
+    fig.update_layout(
+        plot_bgcolor=colors["background_plot"],
+        paper_bgcolor=colors["background_area"],
+        font_color=colors["text"],
+        margin=dict(l=GLOBAL_GRAPH_MARGINS["l"], r=GLOBAL_GRAPH_MARGINS["r"], t=GLOBAL_GRAPH_MARGINS["t"],
+                    b=GLOBAL_GRAPH_MARGINS["b"]),
+        height=max(360, 4 * len(labels))
+    )
+    return fig
+
+
+def create_cell_heatmap_div(fig):
+    return html.Div([
+        html.H2("Voltage of all cells over time:", style={"margin": f"50px 5px 20px {GLOBAL_GRAPH_MARGINS['l']}px"}),
+        dcc.RadioItems(options=list(HEATMAP_MODES), value=HEATMAP_MODES[0], id="heatmap_mode", inline=True,
+                       style={"margin-left": f"{GLOBAL_GRAPH_MARGINS['l']}px"}),
+        *create_graph("cell_heatmap_fig", fig)
+    ], id="cell_heatmap_div", className="div_class")
+
+
+def create_module_cell_plots_div(_df, _module_names, all_cell_names, fig1=None, fig2=None):
+    if fig1 is None or fig2 is None:
+        fig1, fig2 = create_mV_plots_per_cell_for_one_module(_df, _module_names, all_cell_names)
 
     return html.Div([
         # top right bottom left (margin)
@@ -484,11 +748,11 @@ def create_module_cell_plots_div(_df, _module_names, all_cell_names):
         # Row containing both graphs
         html.Div([
             html.Div([
-                dcc.Graph(id="cell_line_fig", figure=fig1)
+                *create_graph("cell_line_fig", fig1)
             ], id="cellline_div", className="div_class"),
 
             html.Div([
-                dcc.Graph(id="cell_bar_fig", figure=fig2)
+                *create_graph("cell_bar_fig", fig2)
             ], id="cellbar_div", className="div_class")
 
         ], id="cell_plots_div", className="div_class")
@@ -496,6 +760,17 @@ def create_module_cell_plots_div(_df, _module_names, all_cell_names):
     ], id="lower_area_div", className="div_class", style={'display': 'flex', 'flex-direction': 'column'})
 
 
+def create_timings_div():
+    """
+    Collapsed panel with the average time per callback and stage (see /debug/timings), only if TIMINGS_PANEL is set.
+    """
+    return html.Details([
+        html.Summary("Timings"),
+        html.Button("Refresh", id="timings_refresh_button"),
+        html.Pre(id="timings_panel", style={"color": colors["text"], "font-size": "12px"})
+    ], id="timings_div", className="div_class", style={"margin": f"10px 5px 10px {GLOBAL_GRAPH_MARGINS['l']}px"})
+
+
 def create_correlation_div(_df):
     """
     Example for scatter plot to check for correlation based on delta values from i.e. energy given
@@ -504,6 +779,7 @@ def create_correlation_div(_df):
     :return:
     :rtype:
     """
+    import plotly.express as px
     df = _df.copy()
     df["Netzeinspeisung delta [Wh]"] = df["Netzeinspeisung Energie [Wh]"].diff().fillna(0)
     df["Netzbezug delta [Wh]"] = df["Netzbezug Energie [Wh]"].diff().fillna(0)
@@ -514,140 +790,203 @@ def create_correlation_div(_df):
     ], id="correlation_row_div", className="div_class", style={'display': 'flex', 'flex-direction': 'row'})
 
 
-def get_df_with_transformed_date_and_rangeslider_marker(_df):
+def get_rangeslider_marks(slider) -> dict:
+    """
+    The marks of the rangeslider, one per step (calendar bucket), labeled with its date.
+    :param slider: SliderBuckets of the shown data
+    :return: marks dict of the dcc.RangeSlider
     """
-    Returns a flag, the edited dataframe and a marker for the rangeslider.
-    The returns flag 'hour' or 'day' or 'minute' tells us if it is rounded to hours or to days or month.
-    df.
-    The marker dict is a dict used to set the markers for a rangeslider to the datetime.
-    :param _df:
-    :type _df:
-    :return: flag, dataframe, marker
-    :rtype: str, pandas.df, dict
-    """
-    # EDIT DATAFRAME
-    flag = "hour"
-    df_new_time = _df.copy()
-    difference = max(df_new_time[timecolumn]) - min(df_new_time[timecolumn])
-    if difference > pd.Timedelta(91, "d"):
-        # set values to end of current month
-        # to_datetime only works on strings for reformatting!, else use df.date.dt.strftime("")!
-        # so the format here is useless
-        df_new_time[timecolumn] = pd.to_datetime(df_new_time[timecolumn], format='%Y-%m-%d') + MonthEnd(0)
-        df_new_time[timecolumn] = df_new_time[timecolumn].dt.floor(freq="d")  # round to days as well to get uniform vals below day
-        flag = "month"
-    elif difference > pd.Timedelta(2, "d"):
-        # reduce time timestamp resolution to per day basis
-        df_new_time[timecolumn] = df_new_time[timecolumn].dt.round(freq="d") #.date   # floors to closest day without time
-        flag = "day"
-    elif difference > pd.Timedelta(2, "H"):
-        # timedelta.round(freq='H')
-        df_new_time[timecolumn] = df_new_time[timecolumn].dt.round(freq="H")
-        flag = "hour"
-    else:
-        df_new_time[timecolumn] = df_new_time[timecolumn].dt.round(freq="min")
-        flag = "minute"
-
     # MARKER https://pandas.pydata.org/docs/reference/api/pandas.Period.strftime.html
-    numdate = [x for x in range(len(df_new_time[timecolumn].unique()))]
-    if flag == "day":
-        marker = {numd: {"label": date.strftime('%d/%m/%y'), "style": {"color": colors["text"]}} for numd, date in
-                  zip(numdate, df_new_time[timecolumn].unique())}
-    elif flag == "hour":
-        marker = {numd: {"label": date.strftime('%d/%m/%y %H:%M'), "style": {"color": colors["text"]}} for numd, date in
-                  zip(numdate, df_new_time[timecolumn].unique())}
-    elif flag == "minute":
-        marker = {numd: {"label": date.strftime('%d/%m/%y %H:%M'), "style": {"color": colors["text"]}} for numd, date in
-                  zip(numdate, df_new_time[timecolumn].unique())}
-    elif flag == "month":
-        marker = {numd: {"label": date.strftime('%m/%y'), "style": {"color": colors["text"]}} for numd, date in
-                  zip(numdate, df_new_time[timecolumn].unique())}
-
-    return flag, df_new_time, marker
-
-
-def get_df_mask_from_rangeslider(flag, _rounded_df, _df_to_mask, minval, maxval):
-    """
-    Takes a flag 'hour' or 'day' (based on if the datas timestemps are rounded to the full hour or converted to date).
-    Takes a dataframe on which the min and maxvals are based (same as df to mask but with rounded or converted timedates).
-    Takes a dataframe to be masked, and a minval and maxval refering to datetimes (_df_to_mask).
-    Returns the mask to filter the dataframe to be between the selected datetimes.
-    :param flag:
-    :type flag:
-    :param _rounded_df:
-    :type _rounded_df:
-    :param _df_to_mask:
-    :type _df_to_mask:
-    :param minval:
-    :type minval:
-    :param maxval:
-    :type maxval:
-    :return:
-    :rtype:
+    return {numd: {"label": label, "style": {"color": colors["text"]}} for numd, label in enumerate(slider.labels())}
+
+
+def get_time_range_from_rangeslider(slider, minval, maxval):
     """
-    # translate the numbers from the slider to the dates then timedates
-    logging.debug(f"Checking maxval {maxval} and unique times {len(_rounded_df[timecolumn].unique())}")
-    try:
-        from_val = _rounded_df[timecolumn].unique()[minval]
-        to_val = _rounded_df[timecolumn].unique()[maxval]
-        from_val = pd.to_datetime(from_val, format='%Y-%m-%d %H:%M:%S.%f')
-        to_val = pd.to_datetime(to_val, format='%Y-%m-%d %H:%M:%S.%f')
-        # no time added for hour since hour is rounded and not floored
-        if flag == "hour":
-            # add 1 hour -1 sec
-            to_val = to_val + pd.Timedelta("00:30:59")
-        if flag == "day":
-            # add 24h -1 sec
-            to_val = to_val + pd.Timedelta("23:59:59")
-        if flag == "minute":
-            # add 24h -1 sec
-            from_val = from_val - pd.Timedelta("00:00:59")
-            to_val = to_val + pd.Timedelta("00:00:59")
-        if flag == "month":
-            # hacky solution to get all days in the first month since all dates have been set to the last day in every month
-            # which is good for the to_val but bad for the from_val in which all days would be missing
-            # TODO find better solution in get_df_with_transformed_date_and_rangeslider_marker when rounding to month
-            from_val = from_val - pd.Timedelta(days=30)
-        # filter the original df (with datetime not date) to contain only data within the selected dates
-        mask = (_df_to_mask[timecolumn] >= from_val) & (_df_to_mask[timecolumn] <= to_val)
-    except Exception as e:
-        # TODO FIND THE CAUSE OF THIS ERROR (Why is maxval 1 too high?) check where it is calculated and why it doesnt fit for example with 11 days
-        # DEFAULT MASK USED SOME ERROR OCCURED! index 13 is out of bounds for axis 0 with size 12
-
-        logging.error(f"Error while getting time values:{e} => reducing maxval by one")
-        # TRY EXACT SAME BUT -1 ON MAX VALUE
-        try:
-            from_val = _rounded_df[timecolumn].unique()[minval]
-            to_val = _rounded_df[timecolumn].unique()[maxval-1]
-            from_val = pd.to_datetime(from_val, format='%Y-%m-%d %H:%M:%S.%f')
-            to_val = pd.to_datetime(to_val, format='%Y-%m-%d %H:%M:%S.%f')
-            # no time added for hour since hour is rounded and not floored
-            if flag == "hour":
-                # add 1 hour -1 sec
-                to_val = to_val + pd.Timedelta("00:30:59")
-            if flag == "day":
-                # add 24h -1 sec
-                to_val = to_val + pd.Timedelta("23:59:59")
-            if flag == "minute":
-                # add 24h -1 sec
-                from_val = from_val - pd.Timedelta("00:00:59")
-                to_val = to_val + pd.Timedelta("00:00:59")
-            if flag == "month":
-                from_val = from_val - pd.Timedelta(days=30)
-            # filter the original df (with datetime not date) to contain only data within the selected dates
-            mask = (_df_to_mask[timecolumn] >= from_val) & (_df_to_mask[timecolumn] <= to_val)
-        except Exception as e:
-            print(f"DEFAULT MASK USED SOME ERROR OCCURED! {e}")
-            logging.error("####################################")
-            logging.error(f"Error while getting time values:{e}")
-            logging.debug(f"Recieved min and max {minval} {maxval} and unique times are {_rounded_df[timecolumn].unique()}"
-                          f"with the flag {flag}")
-            mask = (_df_to_mask[timecolumn] >= from_val)  # fallback mask
-
-    return mask
+    Takes the steps of the rangeslider (calendar buckets of the shown data, month, day, hour or minute depending on
+    the timespan) and a minval and maxval from the rangeslider, refering to the steps.
+    Returns the time range of the original data from the start of the first to the end of the last selected bucket.
+    Slider values outside of the range (i.e. the slider was set before the data was reloaded and now has fewer
+    steps) are moved to the first or last step.
+    :return: from_val, to_val (None, None if there is no data)
+    :rtype: pd.Timestamp, pd.Timestamp
+    """
+    first, last = slider.clamp(minval, maxval)
+    if first is None:
+        return None, None
+    if (first, last) != (minval, maxval):
+        logging.debug(f"rangeslider values {minval} {maxval} outside of the {len(slider)} steps, "
+                      f"using {first} {last}")
+    return slider.time_range(first, last)
+
+
+def get_plot_df(_data, from_val, to_val, graph_width):
+    """
+    The data to plot in line charts for the time range: the mean per bucket of the coarsest rollup tier that still has
+    one bucket per pixel of the graph width, or every sample if no tier has enough buckets (short time ranges).
+    :param _data: TimeIndexedFrame of the data
+    :param graph_width: width of the graphs in pixel (None if unknown)
+    :return: dataframe with the time column and the values
+    """
+    plot_df = global_rollups.frame(from_val, to_val, graph_width or DEFAULT_GRAPH_WIDTH)
+    if plot_df is None:
+        plot_df = _data.slice(from_val, to_val)
+    return plot_df
+
+
+def get_data_version(_data=None) -> tuple:
+    """
+    Version of the data (global_data if None) for the caches: changes with every new row or if older rows changed.
+    """
+    if _data is None:
+        _data = global_data
+    if not len(_data):
+        return 0, None, None
+    return len(_data), int(_data.times[0]), int(_data.times[-1])
+
+
+def get_calendar(_data) -> CalendarIndex:
+    """
+    The calendar buckets of the data for the rangeslider, built once per data version.
+    """
+    return view_results.get(("calendar", get_data_version(_data)), lambda: CalendarIndex(_data.times))
 
 
+def compute_view(_data, last_x_days) -> dict:
+    with timings.stage("slice"):
+        current_data = _data.sub_index(last_x_days)
+    with timings.stage("transform"):
+        slider = get_calendar(_data).slider(current_data.first_time(), current_data.last_time())
+        marker = get_rangeslider_marks(slider)
+    return {"data": current_data, "slider": slider, "marker": marker}
+
+
+def get_view(last_x_days, selected_year_range=None) -> tuple:
+    """
+    The data of the last x days, the steps and marks of the rangeslider for it, and the time range selected by the
+    rangeslider. The view is computed once per data version and number of days, and shared by all callbacks
+    (also by those running at the same time, see SharedResults).
+    :return: view (dict with "data" (TimeIndexedFrame), "slider" (SliderBuckets) and "marker"), from_val, to_val
+    """
+    _data = global_data  # the same data for the version and the view, even if the interval replaces global_data
+    view = view_results.get((get_data_version(_data), last_x_days), lambda: compute_view(_data, last_x_days))
+    if selected_year_range is None:
+        return view, None, None
+    from_val, to_val = get_time_range_from_rangeslider(view["slider"], selected_year_range[0], selected_year_range[1])
+    return view, from_val, to_val
+
+
+def get_figures(names, _data, from_val, to_val, graph_width, module_id=0, show_secondary_axis=False,
+                secondary_col=DEFAULT_SECONDARY_COLUMN, use_delta=False, show_marker=False,
+                heatmap_deviation=False) -> list:
+    """
+    The figures for the time range, from the figure cache or built (and added to the cache).
+    :param names: the figures to get, see FIGURE_NAMES
+    :param _data: TimeIndexedFrame of the data
+    :param graph_width: width of the graphs in pixel, to select the rollup tier (None if unknown)
+    :param module_id: module of the cell figures
+    :param heatmap_deviation: the cell heatmap shows the deviation from the module mean instead of the mV
+    :return: list with the figures in the order of the names
+    """
+    # the line figures are built from the selected rollup tier (or all samples), the bar figures from all samples
+    tier = global_rollups.select(from_val, to_val, graph_width or DEFAULT_GRAPH_WIDTH)
+    source = tier.name if tier is not None else "samples"
+    version = get_data_version()
+    keys = {"linefig": (source, show_secondary_axis, secondary_col, use_delta, show_marker),
+            "barfig": (),
+            "cell_line_fig": (source, module_id),
+            "cell_bar_fig": (module_id,),
+            "delta_fig": (source, show_secondary_axis, secondary_col, use_delta, show_marker),
+            "cell_heatmap_fig": (source, heatmap_deviation)}
+    built = {}  # the data and the cell figures (built together) are only created once for all figures
+
+    def get_plot_data():
+        if "plot_df" not in built:
+            with timings.stage("slice"):
+                built["plot_df"] = get_plot_df(_data, from_val, to_val, graph_width)
+                built["filtered_df"] = _data.slice(from_val, to_val)
+        return built["plot_df"], built["filtered_df"]
+
+    def create(name):
+        plot_df, filtered_df = get_plot_data()
+        with timings.stage("figure_build"):
+            fig = build(name, plot_df, filtered_df)
+        with timings.stage("serialize"):
+            return browser_figure(name, fig)
+
+    def build(name, plot_df, filtered_df):
+        if name == "linefig":
+            fig = create_fig_graphobject(plot_df, global_module_names, show_secondary_axis, secondary_col,
+                                         use_delta, show_marker)
+        elif name == "barfig":
+            fig = create_bar_fig(filtered_df, global_module_names)
+        elif name == "delta_fig":
+            fig = create_delta_overtime_fig(plot_df, global_module_names, show_secondary_axis, secondary_col,
+                                            use_delta, show_marker)
+        elif name == "cell_heatmap_fig":
+            fig = create_cell_heatmap_fig(plot_df, global_module_names, global_cell_names, heatmap_deviation)
+        else:
+            if "cell_figs" not in built:
+                built["cell_figs"] = create_mV_plots_per_cell_for_one_module(plot_df, global_module_names,
+                                                                             global_cell_names, module_id, filtered_df)
+            fig = built["cell_figs"][0 if name == "cell_line_fig" else 1]
+        fig.update_layout(transition_duration=200)
+        return fig
+
+    return [figure_cache.get_or_create((name, version, from_val, to_val) + keys[name], lambda: create(name))
+            for name in names]
+
+
+def get_relayout_range(relayout_data):
+    """
+    The x axis range of a graph after zooming or panning (relayoutData of the graph).
+    Raises PreventUpdate if the x axis didnt change (i.e. the y axis was zoomed or the graph was drawn).
+    :return: from_val, to_val (None, None if the zoom was reset)
+    :rtype: pd.Timestamp, pd.Timestamp
+    """
+    if not relayout_data:
+        raise PreventUpdate
+    if relayout_data.get("xaxis.autorange"):
+        return None, None
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        return pd.Timestamp(relayout_data["xaxis.range[0]"]), pd.Timestamp(relayout_data["xaxis.range[1]"])
+    if "xaxis.range" in relayout_data:
+        return pd.Timestamp(relayout_data["xaxis.range"][0]), pd.Timestamp(relayout_data["xaxis.range"][1])
+    raise PreventUpdate
+
+
+def get_zoomed_time_range(relayout_data, selected_year_range, last_x_days):
+    """
+    The visible part of a zoomed graph (within the time range selected by the rangeslider).
+    The rollup tier is selected for the visible range, so zooming in shows finer buckets and finally every sample.
+    :return: TimeIndexedFrame of the last x days, from_val, to_val
+    """
+    view, from_val, to_val = get_view(last_x_days, selected_year_range)
+    current_data = view["data"]
+    zoom_from, zoom_to = get_relayout_range(relayout_data)
+    if zoom_from is not None and from_val is not None:
+        # a bit more than the visible range, so the lines dont end within the graph
+        margin = (zoom_to - zoom_from) * 0.05
+        from_val = max(from_val, zoom_from - margin)
+        to_val = min(to_val, zoom_to + margin)
+    return current_data, from_val, to_val
+
+
+def patch_trace_data(fig, props=("x", "y")) -> Patch:
+    """
+    Only the x and y values (or the given properties) of the traces of the figure, to update a graph without changing
+    its layout (the zoomed range and traces hidden in the legend stay as they are).
+    """
+    patched_figure = Patch()
+    for i, trace in enumerate(fig["data"]):  # figure or dict (see browser_figure)
+        for prop in props:
+            patched_figure["data"][i][prop] = trace[prop]
+    return patched_figure
+
+
+@timings.timed
 def serve_layout():
+    if not data_loaded.is_set():
+        return create_loading_layout()
     return create_app_layout(global_df, global_module_names, global_cell_names, global_secondary_column_names)
 
 
@@ -659,13 +998,15 @@ def create_app_layout(df, module_names, all_cell_names, secondary_column_names):
     :return:
     :rtype:
     """
-    # reduce time timestamp resolution to per day basis (or to hours if its less than 24h)
-    flag, tmp_df, marker = get_df_with_transformed_date_and_rangeslider_marker(global_df)
-    numdate = [x for x in range(len(tmp_df[timecolumn].unique()))]
-
-    fig = create_fig_graphobject(df, module_names)
-    bar_fig = create_bar_fig(df, module_names)
-    delta_fig = create_delta_overtime_fig(df, module_names)
+    # from the figure cache, every browser tab gets the same figures
+    layout_data = TimeIndexedFrame(df, timecolumn, is_sorted=True)
+    # one slider step per month, day, hour or minute (depending on the timespan of the data)
+    slider = get_calendar(global_data).slider(layout_data.first_time(), layout_data.last_time())
+    marker = get_rangeslider_marks(slider)
+    numdate = [x for x in range(len(slider))]
+    fig, bar_fig, cell_line, cell_bar, delta_fig, cell_heatmap = get_figures(FIGURE_NAMES, layout_data,
+                                                                             layout_data.first_time(),
+                                                                             layout_data.last_time(), None)
 
     return html.Div([
         create_headerdiv(),
@@ -674,6 +1015,10 @@ def create_app_layout(df, module_names, all_cell_names, secondary_column_names):
             interval= 300 * 1000,  # in milliseconds
             n_intervals=0
         ),
+        dcc.Store(id="graph_width_store"),  # width of the browser window, to select the rollup tier
+        # secondary column and delta setting of the secondary trace in the figures (None if they have none)
+        dcc.Store(id="secondary_trace_store",
+                  data=[DEFAULT_SECONDARY_COLUMN if DEFAULT_SECONDARY_COLUMN in df.columns else None, False]),
         # Data length setting
         html.Div([
             html.Label("Show last "),
@@ -682,14 +1027,14 @@ def create_app_layout(df, module_names, all_cell_names, secondary_column_names):
                 type="number",
                 placeholder="14",
                 value=14,
-                min=1, max=6*30,
+                min=1, max=MAX_DAYS,
             ),
             html.Label(" days of data. (After changing the value, it may take a few seconds to update)")
         ], style={"margin": f"0px 0px 0px {GLOBAL_GRAPH_MARGINS['l']}px"}),
         html.Div([
             html.H2("The mV value per module as average over its cells:",
                     style={"margin": f"50px 5px 20px {GLOBAL_GRAPH_MARGINS['l']}px"}),
-            dcc.Graph(id="linefig", figure=fig)
+            *create_graph("linefig", fig)
         ], id="figure_div", className="div_class"),
 
         html.Div([
@@ -705,24 +1050,53 @@ def create_app_layout(df, module_names, all_cell_names, secondary_column_names):
         html.Div([
             html.H3("The delta, between the lowest module mV and the highest mV, over time:",
                     style={"margin": f"10px 5px 2px {GLOBAL_GRAPH_MARGINS['l']}px"}),
-            dcc.Graph(id="delta_fig", figure=delta_fig)
+            *create_graph("delta_fig", delta_fig)
         ], id="delta_over_time_div", className="div_class"),
 
         html.Div([
 
             html.Div([
-                dcc.Graph(id="barfig", figure=bar_fig)
+                *create_graph("barfig", bar_fig)
             ], id="barplot_div", className="div_class"),
             create_settingsdiv(secondary_column_names),
 
         ], id="setting_barplot_div", className="div_class"),
 
-        create_module_cell_plots_div(df, module_names, all_cell_names),
+        create_module_cell_plots_div(df, module_names, all_cell_names, cell_line, cell_bar),
+
+        create_cell_heatmap_div(cell_heatmap),
 
         #create_correlation_div(df),
 
+    ] + ([create_timings_div()] if TIMINGS_PANEL else []), id="layout", className="div_class")
 
-    ], id="layout", className="div_class")
+
+@app.callback(
+    Output("loading_div", "children"),
+    Input("loading_interval", "n_intervals"),
+    prevent_initial_call=True
+)
+def show_layout_when_loaded(n):
+    # the layout with the graphs replaces the loading message (and its interval)
+    if not data_loaded.is_set():
+        raise PreventUpdate
+    return create_app_layout(global_df, global_module_names, global_cell_names, global_secondary_column_names)
+
+
+# the graphs use the whole window width, the browser sends it at the start and with every refresh interval
+app.clientside_callback(
+    "function(n) { return window.innerWidth; }",
+    Output("graph_width_store", "data"),
+    Input("interval-component", "n_intervals")
+)
+
+# the figures are sent to the stores of the graphs, the browser decodes the typed arrays before plotting them
+for figure_name in FIGURE_NAMES:
+    app.clientside_callback(
+        ClientsideFunction(namespace="typed_arrays", function_name="decode_figure"),
+        Output(figure_name, "figure"),
+        Input(f"{figure_name}_store", "data")
+    )
 
 
 # If possible, expensive initialization (like downloading or querying data) should be done
@@ -732,6 +1106,7 @@ def create_app_layout(df, module_names, all_cell_names, secondary_column_names):
     [Input('date_rangeslider', 'value')],
     [State('date_rangeslider', 'marks')]
 )
+@timings.timed
 def update_rangeslider_marks(vals, marks):
     """
     Update the dateslider marks when selected, to have the correct color and text style
@@ -753,30 +1128,30 @@ def update_rangeslider_marks(vals, marks):
 # Another possibility instead of duplicate Outputs: Updating the Same Output From Different Inputs
 # https://dash.plotly.com/duplicate-callback-outputs
 @app.callback(
-    Output("linefig", "figure"),
-    Output('barfig', 'figure'),
-    Output("cell_line_fig", "figure"),
-    Output("cell_bar_fig", "figure"),
-    Output("delta_fig", "figure"),
+    Output("linefig_store", "data"),
+    Output("barfig_store", "data"),
+    Output("cell_line_fig_store", "data"),
+    Output("cell_bar_fig_store", "data"),
+    Output("delta_fig_store", "data"),
+    Output("cell_heatmap_fig_store", "data"),
     Input("date_rangeslider", "value"),
     State("module-dropdown", "value"),
     State("secondary_y_checkbox", "value"),
     State("secondary_y_dropdown", "value"),
     State("showmarker_checkbox", "value"),
     State("lastxdays_input", "value"),
+    State("graph_width_store", "data"),
+    State("heatmap_mode", "value"),
     prevent_initial_call=True
 )
-def update_figures_timespan(selected_year_range, sel_module_id, checkbox, dropdown_value, marker_checkbox, last_x_days):
+@timings.timed
+def update_figures_timespan(selected_year_range, sel_module_id, checkbox, dropdown_value, marker_checkbox, last_x_days,
+                            graph_width, heatmap_mode):
     # first get the transformed timestamps (as date or rounded to full hour)
 
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    current_df = global_df.loc[data_mask]
-
-    flag, tmp_df, _ = get_df_with_transformed_date_and_rangeslider_marker(current_df)
-    mask = get_df_mask_from_rangeslider(flag, tmp_df, current_df, selected_year_range[0], selected_year_range[1])
-    filtered_df = current_df.loc[mask]
+    # last x days (a view of the data, found by binary search on the sorted timestamps) and the selected time range
+    view, from_val, to_val = get_view(last_x_days, selected_year_range)
+    current_data = view["data"]
 
     show_secondary_axis = False
     use_delta = False
@@ -788,102 +1163,193 @@ def update_figures_timespan(selected_year_range, sel_module_id, checkbox, dropdo
     if 'Use delta value' in checkbox:
         use_delta = True
 
-    # Create new figure return that figure
-    fig = create_fig_graphobject(filtered_df, global_module_names, show_secondary_axis, dropdown_value,
-                                 use_delta, show_marker)
-    #fig.update_layout(legend_title_text="blabla")
-    fig.update_layout(transition_duration=200)
-
-    # Update Avg Bar plot
-    barfig = create_bar_fig(filtered_df, global_module_names)
-    barfig.update_layout(transition_duration=200)
-
-    # Update Cell line and bar figures
-    cell_line, cell_bar = create_mV_plots_per_cell_for_one_module(filtered_df, global_module_names, global_cell_names, sel_module_id)
-    cell_line.update_layout(transition_duration=200)
-    cell_bar.update_layout(transition_duration=200)
-
-    # Update delta fig
-    deltafig = create_delta_overtime_fig(filtered_df, global_module_names, show_secondary_axis, dropdown_value,
-                                         use_delta, show_marker)
-    deltafig.update_layout(transition_duration=200)
-
-    return fig, barfig, cell_line, cell_bar, deltafig
+    # Create new figures (or get them from the figure cache) and return them
+    return get_figures(FIGURE_NAMES, current_data, from_val, to_val, graph_width, sel_module_id, show_secondary_axis,
+                       dropdown_value, use_delta, show_marker, heatmap_mode != HEATMAP_MODES[0])
 
 
 @app.callback(
-    Output("cell_line_fig", "figure", allow_duplicate=True),
-    Output("cell_bar_fig", "figure", allow_duplicate=True),
+    Output("cell_line_fig_store", "data", allow_duplicate=True),
+    Output("cell_bar_fig_store", "data", allow_duplicate=True),
     Input("module-dropdown", "value"),
     State("date_rangeslider", "value"),
     State("lastxdays_input", "value"),
+    State("graph_width_store", "data"),
     prevent_initial_call=True
 )
-def update_cell_figures(sel_module_id, selected_year_range, last_x_days):
+@timings.timed
+def update_cell_figures(sel_module_id, selected_year_range, last_x_days, graph_width):
     # year_range is a list with two numbers left and right value
     # first get the timestamps as date (without time) as tempdf
     # first get the transformed timestamps (as date or rounded to full hour)
 
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    current_df = global_df.loc[data_mask]
-
-    flag, tmp_df, _ = get_df_with_transformed_date_and_rangeslider_marker(current_df)
-    mask = get_df_mask_from_rangeslider(flag, tmp_df, current_df, selected_year_range[0], selected_year_range[1])
-    filtered_df = current_df.loc[mask]
+    # last x days (a view of the data, found by binary search on the sorted timestamps) and the selected time range
+    view, from_val, to_val = get_view(last_x_days, selected_year_range)
+    current_data = view["data"]
 
     # Update Cell line and bar figures
-    cell_line, cell_bar = create_mV_plots_per_cell_for_one_module(filtered_df, global_module_names, global_cell_names,
-                                                                  sel_module_id)
-    cell_line.update_layout(transition_duration=200)
-    cell_bar.update_layout(transition_duration=200)
+    return get_figures(["cell_line_fig", "cell_bar_fig"], current_data, from_val, to_val, graph_width, sel_module_id)
 
-    return cell_line, cell_bar
+
+# the line-marker is switched in the browser (mode of every trace), the data is not sent again
+app.clientside_callback(
+    """
+    function(marker_checkbox, linefig, delta_fig) {
+        const mode = marker_checkbox.includes("Show line-marker") ? "lines+markers" : "lines";
+        const set_mode = fig => Object.assign({}, fig, {data: fig.data.map(trace => Object.assign({}, trace, {mode: mode}))});
+        return [set_mode(linefig), set_mode(delta_fig)];
+    }
+    """,
+    Output("linefig_store", "data", allow_duplicate=True),
+    Output("delta_fig_store", "data", allow_duplicate=True),
+    Input("showmarker_checkbox", "value"),
+    State("linefig_store", "data"),
+    State("delta_fig_store", "data"),
+    prevent_initial_call=True
+)
 
 
 @app.callback(
-    Output("linefig", "figure", allow_duplicate=True),
-    Output("delta_fig", "figure", allow_duplicate=True),
+    Output("linefig_store", "data", allow_duplicate=True),
+    Output("delta_fig_store", "data", allow_duplicate=True),
+    Output("secondary_trace_store", "data"),
     Input("secondary_y_checkbox", "value"),
     Input("secondary_y_dropdown", "value"),
-    Input("showmarker_checkbox", "value"),
+    State("showmarker_checkbox", "value"),
     State("date_rangeslider", "value"),
     State("lastxdays_input","value"),
+    State("graph_width_store", "data"),
+    State("secondary_trace_store", "data"),
     prevent_initial_call=True
 )
-def update_secondary_axis_in_lineplot(checkbox, dropdown_value, marker_checkbox, selected_year_range, last_x_days):
-    # year_range is a list with two numbers left and right value
-    # first get the timestamps as date (without time) as tempdf
-    # first get the transformed timestamps (as date or rounded to full hour)
+@timings.timed
+def update_secondary_axis_in_lineplot(checkbox, dropdown_value, marker_checkbox, selected_year_range, last_x_days,
+                                      graph_width, secondary_trace):
+    """
+    Only the changed parts of the figures are sent (Patch): the visibility of the secondary trace and axis, and the
+    values of the secondary trace if another column or the delta value was selected.
+    """
+    show_secondary_axis = 'Show secondary y-axis' in checkbox
+    use_delta = 'Use delta value' in checkbox
+    show_marker = "Show line-marker" in marker_checkbox
+
+    # last x days (a view of the data, found by binary search on the sorted timestamps) and the selected time range
+    view, from_val, to_val = get_view(last_x_days, selected_year_range)
+    current_data = view["data"]
+
+    if secondary_trace[0] is None or dropdown_value not in current_data.df.columns:
+        # the figures have no secondary trace (yet), build them again
+        figs = get_figures(["linefig", "delta_fig"], current_data, from_val, to_val, graph_width, 0,
+                           show_secondary_axis, dropdown_value, use_delta, show_marker)
+        has_secondary_trace = dropdown_value in current_data.df.columns
+        return figs + [[dropdown_value if has_secondary_trace else None, use_delta]]
+
+    # the secondary trace is the last trace: after the module traces in the line fig, after the delta in the delta fig
+    patched_figures = [Patch(), Patch()]
+    for patched_figure, trace_index in zip(patched_figures, [len(global_module_names), 1]):
+        set_secondary_axis_visible(patched_figure, trace_index, show_secondary_axis)
+    if secondary_trace != [dropdown_value, use_delta]:
+        trace = create_secondary_trace(get_plot_df(current_data, from_val, to_val, graph_width), dropdown_value,
+                                       use_delta, "lines+markers" if show_marker else "lines")
+        for patched_figure, trace_index in zip(patched_figures, [len(global_module_names), 1]):
+            for prop in ("x", "y"):
+                patched_figure["data"][trace_index][prop] = browser_values(trace[prop])
+            for prop in ("name", "hovertemplate"):
+                patched_figure["data"][trace_index][prop] = trace[prop]
+            patched_figure["layout"]["yaxis2"]["title"]["text"] = dropdown_value
+    return patched_figures + [[dropdown_value, use_delta]]
+
 
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    current_df = global_df.loc[data_mask]
+@app.callback(
+    Output("linefig_store", "data", allow_duplicate=True),
+    Input("linefig", "relayoutData"),
+    State("date_rangeslider", "value"),
+    State("lastxdays_input", "value"),
+    State("secondary_y_checkbox", "value"),
+    State("secondary_y_dropdown", "value"),
+    State("showmarker_checkbox", "value"),
+    State("graph_width_store", "data"),
+    prevent_initial_call=True
+)
+@timings.timed
+def zoom_linefig(relayout_data, selected_year_range, last_x_days, checkbox, dropdown_value, marker_checkbox,
+                 graph_width):
+    # downsample the visible range again after zooming
+    current_data, from_val, to_val = get_zoomed_time_range(relayout_data, selected_year_range, last_x_days)
+    [fig] = get_figures(["linefig"], current_data, from_val, to_val, graph_width, 0, 'Show secondary y-axis' in checkbox,
+                        dropdown_value, 'Use delta value' in checkbox, "Show line-marker" in marker_checkbox)
+    return patch_trace_data(fig)
 
-    flag, tmp_df, _ = get_df_with_transformed_date_and_rangeslider_marker(current_df)
-    mask = get_df_mask_from_rangeslider(flag, tmp_df, current_df, selected_year_range[0], selected_year_range[1])
-    filtered_df = current_df.loc[mask]
 
-    show_secondary_axis = False
-    use_delta = False
-    show_marker = False
-    if "Show line-marker" in marker_checkbox:
-        show_marker = True
-    if 'Show secondary y-axis' in checkbox:
-        show_secondary_axis = True
-    if 'Use delta value' in checkbox:
-        use_delta = True
+@app.callback(
+    Output("delta_fig_store", "data", allow_duplicate=True),
+    Input("delta_fig", "relayoutData"),
+    State("date_rangeslider", "value"),
+    State("lastxdays_input", "value"),
+    State("secondary_y_checkbox", "value"),
+    State("secondary_y_dropdown", "value"),
+    State("showmarker_checkbox", "value"),
+    State("graph_width_store", "data"),
+    prevent_initial_call=True
+)
+@timings.timed
+def zoom_delta_fig(relayout_data, selected_year_range, last_x_days, checkbox, dropdown_value, marker_checkbox,
+                   graph_width):
+    current_data, from_val, to_val = get_zoomed_time_range(relayout_data, selected_year_range, last_x_days)
+    [fig] = get_figures(["delta_fig"], current_data, from_val, to_val, graph_width, 0, 'Show secondary y-axis' in checkbox,
+                        dropdown_value, 'Use delta value' in checkbox, "Show line-marker" in marker_checkbox)
+    return patch_trace_data(fig)
 
-    fig = create_fig_graphobject(filtered_df, global_module_names, show_secondary_axis, dropdown_value, use_delta,
-                                 show_marker)
 
-    # Update delta fig
-    deltafig = create_delta_overtime_fig(filtered_df, global_module_names, show_secondary_axis, dropdown_value,
-                                         use_delta, show_marker)
+@app.callback(
+    Output("cell_line_fig_store", "data", allow_duplicate=True),
+    Input("cell_line_fig", "relayoutData"),
+    State("date_rangeslider", "value"),
+    State("lastxdays_input", "value"),
+    State("module-dropdown", "value"),
+    State("graph_width_store", "data"),
+    prevent_initial_call=True
+)
+@timings.timed
+def zoom_cell_line_fig(relayout_data, selected_year_range, last_x_days, sel_module_id, graph_width):
+    current_data, from_val, to_val = get_zoomed_time_range(relayout_data, selected_year_range, last_x_days)
+    [cell_line] = get_figures(["cell_line_fig"], current_data, from_val, to_val, graph_width, sel_module_id)
+    return patch_trace_data(cell_line)
 
-    return fig, deltafig
+
+@app.callback(
+    Output("cell_heatmap_fig_store", "data", allow_duplicate=True),
+    Input("heatmap_mode", "value"),
+    State("date_rangeslider", "value"),
+    State("lastxdays_input", "value"),
+    State("graph_width_store", "data"),
+    prevent_initial_call=True
+)
+@timings.timed
+def update_cell_heatmap(heatmap_mode, selected_year_range, last_x_days, graph_width):
+    # the other mode has another color scale and colorbar, the whole figure is sent
+    view, from_val, to_val = get_view(last_x_days, selected_year_range)
+    [cell_heatmap] = get_figures(["cell_heatmap_fig"], view["data"], from_val, to_val, graph_width,
+                                 heatmap_deviation=heatmap_mode != HEATMAP_MODES[0])
+    return cell_heatmap
+
+
+@app.callback(
+    Output("cell_heatmap_fig_store", "data", allow_duplicate=True),
+    Input("cell_heatmap_fig", "relayoutData"),
+    State("date_rangeslider", "value"),
+    State("lastxdays_input", "value"),
+    State("heatmap_mode", "value"),
+    State("graph_width_store", "data"),
+    prevent_initial_call=True
+)
+@timings.timed
+def zoom_cell_heatmap(relayout_data, selected_year_range, last_x_days, heatmap_mode, graph_width):
+    # the visible range is binned again into the same number of buckets
+    current_data, from_val, to_val = get_zoomed_time_range(relayout_data, selected_year_range, last_x_days)
+    [cell_heatmap] = get_figures(["cell_heatmap_fig"], current_data, from_val, to_val, graph_width,
+                                 heatmap_deviation=heatmap_mode != HEATMAP_MODES[0])
+    return patch_trace_data(cell_heatmap, ("x", "z"))
 
 
 @app.callback(
@@ -892,12 +1358,14 @@ def update_secondary_axis_in_lineplot(checkbox, dropdown_value, marker_checkbox,
     Output('date_rangeslider', 'value'),
     Output('date_rangeslider', 'marks', allow_duplicate=True),
     Input("interval-component", "n_intervals"),
-    State("lastxdays_input","value")
+    Input("lastxdays_input", "value")
 )
-def interval_adjust_rangeslider(n, last_x_days):
+@timings.timed
+def update_rangeslider(n, last_x_days):
     """
-    Update the rangeslider with possibly new data
-    This is then the input for the refresh_all_graphs_on_interval.
+    Update the rangeslider with possibly new data (interval) or for another number of days.
+    The new value of the rangeslider updates the figures (update_figures_timespan), so every interval or change of
+    the days builds the figures once.
     :return:
     :rtype:
     """
@@ -906,139 +1374,165 @@ def interval_adjust_rangeslider(n, last_x_days):
     # todo maybe use a filesystem cache and a dc.store element as input for df in every callback, as alternative
     # https://dash.plotly.com/sharing-data-between-callbacks
     global global_df
-    # read data again (to update for newly collected data)
-    global_df = read_data_as_df(filename)
-    # adjust to last x days
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    global_df = global_df.loc[data_mask]
-
-    _, tmp_df, marker = get_df_with_transformed_date_and_rangeslider_marker(global_df)
-    logging.debug(f"load csv again, refresh interval {n}: unique times {len(tmp_df[timecolumn].unique())}")
-
-    numdate = [x for x in range(len(tmp_df[timecolumn].unique()))]
-    new_min = numdate[0]
-    new_max = numdate[-1]
+    if dash.ctx.triggered_id != "lastxdays_input":
+        # read data again (to update for newly collected data)
+        refresh_data()
+        # adjust to last x days
+        global_df = global_data.last_days(last_x_days)
+
+    view, _, _ = get_view(last_x_days)
+    logging.debug(f"rangeslider for {last_x_days} days, refresh interval {n}: {len(view['slider'])} {view['slider'].granularity} steps")
+
+    new_min = 0
+    new_max = len(view["slider"]) - 1
     value = [new_min, new_max]
 
-    return new_min, new_max, value, marker
+    return new_min, new_max, value, view["marker"]
 
 
-@app.callback(
-    Output('date_rangeslider', 'min', allow_duplicate=True),
-    Output('date_rangeslider', 'max', allow_duplicate=True),
-    Output('date_rangeslider', 'value', allow_duplicate=True),
-    Output('date_rangeslider', 'marks', allow_duplicate=True),
-    Input("lastxdays_input", "value")
-)
-def lastxdays_adjust_rangeslider2(last_x_days):
+@app.server.route("/debug/figure_cache")
+def figure_cache_stats():
+    # hits and misses of the figure cache of this process (gunicorn worker)
+    return flask.jsonify(figure_cache.stats())
 
-    # adjust to last x days
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    current_df = global_df.loc[data_mask]
 
-    _, tmp_df, marker = get_df_with_transformed_date_and_rangeslider_marker(current_df)
+@app.server.after_request
+def count_payload(response):
+    # bytes of every callback response (uncompressed), by the outputs of the callback (from the request), and the
+    # time since the callback returned (dash serializing the outputs) by the callback that ran for this request
+    if response.direct_passthrough:
+        return response
+    size = response.calculate_content_length() or 0
+    if flask.request.path.endswith("/_dash-update-component"):
+        request_data = flask.request.get_json(silent=True) or {}
+        payload_stats.add_response(str(request_data.get("output")), size)
+        callback_name, callback_end = timings.finished_callback()
+        if callback_name is not None:
+            timings.add_response(callback_name, time.perf_counter() - callback_end, size)
+    elif flask.request.path.endswith("/_dash-layout"):
+        payload_stats.add_response("layout", size)
+    return response
 
-    numdate = [x for x in range(len(tmp_df[timecolumn].unique()))]
-    new_min = numdate[0]
-    new_max = numdate[-1]
-    value = [new_min, new_max]
 
-    return new_min, new_max, value, marker
+@app.server.teardown_request
+def end_request_timings(error):
+    # also after errors and responses without a callback, so the next request of the thread starts without a callback
+    timings.end_request()
 
 
-def test():
-    print(global_df)
+def update_timings_panel(n_clicks, n):
+    return format_table(timings.stats())
 
-@app.callback(
-    Output("linefig", "figure", allow_duplicate=True),
-    Output('barfig', 'figure', allow_duplicate=True),
-    Output("cell_line_fig", "figure", allow_duplicate=True),
-    Output("cell_bar_fig", "figure", allow_duplicate=True),
-    Output("delta_fig", "figure", allow_duplicate=True),
-    Input('date_rangeslider', 'marks'),
-    Input("lastxdays_input", "value"),
-    State("date_rangeslider", "value"),
-    State("secondary_y_checkbox", "value"),
-    State("secondary_y_dropdown", "value"),
-    State("showmarker_checkbox", "value"),
-    State("module-dropdown", "value"),
-    prevent_initial_call=True
-)
-def refresh_all_graphs_on_interval(_, last_x_days, selected_year_range, checkbox, dropdown_value, marker_checkbox, sel_module_id, ):
-    logging.debug(f"refresh all graphs interval")
 
-    to_val = global_df[timecolumn].max()  # last date
-    from_val = to_val - pd.Timedelta(days=last_x_days)
-    data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-    current_df = global_df.loc[data_mask]
+if TIMINGS_PANEL:
+    # the panel only exists in the layout if it is enabled
+    app.callback(
+        Output("timings_panel", "children"),
+        Input("timings_refresh_button", "n_clicks"),
+        Input("interval-component", "n_intervals")
+    )(update_timings_panel)
 
-    # first get the transformed timestamps (as date or rounded to full hour)
-    flag, tmp_df, _ = get_df_with_transformed_date_and_rangeslider_marker(current_df)
-    mask = get_df_mask_from_rangeslider(flag, tmp_df, current_df, selected_year_range[0], selected_year_range[1])
-    filtered_df = current_df.loc[mask]
 
-    # Update the graphs
-    show_secondary_axis = False
-    use_delta = False
-    show_marker = False
-    if "Show line-marker" in marker_checkbox:
-        show_marker = True
-    if 'Show secondary y-axis' in checkbox:
-        show_secondary_axis = True
-    if 'Use delta value' in checkbox:
-        use_delta = True
+@app.server.route("/debug/timings")
+def timings_route():
+    # ms per callback and stage of this process (gunicorn worker), as text table with ?format=text
+    if flask.request.args.get("format") == "text":
+        return flask.Response(format_table(timings.stats()), mimetype="text/plain")
+    return flask.jsonify(timings.stats())
 
-    # Create new figure return that figure
-    fig = create_fig_graphobject(filtered_df, global_module_names, show_secondary_axis, dropdown_value,
-                                 use_delta, show_marker)
 
-    # Update Avg Bar plot
-    barfig = create_bar_fig(filtered_df, global_module_names)
+@app.server.route("/debug/payload")
+def payload_stats_route():
+    # bytes sent to the browser by this process (gunicorn worker) per callback, and per trace if RENDER_MODE is "webgl"
+    return flask.jsonify(payload_stats.stats())
 
-    # Update Cell line and bar figures
-    cell_line, cell_bar = create_mV_plots_per_cell_for_one_module(filtered_df, global_module_names, global_cell_names, sel_module_id)
 
-    # Update delta fig
-    deltafig = create_delta_overtime_fig(filtered_df, global_module_names, show_secondary_axis, dropdown_value,
-                                         use_delta, show_marker)
+def load_data():
+    """
+    Read the data and set the global variables used by the layout and the callbacks.
+    """
+    global global_data, global_data_source, global_df, global_module_names, global_cell_names, \
+        global_secondary_column_names
+    with timings.stage("load"):
+        source = read_data_as_df(filename)
+        data = TimeIndexedFrame(source, timecolumn)
+    with timings.stage("transform"):
+        global_rollups.update(data)
+    df = data.last_days(14)
+    module_names, cell_names = get_cell_and_module_names(df)
+    all_cell_names = [name for module_cells in cell_names for name in module_cells]
+
+    global_secondary_column_names = [x for x in df.columns if
+                                     x not in all_cell_names + module_names + [timecolumn] and x[:6] != "Module"]
+    global_df = df  # to have a global reference to use in callbacks (only the last 14 days)
+    global_module_names = module_names
+    global_cell_names = cell_names
+    global_data, global_data_source = data, source
+    figure_cache.set_version(get_data_version())
+    import plotly.express  # noqa: F401, imported here so the first layout with the data doesn't wait for it
+    data_loaded.set()
+    logging.info(f"data loaded: {len(data)} rows")
+
+
+def refresh_data() -> bool:
+    """
+    Read the data again and update global_data, the rollup tiers and the version of the figure cache if there are
+    new rows (or the data was replaced).
+    :return: True if the data changed
+    """
+    global global_data, global_data_source
+    with refresh_lock:
+        with timings.stage("load"):
+            df = read_data_as_df(filename)
+        if df is global_data_source:
+            return False
+        with timings.stage("transform"):
+            data = TimeIndexedFrame(df, timecolumn)
+            global_rollups.update(data)  # only the new rows are added
+        global_data, global_data_source = data, df
+        figure_cache.set_version(get_data_version())  # the cached figures are from the older data
+        logging.debug(f"data refreshed: {len(data)} rows, figure cache: {figure_cache.stats()}")
+        return True
+
+
+def refresh_data_periodically():
+    while True:
+        time.sleep(DATA_REFRESH_INTERVAL)
+        try:
+            refresh_data()
+        except Exception:
+            logging.exception(f"refreshing the data failed, trying again in {DATA_REFRESH_INTERVAL} s")
 
-    return fig, barfig, cell_line, cell_bar, deltafig
 
+def wait_and_load_data():
+    """
+    Wait for the data file (the data collection creates it) and load it. Errors are retried, the server keeps
+    showing the loading message.
+    """
+    warned = False
+    while not data_loaded.is_set():
+        if not data_exists(filename):
+            if not warned:
+                logging.warning(f"CSV TO READ DOESNT EXIST! checking again every {DATA_WAIT_INTERVAL} s...")
+                warned = True
+            time.sleep(DATA_WAIT_INTERVAL)
+            continue
+        try:
+            load_data()
+        except Exception:
+            logging.exception(f"loading the data failed, trying again in {DATA_WAIT_INTERVAL} s")
+            time.sleep(DATA_WAIT_INTERVAL)
+    threading.Thread(target=refresh_data_periodically, name="data_refresh", daemon=True).start()
 
-# MAIN CODE THAT SHOULD ALSO RUN WHEN IMPORTING THE SCRIPT (into wsgi.py)
-print("Checking for file...")
-logging.info("Checking for file...")
-# waiting for the file to generate if its not there already
-if not os.path.exists(os.path.join(os.path.join(os.getcwd(), "data"), filename)):
-    print("CSV TO READ DOESNT EXIST! Waiting...")
-    logging.warning("CSV TO READ DOESNT EXIST! sleeping 3 min...")
-    time.sleep(180)  # wait 2 minutes
-print("done checking")
-logging.info("done checking")
-
-df = read_data_as_df(filename)
-cell_values, cell_names = get_list_of_cell_voltage_values(df)
-avg_module_values, module_names = get_list_of_avg_module_voltage_values(cell_values)
-
-global_secondary_column_names = [x for x in df.columns if
-                                 x not in cell_names + module_names + [timecolumn] and x[:6] != "Module"]
-global_df = df  # to have a global reference to use in callbacks
-# Mask to get only last 14 days
-to_val = global_df[timecolumn].max()  # last date
-from_val = to_val - pd.Timedelta(days=14)
-
-data_mask = (global_df[timecolumn] >= from_val) & (global_df[timecolumn] <= to_val)
-global_df = global_df.loc[data_mask]
-
-global_module_names = module_names
-global_cell_names = cell_names
 
+# MAIN CODE THAT SHOULD ALSO RUN WHEN IMPORTING THE SCRIPT (into wsgi.py)
 #create_app_layout(global_df, global_module_names, global_cell_names, global_secondary_column_names)
 app.layout = serve_layout
+if LOAD_IN_BACKGROUND:
+    # the server (gunicorn worker) starts at once, the layout shows "loading" until the data is there
+    threading.Thread(target=wait_and_load_data, name="data_loader", daemon=True).start()
+else:
+    wait_and_load_data()
 
 #  __main__ means the script is executed directly and not imported
 if __name__ == "__main__":
@@ -1046,7 +1540,6 @@ if __name__ == "__main__":
     #print(np.corrcoef(global_df["Ladezustand [%]"].tolist(), global_df["Netzbezug Energie [Wh]"].diff().fillna(0).tolist()))
     #print(np.corrcoef(global_df["Ladezustand [%]"].tolist(), global_df["Netzeinspeisung Energie [Wh]"].diff().fillna(0).tolist()))
 
-    print("main running")
     logging.info("main running")
 
     app.run_server(debug=True, port=8050, dev_tools_hot_reload=True)
@@ -0,0 +1,107 @@
+# Reading the day partitioned parquet archive written by data_logging_scripts/data_writers.py
+# (ParquetArchiveWriter). The archive is only read here, the format is described in the writer.
+
+import os
+import json
+import logging
+
+import pandas as pd
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_MANIFEST = "manifest.json"
+
+
+def archive_exists(data_dir: str) -> bool:
+    return os.path.exists(os.path.join(data_dir, ARCHIVE_DIR, ARCHIVE_MANIFEST))
+
+
+def load_manifest(data_dir: str) -> dict:
+    with open(os.path.join(data_dir, ARCHIVE_DIR, ARCHIVE_MANIFEST), "r") as f:
+        return json.loads(f.read())
+
+
+def _window(manifest: dict, last_x_days: float = None) -> tuple:
+    # the partitions (day, partition) with rows of the last x days, and the first time of the last x days (us)
+    partitions = sorted(manifest["partitions"].items())
+    if last_x_days is None or not partitions:
+        return partitions, None
+    to_ts = max(p["max_ts"] for _, p in partitions)
+    from_ts = to_ts - int(pd.Timedelta(days=last_x_days) / pd.Timedelta(microseconds=1))
+    return [(day, p) for day, p in partitions if p["max_ts"] >= from_ts], from_ts
+
+
+def archive_window_start(data_dir: str, last_x_days: float) -> pd.Timestamp:
+    """
+    The time of the first row read_archive(data_dir, last_x_days, whole_days=True) returns.
+    :return: the time, None if the archive is empty
+    """
+    partitions, _ = _window(load_manifest(data_dir), last_x_days)
+    if not partitions:
+        return None
+    return pd.Timestamp(min(p["min_ts"] for _, p in partitions), unit="us")
+
+
+def read_archive(data_dir: str, last_x_days: float = None, columns: list = None,
+                 whole_days: bool = False, after: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    Read the archive as dataframe, only opening the partitions (days) and columns that are needed.
+    :param data_dir: the data directory containing the archive directory
+    :param last_x_days: only return the rows of the last x days (relative to the newest row), None for all rows
+    :param columns: the columns to read (the timestamp column is always read), None for all columns
+    :param whole_days: return every row of the first day too, so the first row only changes when the next day
+        starts instead of with every new row
+    :param after: only return the rows after this time (i.e. the rows added since the last read), None for all rows
+    :return: dataframe with the timestamp column as datetime, sorted by time
+    """
+    try:
+        return _read_archive(data_dir, last_x_days, columns, whole_days, after)
+    except FileNotFoundError as e:
+        # the collector may have compacted a day between reading the manifest and the files
+        logging.debug(f"archive changed while reading ({e}), reading again")
+        return _read_archive(data_dir, last_x_days, columns, whole_days, after)
+
+
+def concat_tables(tables: list):
+    # parts written before new columns were added have less columns (same as in the writer, the dashboard image
+    # doesn't contain the data collection)
+    import pyarrow as pa
+    try:
+        return pa.concat_tables(tables, promote_options="default")
+    except TypeError:
+        return pa.concat_tables(tables, promote=True)  # pyarrow < 14
+
+
+def _read_archive(data_dir: str, last_x_days: float = None, columns: list = None,
+                  whole_days: bool = False, after: pd.Timestamp = None) -> pd.DataFrame:
+    import pyarrow.parquet as pq
+
+    manifest = load_manifest(data_dir)
+    timecolumn = manifest["timestamp_column"]
+    partitions, from_ts = _window(manifest, last_x_days)
+    if after is not None:
+        after_ts = int((pd.Timestamp(after) - pd.Timestamp(0)) / pd.Timedelta(microseconds=1))
+        partitions = [(day, p) for day, p in partitions if p["max_ts"] > after_ts]
+
+    if columns is not None:
+        columns = [timecolumn] + [c for c in columns if c != timecolumn]
+
+    tables = []
+    for _, partition in partitions:
+        for file in partition["files"]:
+            path = os.path.join(data_dir, ARCHIVE_DIR, file)
+            file_columns = None
+            if columns is not None:
+                # older files may not contain every column
+                names = pq.ParquetFile(path).schema_arrow.names
+                file_columns = [c for c in columns if c in names]
+            tables.append(pq.read_table(path, columns=file_columns))
+
+    if not tables:
+        return pd.DataFrame(columns=columns or list(manifest["columns"]))
+    df = concat_tables(tables).to_pandas()
+    df[timecolumn] = pd.to_datetime(df[timecolumn], unit=manifest.get("timestamp_unit", "us"))
+    if from_ts is not None and not whole_days:
+        df = df.loc[df[timecolumn] >= pd.Timestamp(from_ts, unit="us")]
+    if after is not None:
+        df = df.loc[df[timecolumn] > pd.Timestamp(after)]
+    return df.sort_values(timecolumn, kind="stable").reset_index(drop=True)
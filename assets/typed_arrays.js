@@ -0,0 +1,60 @@
+// Decodes the trace values the dashboard sends as base64 encoded typed arrays (RENDER_MODE=webgl, see
+// browser_payload.py) before plotly plots them. The plotly.js of dash 2.9 doesn't know this format yet, so the
+// callbacks send the figures to a store per graph and the clientside callback typed_arrays.decode_figure (see
+// create_graph in app.py) puts the decoded figure into the graph (the figure in the store stays encoded).
+(function () {
+    const TYPES = {f8: Float64Array, f4: Float32Array, i4: Int32Array, i2: Int16Array};
+
+    function decodeValues(values) {
+        if (!values || typeof values !== "object" || typeof values.bdata !== "string" || !TYPES[values.dtype]) {
+            return values;
+        }
+        const binary = atob(values.bdata);
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        const array = new TYPES[values.dtype](bytes.buffer);
+        if (typeof values.shape === "string") {
+            // a matrix (i.e. z of a heatmap) as list of rows
+            const [rows, columns] = values.shape.split(",").map(Number);
+            return Array.from({length: rows}, (_, i) => Array.from(array.subarray(i * columns, (i + 1) * columns)));
+        }
+        return array;
+    }
+
+    function decodeFigure(figure) {
+        if (!figure || !Array.isArray(figure.data)) {
+            return figure;
+        }
+        const data = [];
+        figure.data.forEach(trace => {
+            const decoded = Object.assign({}, trace);
+            ["x", "y", "z"].forEach(prop => {
+                if (!(prop in trace)) {
+                    return;
+                }
+                const values = trace[prop];
+                if (values && typeof values === "object" && "ref" in values) {
+                    // the same values as an earlier trace (sent once)
+                    decoded[prop] = data[values.ref][prop];
+                } else {
+                    decoded[prop] = decodeValues(values);
+                }
+            });
+            data.push(decoded);
+        });
+        return Object.assign({}, figure, {data: data});
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        typed_arrays: {
+            decode_figure: function (figure) {
+                if (!figure) {
+                    return window.dash_clientside.no_update;
+                }
+                return decodeFigure(figure);
+            }
+        }
+    });
+})();
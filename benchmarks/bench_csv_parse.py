@@ -0,0 +1,120 @@
+# Compares the csv parsers of the dashboard on a generated file in the format of the data collection.
+#   python benchmarks/bench_csv_parse.py --rows 100000
+# 100000 rows are about 2 years of data with a sample every 10 minutes.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")))
+from data_loader import IncrementalCsvReader  # noqa: E402
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def create_columns(modules: int, cells: int) -> list:
+    # same columns as written by data_logging_scripts/collectDataVoltageV5.py
+    columns = ["Zeitstempel"] + [f"Sum Channel {i}" for i in range(19)]
+    columns += [f"Voltage Module{m} Cell{c:03d}" for m in range(modules) for c in range(cells)]
+    for m in range(modules):
+        columns += [f"Module{m} Min", f"Module{m} Max", f"Module{m} Delta", f"Module{m} Std",
+                    f"Module{m} ArgMin", f"Module{m} ArgMax"]
+    columns += ["Global Min", "Global Max", "Global Delta"]
+    columns += [f"Module_{m}" for m in range(modules)] + ["Module Avg Delta"]
+    return columns
+
+
+def generate_csv(path: str, rows: int, modules: int = 10, cells: int = 14, chunk: int = 10000):
+    columns = create_columns(modules, cells)
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2022-01-01")
+    with open(path, "w", newline="") as f:
+        f.write(";".join(columns) + "\n")
+        for first in range(0, rows, chunk):
+            n = min(chunk, rows - first)
+            df = pd.DataFrame({"Zeitstempel": (start + pd.to_timedelta(np.arange(first, first + n) * 600, unit="s"))
+                               .strftime(TIME_FORMAT)})
+            sums = rng.integers(0, 100000, size=(n, 19))
+            voltages = rng.integers(3200, 3400, size=(n, modules * cells))
+            matrix = voltages.reshape(n, modules, cells)
+            stats = np.stack([matrix.min(axis=2), matrix.max(axis=2), np.ptp(matrix, axis=2),
+                              matrix.std(axis=2).round(2), matrix.argmin(axis=2), matrix.argmax(axis=2)], axis=2)
+            averages = matrix.mean(axis=2)
+            glob = np.stack([voltages.min(axis=1), voltages.max(axis=1), np.ptp(voltages, axis=1)], axis=1)
+            values = np.hstack([sums, voltages, stats.reshape(n, -1), glob, averages,
+                                np.ptp(averages, axis=1)[:, None]])
+            df = pd.concat([df, pd.DataFrame(values, columns=columns[1:])], axis=1)
+            df.to_csv(f, sep=";", header=False, index=False)
+    return columns
+
+
+def read_legacy(path: str) -> pd.DataFrame:
+    # read_data_as_df before the incremental reader
+    df = pd.read_csv(path, sep=";")
+    df["Zeitstempel"] = pd.to_datetime(df["Zeitstempel"], format=TIME_FORMAT)
+    return df
+
+
+def timed(function, repeat: int):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the csv parsers of the dashboard.")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows of the generated file. Default is 100000")
+    parser.add_argument("--modules", type=int, default=10, help="Modules. Default is 10")
+    parser.add_argument("--cells", type=int, default=14, help="Cells per module. Default is 14")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per parser, the fastest is reported. Default is 3")
+    parser.add_argument("--file", default=None, help="Use (or create) this csv file instead of a temporary file")
+    args = parser.parse_args()
+
+    path = args.file or os.path.join(tempfile.mkdtemp(), "bench_fenecon_voltage_data.csv")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        generate_csv(path, args.rows, args.modules, args.cells)
+        print(f"generated {path} in {time.perf_counter() - start:.1f} s")
+    print(f"file: {os.path.getsize(path) / 1e6:.1f} MB")
+
+    results = {}
+    results["legacy (read_csv + to_datetime)"] = timed(lambda: read_legacy(path), args.repeat)
+    for name in ("pandas", "pyarrow"):
+        results[f"IncrementalCsvReader {name}"] = timed(lambda: IncrementalCsvReader(path, parser=name).read(),
+                                                        args.repeat)
+
+    baseline = results["legacy (read_csv + to_datetime)"][0]
+    print(f"{'parser':<36}{'time [s]':>10}{'speedup':>10}{'memory [MB]':>14}")
+    for name, (seconds, df) in results.items():
+        memory = df.memory_usage(deep=True).sum() / 1e6
+        print(f"{name:<36}{seconds:>10.2f}{baseline / seconds:>10.1f}{memory:>14.1f}")
+
+    # refresh after one appended row: only the new row is parsed
+    reader = IncrementalCsvReader(path, parser="pyarrow")
+    df = reader.read()
+    with open(path, "rb") as f:
+        f.seek(-min(os.path.getsize(path), 1 << 16), os.SEEK_END)
+        last_line = f.read().splitlines(keepends=True)[-1]
+    with open(path, "ab") as f:
+        f.write(last_line)
+    seconds, df = timed(reader.read, 1)
+    print(f"refresh with one new row: {1000 * seconds:.1f} ms ({len(df)} rows)")
+    if args.file is None:
+        os.remove(path)
+    else:
+        # remove the appended row again
+        with open(path, "rb+") as f:
+            f.truncate(os.path.getsize(path) - len(last_line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# Cold start of the dashboard (wsgi.py, as started by gunicorn) and of the data collection, each in a new process:
+#   python benchmarks/bench_startup.py --rows 100000
+# dashboard: import time of wsgi.py, first response (the "loading" layout), the layout with the data, and
+#   which heavy modules were imported at startup. "cold" has no snapshot and shared store yet, "warm" is the restart.
+# collection: import time (until "done importing") and the first row in the csv file, against mock_fems_server.py.
+# A time over its budget (or a heavy module imported at startup) is a regression, the exit code is 1 then.
+# --budget-scale 3 for a slower machine (i.e. raspberry pi).
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import signal
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from bench_csv_parse import generate_csv  # noqa: E402
+
+COLLECTOR_DIR = os.path.join(ROOT, "data_logging_scripts")
+
+# seconds, measured from the start of the process (after the interpreter started)
+BUDGETS = {
+    "dashboard import": 1.5,
+    "dashboard first response": 2.5,
+    "dashboard data layout (cold)": 7.5,
+    "dashboard data layout (warm)": 4.5,
+    "collector import": 1.0,
+    "collector first row": 3.0,
+}
+# not needed until the data is loaded (or not at all), importing them at startup is a regression. The JSON encoding
+# of the first response imports plotly.tools (and IPython if it is installed), that can't be deferred
+LAZY_MODULES = ("matplotlib", "plotly.express")
+
+# runs in the new dashboard process, cwd is the directory with data/fenecon_voltage_data.csv
+DASHBOARD_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, ROOT)
+import wsgi
+imported = time.perf_counter()
+heavy = [name for name in LAZY_MODULES if name in sys.modules]
+client = wsgi.application.test_client()
+client.get("/")
+response = client.get("/_dash-layout")
+first_response = time.perf_counter()
+loading = b"loading_div" in response.data
+sys.modules["app"].data_loaded.wait(600)
+response = client.get("/_dash-layout")
+data_layout = time.perf_counter()
+print(json.dumps({"import": imported - start, "first response": first_response - start,
+                  "data layout": data_layout - start, "status": response.status_code, "loading first": loading,
+                  "heavy modules": heavy}))
+"""
+
+
+def run_dashboard(workdir: str, env: dict) -> dict:
+    script = f"ROOT = {ROOT!r}\nLAZY_MODULES = {LAZY_MODULES!r}\n" + DASHBOARD_SCRIPT
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env, capture_output=True, text=True,
+                            timeout=900)
+    if output.returncode != 0:
+        raise RuntimeError(f"dashboard process failed:\n{output.stderr[-2000:]}")
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listens on port {port}")
+
+
+def run_collector(workdir: str, modules: int, cells: int) -> dict:
+    # copy of the data collection scripts with a config for the mock server
+    scripts = os.path.join(workdir, "collector")
+    shutil.copytree(COLLECTOR_DIR, scripts, ignore=shutil.ignore_patterns("data", "__pycache__", "*.log"))
+    os.makedirs(os.path.join(scripts, "data"))
+    port = free_port()
+    with open(os.path.join(COLLECTOR_DIR, "config.json"), "r") as f:
+        config = json.loads(f.read())
+    config.update({"batteryIP": f"127.0.0.1:{port}", "module_count": modules, "collection_period": 3600,
+                   "output_formats": ["csv"], "metrics_port": 0, "metrics_file": ""})
+    with open(os.path.join(scripts, "config.json"), "w") as f:
+        f.write(json.dumps(config, indent=2))
+
+    server = subprocess.Popen([sys.executable, "mock_fems_server.py", "--port", str(port), "--modules", str(modules),
+                               "--cells", str(cells)], cwd=scripts, stdout=subprocess.DEVNULL)
+    collector = None
+    try:
+        wait_for_port(port)
+        csv_path = os.path.join(scripts, "data", "fenecon_voltage_data.csv")
+        start = time.perf_counter()
+        collector = subprocess.Popen([sys.executable, "-u", "collectDataVoltageV5.py"], cwd=scripts,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        imported = None
+        for line in collector.stdout:
+            if "done importing" in line:
+                imported = time.perf_counter() - start
+                break
+        if imported is None:
+            raise RuntimeError(f"data collection stopped with exit code {collector.wait()}")
+        while True:
+            # the header and one row
+            if os.path.exists(csv_path):
+                with open(csv_path, "rb") as f:
+                    if f.read().count(b"\n") >= 2:
+                        break
+            if collector.poll() is not None:
+                raise RuntimeError(f"data collection stopped with exit code {collector.returncode}")
+            if time.perf_counter() - start > 120:
+                raise RuntimeError("no row written after 120 s")
+            time.sleep(0.01)
+        first_row = time.perf_counter() - start
+        return {"import": imported, "first row": first_row}
+    finally:
+        if collector is not None:
+            collector.send_signal(signal.SIGTERM)
+            try:
+                collector.wait(10)
+            except subprocess.TimeoutExpired:
+                collector.kill()
+        server.terminate()
+        server.wait()
+
+
+def check(name: str, seconds: float, scale: float, failures: list):
+    budget = BUDGETS[name] * scale
+    over = seconds > budget
+    if over:
+        failures.append(f"{name}: {seconds:.2f} s > {budget:.2f} s")
+    print(f"{name:<32}{seconds:>10.2f}{budget:>12.2f}{'  OVER BUDGET' if over else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of the dashboard and the data collection.")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows of the generated file. Default is 100000")
+    parser.add_argument("--modules", type=int, default=10, help="Modules. Default is 10")
+    parser.add_argument("--cells", type=int, default=14, help="Cells per module. Default is 14")
+    parser.add_argument("--repeat", type=int, default=3, help="Warm restarts, the fastest is reported. Default is 3")
+    parser.add_argument("--budget-scale", type=float, default=1.0,
+                        help="Multiply the budgets, i.e. 3 for a raspberry pi. Default is 1")
+    parser.add_argument("--skip-collector", action="store_true", help="Only benchmark the dashboard")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    failures = []
+    try:
+        os.makedirs(os.path.join(workdir, "data"))
+        start = time.perf_counter()
+        generate_csv(os.path.join(workdir, "data", "fenecon_voltage_data.csv"), args.rows, args.modules, args.cells)
+        print(f"generated {args.rows} rows in {time.perf_counter() - start:.1f} s")
+
+        env = dict(os.environ, LOAD_IN_BACKGROUND="1")
+        cold = run_dashboard(workdir, env)
+        warm = min((run_dashboard(workdir, env) for _ in range(args.repeat)), key=lambda r: r["data layout"])
+
+        print(f"{'':<32}{'time [s]':>10}{'budget [s]':>12}")
+        check("dashboard import", min(cold["import"], warm["import"]), args.budget_scale, failures)
+        check("dashboard first response", min(cold["first response"], warm["first response"]), args.budget_scale,
+              failures)
+        check("dashboard data layout (cold)", cold["data layout"], args.budget_scale, failures)
+        check("dashboard data layout (warm)", warm["data layout"], args.budget_scale, failures)
+        print(f"dashboard process (cold / warm): {cold['process']:.2f} s / {warm['process']:.2f} s "
+              f"(with interpreter start and exit)")
+        for result in (cold, warm):
+            if result["status"] != 200:
+                failures.append(f"dashboard: layout with the data failed ({result['status']})")
+        # a small file can be loaded before the first response, then there is no loading message
+        print(f"first response was the loading message (cold / warm): {cold['loading first']} / {warm['loading first']}")
+        heavy = sorted(set(cold["heavy modules"] + warm["heavy modules"]))
+        if heavy:
+            failures.append(f"imported at startup: {', '.join(heavy)}")
+        print(f"heavy modules imported at startup: {', '.join(heavy) or 'none'}")
+
+        if not args.skip_collector:
+            collector = run_collector(workdir, args.modules, args.cells)
+            check("collector import", collector["import"], args.budget_scale, failures)
+            check("collector first row", collector["first row"], args.budget_scale, failures)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print("\nregressions:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nall within budget")
+
+
+if __name__ == "__main__":
+    main()
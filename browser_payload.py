@@ -0,0 +1,113 @@
+# What the dashboard sends to the browser: the values of the traces as base64 encoded typed arrays (instead of JSON
+# lists of float64 numbers and date strings), and the bytes sent per callback.
+# The browser decodes the arrays in assets/typed_arrays.js before plotting (same format as plotly.js >= 2.28,
+# {"dtype": "f4", "bdata": "...", "shape": "rows,columns" for a matrix like the z values of a heatmap}, plus
+# {"ref": i} for the values of trace i if traces have the same x values).
+
+import base64
+import threading
+
+import numpy as np
+
+INTEGER_TYPES = ("i2", "i4")  # smallest first
+
+
+def encode_values(values):
+    """
+    Numbers as base64 encoded little endian typed array: int16 or int32 if all values are whole numbers in its range
+    (i.e. mV or energy counters in Wh), float32 otherwise. Datetimes (naive) as float64 milliseconds since 1970,
+    which plotly shows as the same date on a date axis. Other values (i.e. names of a bar chart) are not changed.
+    A matrix (2 dimensions) is sent row by row with its shape.
+    :return: dict with dtype and bdata (and shape), or the values
+    """
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        array = array.astype("datetime64[ns]").view(np.int64) / 1e6
+        dtype = "f8"
+    elif np.issubdtype(array.dtype, np.number) and not np.issubdtype(array.dtype, np.complexfloating):
+        if np.issubdtype(array.dtype, np.integer):
+            whole = True
+        else:
+            with np.errstate(invalid="ignore"):
+                whole = bool(np.all(np.isfinite(array)) and np.all(array == np.round(array)))
+        dtype = "f4"  # mV and percent need less than the 7 digits of float32
+        if whole and len(array):
+            low, high = array.min(), array.max()
+            dtype = next((t for t in INTEGER_TYPES if np.iinfo(t).min <= low and high <= np.iinfo(t).max), "f8")
+    else:
+        return values
+    encoded = {"dtype": dtype, "bdata": base64.b64encode(array.astype("<" + dtype).tobytes()).decode("ascii")}
+    if array.ndim == 2:
+        encoded["shape"] = f"{array.shape[0]},{array.shape[1]}"
+    return encoded
+
+
+def encode_traces(traces: list, props=("x", "y", "z")) -> list:
+    """
+    Encode the values of the traces (dicts). The x values are only sent once if traces have the same x values,
+    the others refer to the trace with them.
+    :return: list with a copy of every trace
+    """
+    encoded = []
+    shared_x = []  # (x values, index of the trace that has them)
+    for i, trace in enumerate(traces):
+        trace = dict(trace)
+        for prop in props:
+            if trace.get(prop) is None:
+                continue
+            values = np.asarray(trace[prop])
+            if prop == "x":
+                same = [index for x, index in shared_x if len(x) == len(values) and np.array_equal(x, values)]
+                if same:
+                    trace[prop] = {"ref": same[0]}
+                    continue
+                shared_x.append((values, i))
+            trace[prop] = encode_values(values)
+        encoded.append(trace)
+    return encoded
+
+
+def encode_figure(fig) -> dict:
+    """
+    The figure as dict with encoded trace values (see encode_traces).
+    """
+    fig_dict = fig.to_plotly_json()
+    fig_dict["data"] = encode_traces(fig_dict["data"])
+    if any(isinstance(trace.get("x"), dict) and trace["x"].get("dtype") == "f8" for trace in fig_dict["data"]):
+        # numbers are shown as numbers, unless the axis is known to be a date axis
+        fig_dict["layout"].setdefault("xaxis", {})["type"] = "date"
+    return fig_dict
+
+
+class PayloadStats:
+    """
+    Bytes sent per callback (outputs of the callback) and per trace (encoded values, by figure and trace name).
+    """
+
+    def __init__(self):
+        self.callbacks = {}  # outputs -> {"calls", "bytes", "last", "max"}
+        self.traces = {}  # figure name -> trace name -> bytes of the last encoding
+        self.lock = threading.Lock()
+
+    def add_response(self, outputs: str, nbytes: int):
+        with self.lock:
+            entry = self.callbacks.setdefault(outputs, {"calls": 0, "bytes": 0, "last": 0, "max": 0})
+            entry["calls"] += 1
+            entry["bytes"] += nbytes
+            entry["last"] = nbytes
+            entry["max"] = max(entry["max"], nbytes)
+
+    def add_figure(self, name: str, fig_dict: dict):
+        sizes = {}
+        for i, trace in enumerate(fig_dict["data"]):
+            size = sum(len(trace[prop]["bdata"]) for prop in ("x", "y", "z")
+                       if isinstance(trace.get(prop), dict) and "bdata" in trace[prop])
+            sizes[str(trace.get("name", i))] = size
+        with self.lock:
+            self.traces[name] = sizes
+
+    def stats(self) -> dict:
+        with self.lock:
+            callbacks = {outputs: dict(entry, avg=round(entry["bytes"] / entry["calls"]))
+                         for outputs, entry in self.callbacks.items()}
+            return {"callbacks": callbacks, "traces": {name: dict(sizes) for name, sizes in self.traces.items()}}
@@ -0,0 +1,124 @@
+# Calendar buckets of the collected data for the rangeslider: every minute, hour, day and month that has data, with
+# its exact start and end time and the rows of the data in it. Built once per data version, the slider marks and the
+# time range of the slider values are looked up from it instead of rounding the timestamps again.
+
+import numpy as np
+import pandas as pd
+
+# granularity -> numpy datetime unit and format of the slider labels (from fine to coarse)
+GRANULARITIES = {"minute": ("m", "%d/%m/%y %H:%M"),
+                 "hour": ("h", "%d/%m/%y %H:%M"),
+                 "day": ("D", "%d/%m/%y"),
+                 "month": ("M", "%m/%y")}
+
+
+def granularity_for(span: pd.Timedelta) -> str:
+    """
+    The granularity of the rangeslider for data covering the timespan (the slider should have a few to a few hundred
+    steps): month for more than 91 days, day for more than 2 days, hour for more than 2 hours, else minute.
+    """
+    if span > pd.Timedelta(91, "d"):
+        return "month"
+    if span > pd.Timedelta(2, "d"):
+        return "day"
+    if span > pd.Timedelta(2, "h"):
+        return "hour"
+    return "minute"
+
+
+class CalendarBuckets:
+    """
+    The buckets of one granularity that contain data. Per bucket: start time, end time (start of the next bucket,
+    exclusive) in ns and the first and end row of the data in it.
+    """
+
+    def __init__(self, times: np.ndarray, granularity: str):
+        """
+        :param times: sorted timestamps as int64 ns (see TimeIndexedFrame.times)
+        """
+        self.granularity = granularity
+        unit, self.label_format = GRANULARITIES[granularity]
+        periods = times.view("datetime64[ns]").astype(f"datetime64[{unit}]")
+        self.first_row = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]]) if len(times) else \
+            np.empty(0, dtype=np.int64)
+        self.end_row = np.r_[self.first_row[1:], len(times)].astype(np.int64)
+        starts = periods[self.first_row]
+        self.start = starts.astype("datetime64[ns]").view(np.int64)
+        self.end = (starts + 1).astype("datetime64[ns]").view(np.int64)  # months have different lengths
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def window(self, from_ns: int, to_ns: int) -> tuple:
+        """
+        :return: first and end index of the buckets with data between from_ns and to_ns
+        """
+        return (int(np.searchsorted(self.end, from_ns, side="right")),
+                int(np.searchsorted(self.start, to_ns, side="right")))
+
+
+class CalendarIndex:
+    """
+    The buckets of every granularity of the data (all rows).
+    """
+
+    def __init__(self, times: np.ndarray):
+        """
+        :param times: sorted timestamps as int64 ns (see TimeIndexedFrame.times)
+        """
+        self.buckets = {granularity: CalendarBuckets(times, granularity) for granularity in GRANULARITIES}
+
+    def slider(self, from_val, to_val) -> "SliderBuckets":
+        """
+        The rangeslider for the data between from_val and to_val (i.e. the last x days), with the granularity
+        for the timespan.
+        """
+        buckets = self.buckets[granularity_for(to_val - from_val)]
+        return SliderBuckets(buckets, pd.Timestamp(from_val).value, pd.Timestamp(to_val).value)
+
+
+class SliderBuckets:
+    """
+    The steps of the rangeslider: the buckets in the time range of the shown data. Slider value i is the i-th bucket
+    in the range, the first and last bucket are cut to the range.
+    """
+
+    def __init__(self, buckets: CalendarBuckets, from_ns: int, to_ns: int):
+        self.buckets = buckets
+        self.granularity = buckets.granularity
+        self.from_ns = from_ns
+        self.to_ns = to_ns
+        self.lo, self.hi = buckets.window(from_ns, to_ns)
+
+    def __len__(self) -> int:
+        return self.hi - self.lo
+
+    def labels(self) -> list:
+        return list(pd.DatetimeIndex(self.buckets.start[self.lo:self.hi]).strftime(self.buckets.label_format))
+
+    def clamp(self, minval, maxval) -> tuple:
+        """
+        Slider values within the buckets (i.e. the slider was set before the data was reloaded and now has fewer
+        steps).
+        :return: first and last bucket, None, None if there are no buckets
+        """
+        last = len(self) - 1
+        if last < 0:
+            return None, None
+        first = min(max(int(minval), 0), last)
+        return first, min(max(int(maxval), first), last)
+
+    def time_range(self, first: int, last: int) -> tuple:
+        """
+        :return: start of the first and end of the last bucket (as Timestamps, 1 ns before the next bucket)
+        """
+        start = max(self.buckets.start[self.lo + first], self.from_ns)
+        end = min(self.buckets.end[self.lo + last] - 1, self.to_ns)
+        return pd.Timestamp(start), pd.Timestamp(end)
+
+    def row_range(self, first: int, last: int) -> tuple:
+        """
+        :return: first and end row of the data (all rows the index was built from) in the buckets, not cut to
+            the time range of the slider
+        """
+        return int(self.buckets.first_row[self.lo + first]), int(self.buckets.end_row[self.lo + last])
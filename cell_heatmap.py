@@ -0,0 +1,59 @@
+# Cell x time matrix for the heatmap of all cells: the mean voltage of every cell per time bucket, binned at once
+# from the (samples x cells) matrix of the cell columns. Optionally the deviation of every cell from the mean of its
+# module, which shows a weak or drifting cell independent of the state of charge.
+# One heatmap trace instead of a line trace per cell, the size only depends on the buckets and cells.
+
+import numpy as np
+
+
+def bin_time_cells(times, values: np.ndarray, buckets: int) -> tuple:
+    """
+    Mean of every column (cell) per time bucket. The buckets have the same length and cover the times.
+    :param times: sorted times (datetime64 or int64 ns)
+    :param values: samples x cells matrix, NaN for missing values
+    :param buckets: number of time buckets (less if there are less samples)
+    :return: middle of every bucket (datetime64[ns]), buckets x cells matrix of the means (NaN if a bucket has no
+        value of the cell)
+    """
+    times = np.asarray(times).astype("datetime64[ns]").view(np.int64)
+    values = np.asarray(values)
+    n = len(times)
+    if n == 0:
+        return np.array([], dtype="datetime64[ns]"), np.empty((0, values.shape[1]))
+    buckets = max(1, min(buckets, n))
+    # float edges, (end - start) * buckets can overflow int64 for long time ranges
+    edges = np.linspace(times[0], times[-1] + 1, buckets + 1).astype(np.int64)
+    starts = np.searchsorted(times, edges[:-1])
+    rows = np.diff(np.r_[starts, n])
+    starts = np.minimum(starts, n - 1)  # reduceat needs valid indices, empty buckets are masked below
+
+    # summed as float64, the voltages are float32 (see data_loader.py)
+    valid = ~np.isnan(values)
+    if valid.all():
+        sums = np.add.reduceat(values, starts, axis=0, dtype=np.float64)
+        counts = np.repeat(rows[:, None], values.shape[1], axis=1)
+    else:
+        sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0, dtype=np.float64)
+        counts = np.add.reduceat(valid, starts, axis=0, dtype=np.int32)
+        counts[rows == 0] = 0  # reduceat returns the row at the index for an empty bucket
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    middles = (edges[:-1] + np.diff(edges) // 2).view("datetime64[ns]")
+    return middles, means
+
+
+def deviation_from_module_mean(matrix: np.ndarray, module_sizes: list) -> np.ndarray:
+    """
+    The difference of every cell to the mean of the cells of its module in the same bucket.
+    :param matrix: buckets x cells matrix, the cells ordered by module
+    :param module_sizes: number of cells of every module
+    :return: matrix of the same shape
+    """
+    module_sizes = [size for size in module_sizes if size > 0]
+    starts = np.r_[0, np.cumsum(module_sizes)[:-1]]
+    valid = ~np.isnan(matrix)
+    sums = np.add.reduceat(np.where(valid, matrix, 0.0), starts, axis=1)
+    counts = np.add.reduceat(valid.astype(np.int32), starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        module_means = sums / counts
+    return matrix - np.repeat(module_means, module_sizes, axis=1)
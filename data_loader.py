@@ -0,0 +1,214 @@
+# Incremental reading of the csv file written by the data collection.
+# The collector only appends rows (data_logging_scripts/data_writers.py CsvAppender), so after the first read only
+# the bytes added since the last read need to be parsed.
+
+import io
+import os
+import re
+import time
+import logging
+import threading
+
+import pandas as pd
+
+from snapshot import schema_hash, SNAPSHOT_INTERVAL
+
+# Known columns of the collected data. With the fast parser these are read as float32 (mV values and statistics
+# fit exactly and need half the memory), the time column as timestamp. Other columns (energy counters etc.) are float64.
+FLOAT32_COLUMNS = re.compile(r"^(Voltage .*|Global (Min|Max|Delta)|Module\d+ (Min|Max|Delta|Std|ArgMin|ArgMax)|"
+                             r"Module_\d+|Module Avg Delta)$")
+PARSERS = ("pandas", "pyarrow")
+
+
+def column_dtype(name: str) -> str:
+    return "float32" if FLOAT32_COLUMNS.match(name) else "float64"
+
+
+class IncrementalCsvReader:
+    """
+    Keeps the parsed csv file as dataframe and remembers up to which byte it was parsed. read() only parses the rows
+    appended since the last call and adds them to the dataframe.
+    The whole file is parsed again if it was replaced (other inode, i.e. rewritten because of new columns),
+    truncated (smaller than the parsed part) or the header changed.
+    With a snapshot, the first read starts from the rows in the snapshot instead of parsing the whole file.
+    """
+
+    def __init__(self, path: str, timecolumn: str = "Zeitstempel", time_format: str = "%Y-%m-%d %H:%M:%S.%f",
+                 sep: str = ";", parser: str = "pandas", snapshot=None):
+        """
+        :param path: path of the csv file
+        :param timecolumn: column converted to datetime
+        :param time_format: format of the time column (pandas parser, the pyarrow parser reads ISO timestamps)
+        :param sep: separator of the csv file
+        :param parser: "pandas" (C parser, dtypes inferred) or "pyarrow" (multithreaded, dtypes from the known
+            columns, see column_dtype)
+        :param snapshot: CsvSnapshot to start from and to save the parsed rows to, None for no snapshot
+        """
+        if parser not in PARSERS:
+            raise ValueError(f"unknown parser {parser}, use one of {PARSERS}")
+        self.path = path
+        self.parser = parser
+        self.timecolumn = timecolumn
+        self.time_format = time_format
+        self.sep = sep
+        self.df = None
+        self.header_line = None  # raw bytes of the first line (including the line ending)
+        self.columns = None
+        self.offset = 0  # bytes parsed so far, always the end of a complete line
+        self.inode = None
+        self.full_reads = 0
+        self.incremental_reads = 0
+        self.snapshot = snapshot
+        self.unsaved_rows = False  # rows that are not in the snapshot
+        self.lock = threading.Lock()
+
+    def _parse(self, data: bytes, header: bool) -> pd.DataFrame:
+        if self.parser == "pyarrow":
+            try:
+                return self._parse_pyarrow(data, header)
+            except ValueError as e:  # pyarrow.ArrowInvalid, i.e. text in a number column
+                logging.warning(f"fast parsing of {self.path} failed ({e}), using the pandas parser")
+        if header:
+            df = pd.read_csv(io.BytesIO(data), sep=self.sep)
+        else:
+            df = pd.read_csv(io.BytesIO(data), sep=self.sep, header=None, names=self.columns)
+        df[self.timecolumn] = pd.to_datetime(df[self.timecolumn], format=self.time_format)
+        return df
+
+    def _parse_pyarrow(self, data: bytes, header: bool) -> pd.DataFrame:
+        import pyarrow as pa
+        import pyarrow.csv as pcsv
+
+        columns = self.columns
+        if header:
+            columns = data[:data.find(b"\n")].decode("utf-8").rstrip("\r").split(self.sep)
+            # same names as pandas for columns without name (i.e. an index column written by other tools)
+            columns = [name if name else f"Unnamed: {i}" for i, name in enumerate(columns)]
+        column_types = {name: pa.timestamp("us") if name == self.timecolumn else column_dtype(name)
+                        for name in columns if not name.startswith("Unnamed")}
+        table = pcsv.read_csv(io.BytesIO(data),
+                              read_options=pcsv.ReadOptions(column_names=columns, skip_rows=1 if header else 0),
+                              parse_options=pcsv.ParseOptions(delimiter=self.sep),
+                              convert_options=pcsv.ConvertOptions(column_types=column_types))
+        df = table.to_pandas()
+        df[self.timecolumn] = df[self.timecolumn].astype("datetime64[ns]")
+        return df
+
+    def _file_changed(self, f, stat) -> bool:
+        """
+        Check if the file is not the one parsed so far (replaced, truncated or another header).
+        """
+        if self.df is None or stat.st_ino != self.inode or stat.st_size < self.offset:
+            return True
+        f.seek(0)
+        return f.read(len(self.header_line)) != self.header_line
+
+    def _full_read(self, f, stat) -> pd.DataFrame:
+        f.seek(0)
+        data = f.read()
+        end = data.rfind(b"\n") + 1  # a row that is still being written is parsed with the next read
+        self.header_line = data[:data.find(b"\n") + 1]
+        self.df = self._parse(data[:end], header=True)
+        self.columns = list(self.df.columns)
+        self.offset = end
+        self.inode = stat.st_ino
+        self.full_reads += 1
+        self.unsaved_rows = True
+        if self.snapshot is not None:
+            self.snapshot.saved = 0  # save a full read at once
+        logging.info(f"read {self.path} completely: {len(self.df)} rows, {end} bytes")
+        return self.df
+
+    def _schema(self, header_line: bytes) -> str:
+        return schema_hash(header_line, self.parser, FLOAT32_COLUMNS.pattern)
+
+    def _load_snapshot(self, f):
+        f.seek(0)
+        header_line = f.readline()
+        df, state = self.snapshot.load(self.path, self._schema(header_line))
+        if df is not None:
+            self._resume(df, state)
+
+    def _save_snapshot(self, stat):
+        if self.snapshot is None or not self.unsaved_rows or time.time() - self.snapshot.saved < SNAPSHOT_INTERVAL:
+            return
+        try:
+            self.snapshot.save(self.df, self.state(), self._schema(self.header_line), stat)
+            self.unsaved_rows = False
+        except (OSError, ValueError, TypeError, ImportError) as e:  # i.e. disk full, column types feather cant store
+            logging.warning(f"saving the snapshot of {self.path} failed: {e}")
+            self.snapshot.saved = time.time()  # try again after the interval
+
+    def state(self) -> dict:
+        """
+        The position in the file, to continue reading in another process (see resume).
+        """
+        return {"path": self.path, "inode": self.inode, "offset": self.offset, "columns": self.columns,
+                "header_line": self.header_line.decode("latin-1") if self.header_line is not None else None}
+
+    def resume(self, df: pd.DataFrame, state: dict):
+        """
+        Continue after rows that were already read (i.e. by the reader of another process).
+        If the file changed since then, the next read() reads it completely.
+        :param df: the rows read so far
+        :param state: the state() of the reader that read them
+        """
+        with self.lock:
+            self._resume(df, state)
+
+    def _resume(self, df: pd.DataFrame, state: dict):
+        self.df = df
+        self.inode = state["inode"]
+        self.offset = state["offset"]
+        self.columns = state["columns"]
+        self.header_line = state["header_line"].encode("latin-1") if state["header_line"] is not None else None
+
+    def read(self) -> pd.DataFrame:
+        """
+        Return all rows of the file, parsing only what was appended since the last call.
+        The returned dataframe is shared with the next calls, so it must not be changed in place.
+        :return: dataframe with the time column as datetime
+        """
+        with self.lock, open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if self.df is None and self.snapshot is not None:
+                self._load_snapshot(f)
+            df = self._read(f, stat)
+            self._save_snapshot(stat)
+            return df
+
+    def read_new_rows(self) -> tuple:
+        """
+        Like read(), but the appended rows are only returned and not added to the dataframe, for a caller that keeps
+        the rows itself (i.e. the shared store, the reader is then resumed with its dataframe, see resume).
+        :return: the new rows (None if there are none) and True if the file was read completely (the new rows are
+            all rows then)
+        """
+        with self.lock, open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if self._file_changed(f, stat):
+                return self._full_read(f, stat), True
+            return self._read_appended(f, stat), False
+
+    def _read(self, f, stat) -> pd.DataFrame:
+        if self._file_changed(f, stat):
+            return self._full_read(f, stat)
+        new_rows = self._read_appended(f, stat)
+        if new_rows is not None:
+            self.df = pd.concat([self.df, new_rows], ignore_index=True)
+        return self.df
+
+    def _read_appended(self, f, stat) -> pd.DataFrame:
+        if stat.st_size == self.offset:
+            return None
+        f.seek(self.offset)
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return None  # only an incomplete row was added
+        new_rows = self._parse(data[:end], header=False)
+        self.offset += end
+        self.incremental_reads += 1
+        self.unsaved_rows = True
+        logging.debug(f"read {len(new_rows)} new rows ({end} bytes) from {self.path}")
+        return new_rows
@@ -0,0 +1,157 @@
+# Discovery of the battery layout (towers, modules per tower, cells per module) from the channels of battery0.
+# The layout is saved in data/battery_layout.json, it is used when the FEMS box can't be reached at the next start
+# and by the dashboard to know which columns belong to which module.
+#
+# Modules are numbered over all towers (module index), so a system with 2 towers of 10 modules has the modules 0-19.
+# The column names stay the same as for one tower:
+#   "Voltage Module<index> Cell<cell:03d>"  cell voltage in mV
+#   "Module_<index>"                        average voltage of the module
+
+import os
+import re
+import json
+import logging
+from datetime import datetime
+
+import requests
+
+LAYOUT_VERSION = 1
+CELL_CHANNEL = re.compile(r"battery0/Tower(\d+)Module(\d+)Cell(\d+)Voltage")
+CELL_PATTERN = "battery0/Tower.*Module.*Cell.*Voltage"  # regex request, same style as the batch patterns
+MAX_PROBE = 1000  # upper limit when probing towers, modules or cells one by one
+
+
+def cell_channel(tower: int, module: int, cell: int) -> str:
+    return f"battery0/Tower{tower}Module{module}Cell{cell:03d}Voltage"
+
+
+def create_layout(cells: dict, source: str) -> dict:
+    """
+    Create the layout from the found cells.
+    :param cells: dict mapping (tower, module) to the list of cell numbers of that module
+    :param source: how the layout was found, "regex", "probe" or "config"
+    :return: the layout as it is saved in battery_layout.json
+    """
+    modules = []
+    for index, (tower, module) in enumerate(sorted(cells)):
+        cell_numbers = sorted(cells[(tower, module)])
+        modules.append({"index": index, "tower": tower, "module": module, "cells": cell_numbers,
+                        "cell_channels": [cell_channel(tower, module, c) for c in cell_numbers],
+                        "cell_columns": [f"Voltage Module{index} Cell{c:03d}" for c in cell_numbers],
+                        "avg_column": f"Module_{index}"})
+    return {"version": LAYOUT_VERSION, "source": source, "discovered": datetime.now().isoformat(timespec="seconds"),
+            "towers": len({tower for tower, _ in cells}), "modules": modules}
+
+
+def layout_from_config(module_count: int, cells_per_module: int = 14) -> dict:
+    """
+    The layout used by earlier versions: one tower with module_count modules of 14 cells.
+    """
+    return create_layout({(0, m): list(range(cells_per_module)) for m in range(module_count)}, "config")
+
+
+def discover_by_regex(fems) -> dict:
+    """
+    Find all cells with one regex request.
+    :return: the layout or None if the FEMS box found no cells
+    """
+    cells = {}
+    for address in fems.get_channel_group(CELL_PATTERN):
+        match = CELL_CHANNEL.fullmatch(address)
+        if match:
+            tower, module, cell = (int(g) for g in match.groups())
+            cells.setdefault((tower, module), []).append(cell)
+    return create_layout(cells, "regex") if cells else None
+
+
+def _channel_exists(fems, address: str) -> bool:
+    try:
+        fems.get_channel(address)
+        return True
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return False
+        raise
+
+
+def discover_by_probing(fems) -> dict:
+    """
+    Find the cells by requesting channels one by one until the first one that doesn't exist, for FEMS boxes without
+    regex support. Towers and modules are counted with their first cell, the cells of every module are counted.
+    :return: the layout or None if the FEMS box found no cells
+    """
+    cells = {}
+    for tower in range(MAX_PROBE):
+        if not _channel_exists(fems, cell_channel(tower, 0, 0)):
+            break
+        for module in range(MAX_PROBE):
+            if not _channel_exists(fems, cell_channel(tower, module, 0)):
+                break
+            count = 1
+            while count < MAX_PROBE and _channel_exists(fems, cell_channel(tower, module, count)):
+                count += 1
+            cells[(tower, module)] = list(range(count))
+    return create_layout(cells, "probe") if cells else None
+
+
+def discover_layout(fems) -> dict:
+    """
+    Enumerate the cell channels of battery0, with one regex request or (if not supported) by probing.
+    :param fems: FemsClient
+    :return: the layout or None if nothing was found
+    """
+    try:
+        layout = discover_by_regex(fems)
+        if layout is not None:
+            return layout
+    except requests.HTTPError as e:
+        if e.response is None or not 400 <= e.response.status_code < 500:
+            raise
+        logging.info(f"regex request not supported ({e}), probing the battery layout channel by channel")
+    return discover_by_probing(fems)
+
+
+def load_layout(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            layout = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    return layout if layout.get("version") == LAYOUT_VERSION else None
+
+
+def save_layout(path: str, layout: dict):
+    # write to a temporary file and replace, so the dashboard never reads a half written file
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps(layout, indent=1))
+    os.replace(path + ".tmp", path)
+
+
+def get_layout(fems, path: str, module_count: int, discover: bool = True) -> dict:
+    """
+    Discover the layout (once at startup) and save it. If the FEMS box can't be reached, the saved layout of the last
+    start is used, without one the layout from the config (module_count modules with 14 cells in one tower).
+    :param fems: FemsClient
+    :param path: path of battery_layout.json
+    :param module_count: number of modules from the config, only used if the layout can't be discovered
+    :param discover: False to skip the discovery and use the config
+    :return: the layout
+    """
+    layout = None
+    if discover:
+        try:
+            layout = discover_layout(fems)
+            if layout is None:
+                logging.warning("no cell channels found on the FEMS box")
+        except Exception as e:
+            logging.warning(f"battery layout could not be discovered: {e}")
+        if layout is None:
+            layout = load_layout(path)
+            if layout is not None:
+                logging.info(f"using the saved battery layout from {layout['discovered']}")
+    if layout is None:
+        layout = layout_from_config(module_count)
+    save_layout(path, layout)
+    logging.info(f"battery layout ({layout['source']}): {layout['towers']} tower(s), {len(layout['modules'])} modules, "
+                 f"{sum(len(m['cells']) for m in layout['modules'])} cells")
+    return layout
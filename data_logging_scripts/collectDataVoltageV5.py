@@ -3,15 +3,23 @@
 
 import os
 import time
-import requests
 import csv
-from os.path import exists
+import signal
+import re
+import threading
 from datetime import datetime
 #import explorerhat
 import numpy as np
 import logging
+import warnings
 import json
 
+from fems_client import FemsClient, CircuitBreaker
+from data_writers import CsvAppender, ParquetArchiveWriter
+from scheduler import PeriodicScheduler
+from battery_layout import get_layout
+import collector_metrics as metrics
+
 
 # current dir and then into data
 data_path = os.path.abspath( os.path.join( os.path.dirname(os.path.realpath(__file__)), "data"))
@@ -24,29 +32,53 @@ print("done importing")
 with open("config.json", "r") as f:
     jsondata = json.loads(f.read())
     LOOP_TIME = jsondata["collection_time"]  # time for one iteration in mins (when values are requestet and saved)
-    NUMBER_MODULES = jsondata["module_count"]
+    # time between two samples in seconds, overrides collection_time if set (i.e. 5 for a sample every 5 sec)
+    COLLECTION_PERIOD = jsondata.get("collection_period", LOOP_TIME * 60)
+    NUMBER_MODULES = jsondata["module_count"]  # only used if the battery layout can't be discovered
+    DISCOVER_LAYOUT = jsondata.get("discover_layout", True)  # find towers, modules and cells on the FEMS box
     MODULE_IP = jsondata["batteryIP"]
+    REQUEST_TIMEOUT = jsondata.get("request_timeout", 5)  # timeout for a single API request in sec
+    MAX_CONCURRENT_REQUESTS = jsondata.get("max_concurrent_requests", 4)  # parallel requests to the FEMS box
+    REQUEST_RETRIES = jsondata.get("request_retries", 2)  # retries per failed request
+    RETRY_BACKOFF = jsondata.get("retry_backoff", 0.5)  # wait before the first retry in sec, doubled every retry
+    RETRY_BACKOFF_MAX = jsondata.get("retry_backoff_max", 5)  # max wait between two retries in sec
+    BREAKER_FAILURES = jsondata.get("breaker_failures", 5)  # samples without any value in a row until the FEMS box is down
+    BREAKER_RESET_TIME = jsondata.get("breaker_reset_time", 60)  # sec without requests when the FEMS box is down
+    BATCH_REQUESTS = jsondata.get("batch_requests", True)  # request whole channel groups via regex addresses
+    BATCH_PATTERNS = jsondata.get("batch_patterns", ["_sum/.*", "battery0/Tower.*Module.*Cell.*Voltage"])
+    CSV_FLUSH_ROWS = jsondata.get("csv_flush_rows", 1)  # flush the csv file every n rows
+    CSV_FSYNC_ROWS = jsondata.get("csv_fsync_rows", 0)  # force writing to disk every n rows (0 = leave it to the OS)
+    OUTPUT_FORMATS = jsondata.get("output_formats", ["csv"])  # "csv" and/or "parquet" (day partitioned archive)
+    ARCHIVE_ROWS_PER_FILE = jsondata.get("archive_rows_per_file", 6)  # rows buffered per parquet part file
+    # max sec the archive is behind the csv file (the buffer is written earlier if its rows get older)
+    ARCHIVE_FLUSH_TIME = jsondata.get("archive_flush_time", 300)
+    # groups of channels with their own sample period and output file, see README (default: one group with all)
+    SAMPLING_GROUPS = jsondata.get("sampling_groups", None)
+    METRICS_PORT = jsondata.get("metrics_port", 0)  # serve the metrics on http://<ip>:<port>/metrics (0 = off)
+    METRICS_HOST = jsondata.get("metrics_host", "127.0.0.1")  # address the metrics are served on (only local)
+    METRICS_FILE = jsondata.get("metrics_file", "")  # write the metrics to this file in data after every sample
 
 # https://docs.fenecon.de/de/_/latest/fems/glossar.html
-urls = [f"http://x:user@{MODULE_IP}/rest/channel/_sum/GridActivePower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/GridBuyActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/GridSellActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssSoc",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssActivePower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssActiveChargeEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssActiveDischargeEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssDcChargeEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssDcDischargeEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/EssCapacity",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionActivePower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionAcActivePower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionDcActualPower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionAcActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ProductionDcActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ConsumptionActivePower",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/ConsumptionActiveEnergy",
-        f"http://x:user@{MODULE_IP}/rest/channel/_sum/State"]
+# channel addresses for the REST API (http://<ip>/rest/channel/<address>)
+channels = ["_sum/GridActivePower",
+            "_sum/GridBuyActiveEnergy",
+            "_sum/GridSellActiveEnergy",
+            "_sum/EssSoc",
+            "_sum/EssActivePower",
+            "_sum/EssActiveChargeEnergy",
+            "_sum/EssActiveDischargeEnergy",
+            "_sum/EssDcChargeEnergy",
+            "_sum/EssDcDischargeEnergy",
+            "_sum/EssCapacity",
+            "_sum/ProductionActivePower",
+            "_sum/ProductionAcActivePower",
+            "_sum/ProductionDcActualPower",
+            "_sum/ProductionActiveEnergy",
+            "_sum/ProductionAcActiveEnergy",
+            "_sum/ProductionDcActiveEnergy",
+            "_sum/ConsumptionActivePower",
+            "_sum/ConsumptionActiveEnergy",
+            "_sum/State"]
 
 fields = ['Zeitstempel',
           'Netzbezug(positiv)/Einspeisung(negativ) [W]',
@@ -70,96 +102,121 @@ fields = ['Zeitstempel',
           'Status des Systems'
           ]
 
-cell_voltage_urls = []
-# battery module 10 (0-9)
-# pro modul 14 zellen (0-13)
+
+def observe_request(address, seconds, outcome):
+    # called by the FEMS client after every request
+    metrics.request_latency.observe(seconds, channel=address, outcome=outcome)
+    if outcome == "retry":
+        metrics.request_retries.inc()
+
+
+fems = FemsClient(MODULE_IP, timeout=REQUEST_TIMEOUT, max_workers=MAX_CONCURRENT_REQUESTS, retries=REQUEST_RETRIES,
+                  backoff=RETRY_BACKOFF, backoff_max=RETRY_BACKOFF_MAX,
+                  breaker=CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_TIME), request_observer=observe_request)
+
+# towers, modules and cells of the battery, discovered once at startup (see battery_layout.py)
+# saved in data/battery_layout.json for the dashboard
+battery_layout = get_layout(fems, os.path.join(data_path, "battery_layout.json"), NUMBER_MODULES, DISCOVER_LAYOUT)
+cell_voltage_channels = []
 # Creating API URLs based on Module and Cellnumber
-for i in range(NUMBER_MODULES):  #Anzahl der Batteriemodule hier eintragen
-    for n in range(14):  # Cells per Module = 14
-        if n < 10:
-            cellnumber = "0"+str(n)
-            #print("Cell=", cellnumber)
-        else:
-            cellnumber = n
-        temp_url = f"http://x:user@{MODULE_IP}/rest/channel/battery0/Tower0Module{i}Cell0{cellnumber}Voltage"
-        temp_header = f"Voltage Module{i} Cell0{cellnumber}"  # in mV
-        
-        urls.append(temp_url)
-        cell_voltage_urls.append(temp_url)
+for module in battery_layout["modules"]:
+    for temp_channel, temp_header in zip(module["cell_channels"], module["cell_columns"]):  # header in mV
+        channels.append(temp_channel)
+        cell_voltage_channels.append(temp_channel)
         fields.append(temp_header)
 
 
-def get_all_cell_mV_values(_cell_voltage_urls):
+def get_all_cell_mV_values(channel_values, _cell_voltage_channels, _battery_layout):
     """
 
-    :param _cell_voltage_urls: A list with the URLs to all cell mV values
-    :return: numpy array containing all cell mV values ordered from cell 0-13 in module 0-9
+    :param channel_values: dict with the fetched value for every channel address
+    :param _cell_voltage_channels: A list with the channel addresses of all cell mV values (in the order of the layout)
+    :param _battery_layout: the battery layout, the cells of every module
+    :return: numpy array (modules x cells) containing all cell mV values, the row is the module index, the column the
+        cell within the module. Cells that could not be fetched (and modules with less cells than others) are NaN.
     """
-    all_cell_vals = []
-    for url in _cell_voltage_urls:
-        response = requests.get(url)
-        responseData = response.json()
-        entry = responseData["value"]   # the actual value
-        # current_module = url[-15:-14]
-        all_cell_vals.append(entry)
-    return np.asarray(all_cell_vals)
+    all_cell_vals = [channel_values[channel] for channel in _cell_voltage_channels]
+    cells_per_module = [len(module["cells"]) for module in _battery_layout["modules"]]
+    if None not in all_cell_vals and len(set(cells_per_module)) == 1:
+        return np.asarray(all_cell_vals).reshape(-1, cells_per_module[0])
+    cell_mV_matrix = np.full((len(cells_per_module), max(cells_per_module)), np.nan)
+    rows = np.repeat(np.arange(len(cells_per_module)), cells_per_module)
+    columns = np.concatenate([np.arange(n) for n in cells_per_module])
+    cell_mV_matrix[rows, columns] = [np.nan if v is None else v for v in all_cell_vals]
+    return cell_mV_matrix
+
+
+def nan_to_none(values):
+    # missing values are written as empty values (csv) or null (archive)
+    return [None if v != v else v for v in values]  # only NaN is not equal to itself
 
 
-def add_global_min_max_delta_mV(fields, row, all_cell_mV_values):
+def add_global_min_max_delta_mV(fields, row, cell_mV_matrix):
     """
     Appends new values containing min max and delta mV over all cells to the lists "fields" and "row".
     Because they are appended, the values are added to the original list.
     :param fields:  list containing the column names for the csv
     :param row: list containing the row values for the csv
-    :param all_cell_mV_values:  list with the mV value for every cell
+    :param cell_mV_matrix:  array (modules x cells) with the mV value for every cell
+    :return:  no return, directly modifies the given lists
+    """
+    # calculate and append voltage values over all modules (global), missing cells (NaN) are ignored
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all cells missing
+        global_min = np.nanmin(cell_mV_matrix)
+        global_max = np.nanmax(cell_mV_matrix)
+    fields.extend(["Global Min", "Global Max", "Global Delta"])
+    row.extend(nan_to_none([global_min, global_max, global_max - global_min]))
+
+
+def add_module_stats_mV(fields, row, cell_mV_matrix):
+    """
+    Appends the min, max, delta (max - min) and standard deviation of the cell mV values per module, as well as the
+    index of the cell with the lowest and the highest value, to the lists "fields" and "row".
+    :param fields: list containing the column names for the csv
+    :param row: list containing the row values for the csv
+    :param cell_mV_matrix: array (modules x cells) with the mV value for every cell
     :return:  no return, directly modifies the given lists
     """
-    # calculate and append voltage values over all modules (global)
-    all_cell_mV_values = np.asarray(all_cell_mV_values)
-    global_min = np.min(all_cell_mV_values)
-    global_max = np.max(all_cell_mV_values)
-    global_delta = global_max - global_min
-    fields.append("Global Min")
-    fields.append("Global Max")
-    fields.append("Global Delta")
-    row.append(global_min)
-    row.append(global_max)
-    row.append(global_delta)
-
-
-def add_avg_mV_per_module(fields, row, all_cell_mV_values):
+    # all stats are calculated at once over the cell axis, missing cells (NaN) are ignored
+    missing = np.isnan(cell_mV_matrix)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all cells of a module missing
+        mins = np.nanmin(cell_mV_matrix, axis=1)
+        maxs = np.nanmax(cell_mV_matrix, axis=1)
+        stds = np.round(np.nanstd(cell_mV_matrix, axis=1), 2)
+    argmins = np.where(missing, np.inf, cell_mV_matrix).argmin(axis=1)
+    argmaxs = np.where(missing, -np.inf, cell_mV_matrix).argmax(axis=1)
+    all_missing = missing.all(axis=1)
+    for i in range(cell_mV_matrix.shape[0]):
+        fields.extend([f"Module{i} Min", f"Module{i} Max", f"Module{i} Delta", f"Module{i} Std",
+                       f"Module{i} ArgMin", f"Module{i} ArgMax"])
+        if all_missing[i]:
+            row.extend([None] * 6)
+        else:
+            row.extend([mins[i], maxs[i], maxs[i] - mins[i], stds[i], argmins[i], argmaxs[i]])
+
+
+def add_avg_mV_per_module(fields, row, cell_mV_matrix):
     """
     Appends new values, containing the average mV per module measured over all cells within the module,
-    to the lists "fields" and "row".
+    to the lists "fields" and "row". Also appends the delta between the highest and lowest module average.
     :param fields: list containing the column names for the csv
     :param row: list containing the row values for the csv
-    :param all_cell_mV_values:
+    :param cell_mV_matrix: array (modules x cells) with the mV value for every cell
     :return:
     """
     # Calculate avg mV value per module
-    module_cellmV_lists = []
-    # loop über alle werte in 14er schritten
-    for i in range(0, len(all_cell_mV_values) - 13, 14):
-        cells_per_module = []
-        # take values
-        for n in range(14):
-            cells_per_module.append(all_cell_mV_values[i + n])
-        # a list of lists
-        # has a list for every module containing cell values
-        module_cellmV_lists.append(np.asarray(cells_per_module))
-
-    # Create labels and Avg values
-    avg_values_per_module = []
-    for l in module_cellmV_lists:
-        avg_values_per_module.append(np.average(l, axis=0))
-    avg_labels = []
-    for i in range(10):
-        avg_labels.append(f"Module_{i}")  # from top to bottom in the tower? Seems like it not sure yet
-
-    # add column name and value to fields and rows
-    for i in range(len(avg_labels)):
-        fields.append(avg_labels[i])
-        row.append(avg_values_per_module[i])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all cells of a module missing
+        avg_values_per_module = np.nanmean(cell_mV_matrix, axis=1)
+        avg_delta = np.nanmax(avg_values_per_module) - np.nanmin(avg_values_per_module)
+    for i in range(len(avg_values_per_module)):
+        fields.append(f"Module_{i}")  # from top to bottom in the tower? Seems like it not sure yet
+    row.extend(nan_to_none(avg_values_per_module))
+    # used by the delta figure in the dashboard
+    fields.append("Module Avg Delta")
+    row.extend(nan_to_none([avg_delta]))
 
 
 file = "fenecon_voltage_data.csv"
@@ -167,8 +224,6 @@ file = "fenecon_voltage_data.csv"
 logging.debug(f"data_path: {data_path}")
 
 filename = os.path.join(data_path, file)  # actually a file path
-addHeader = True
-run_loop = True
 
 # File is created when the first row is read out (including column names)
 # this way its easier to check if data exists (when the file exists) in the dashboard app.py
@@ -187,92 +242,187 @@ with open(filename, "a", newline='') as csvfile:
     writer.writerow(fields)
 """
 
+# column name for every channel address (channels without a name here use their address as column name)
+column_names = dict(zip(channels, fields[1:]))
+# "cells" in the channel list of a sampling group stands for all cell voltages (including the statistics)
+CELLS = "cells"
 
-reset_fields = fields
 
+def create_writers(csv_path, archive_path):
+    """
+    Create the writers for the configured output formats. Every writer gets every row.
+    """
+    writers = []
+    if "csv" in OUTPUT_FORMATS:
+        writers.append(CsvAppender(csv_path, flush_rows=CSV_FLUSH_ROWS, fsync_rows=CSV_FSYNC_ROWS))
+    if "parquet" in OUTPUT_FORMATS:
+        try:
+            archive_writer = ParquetArchiveWriter(archive_path, ARCHIVE_ROWS_PER_FILE, ARCHIVE_FLUSH_TIME)
+            # a new archive starts with the data that was already collected in the csv
+            if not archive_writer.manifest["partitions"] and os.path.exists(csv_path):
+                archive_writer.import_csv(csv_path)
+            writers.append(archive_writer)
+        except ImportError as e:
+            print(f"pyarrow is needed for the parquet archive: {e}")
+            logging.error(f"pyarrow is needed for the parquet archive: {e}")
+    return writers
+
+
+class SamplingGroup:
+    """
+    A group of channels that is sampled with its own period and written to its own output file
+    (and archive, if enabled).
+    """
 
-def collection_loop():
-    # collect data loop
-    while run_loop:
-        # Fields need to be resetted because new fields are added in this loop to track module mV min max and delta as well as global
-        fields = reset_fields
+    def __init__(self, name: str, period: float, group_channels: list, file_name: str):
+        self.name = name
+        self.channels = []
+        for channel in group_channels:
+            if channel == CELLS:
+                self.channels.extend(cell_voltage_channels)
+            else:
+                self.channels.append(channel)
+        self.with_cells = CELLS in group_channels
+        # only use the batch patterns that cover channels of this group
+        self.patterns = [p for p in BATCH_PATTERNS if any(re.fullmatch(p, c) for c in self.channels)]
+        self.fields = [fields[0]] + [column_names.get(c, c) for c in self.channels]
+
+        # the main csv file keeps the archive name the dashboard reads
+        archive_dir = "archive" if file_name == file else f"archive_{name}"
+        self.writers = create_writers(os.path.join(data_path, file_name), os.path.join(data_path, archive_dir))
+        self.scheduler = PeriodicScheduler(period, name=f"collection {name}")
+        self.reported_bytes = [0] * len(self.writers)  # bytes_written of every writer already counted in the metrics
+        metrics.failed_samples_total.inc(0, group=name)
+        # the dashboard only reads the main file (and archive), the files of the other groups are for own analysis
+        shown = "shown in the dashboard" if file_name == file else "not read by the dashboard"
+        logging.info(f"sampling group {name}: {len(self.channels)} channels every {period} s into {file_name} "
+                     f"({shown})")
+
+    def collect_sample(self):
+        """
+        Request all channels of the group once and write one row. Called by the scheduler every period.
+        """
+        # Fields need to be copied because new fields are added in this loop to track module mV min max and delta as well as global
+        fields = list(self.fields)
 
         start = time.time()
+        metrics.scheduler_lag.set(self.scheduler.last_lag, group=self.name)
+        metrics.scheduler_skipped.set(self.scheduler.skipped_ticks, group=self.name)
         # explorerhat.light[3].on()  # green lamp on = explorer is reading data
-        print("Running start of loop ...")
+        print(f"Running start of loop ({self.name}) ...")
         #logging.info("Running start of loop ...")
 
-        addHeader = True
-        if exists(filename):
-            addHeader = False
-
         row = []
 
         # Get timestamp
         dt = datetime.now()
         row.append(dt)
 
-        dict_of_all_modul_voltages = {}
-        current_module = None
         # Get data from API and write it into a row
         # print("API REST call ...")
 
         try:
-            for url in urls:
-                #print("Request with url: ", url)
-                response = requests.get(url)
-                responseData = response.json()
-                entry = responseData["value"]
-                row.append(entry)
-
-            all_cell_mV_values = get_all_cell_mV_values(cell_voltage_urls)
-            add_global_min_max_delta_mV(fields, row, all_cell_mV_values)
-            add_avg_mV_per_module(fields, row, all_cell_mV_values)
-
-            # Add the row to a csv file
+            # every channel is requested exactly once, the cell values are taken from the same result
+            # channels that could not be fetched (after retries) are None and written as empty values
+            channel_values, missing_channels, fetch_time = fems.fetch_channels(
+                self.channels, self.patterns if BATCH_REQUESTS else None)
+            missing = len(missing_channels)
+            metrics.fetch_duration.set(fetch_time, group=self.name)
+            metrics.missing_channels.set(missing, group=self.name)
+            metrics.missing_channels_total.inc(missing, group=self.name)
+            metrics.circuit_breaker_open.set(int(fems.breaker.is_open))
+            if missing == len(self.channels):
+                raise ConnectionError(f"no channel could be fetched (retries so far: {fems.retry_count})")
+            for channel in self.channels:
+                row.append(channel_values[channel])
+            print(f"Fetching {len(self.channels)} channels took: {fetch_time:.2f} s ({missing} missing)")
+            logging.info(f"{self.name}: fetching {len(self.channels)} channels took: {fetch_time:.2f} s, "
+                         f"{missing} missing, retries so far: {fems.retry_count}")
+
+            if self.with_cells:
+                cell_mV_matrix = get_all_cell_mV_values(channel_values, cell_voltage_channels, battery_layout)
+                add_module_stats_mV(fields, row, cell_mV_matrix)
+                add_global_min_max_delta_mV(fields, row, cell_mV_matrix)
+                add_avg_mV_per_module(fields, row, cell_mV_matrix)
+
+            # Add the row to the csv file (';' separated, header is added if the file is new) and/or the archive
             print("adding row ...")
             #logging.info("adding row ...")
-            with open(filename, "a", newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                if addHeader:
-                    writer.writerow(fields)
-                writer.writerow(row)
-
-            # Replace all ',' with ';'
-            file = open(filename)
-            replacement = file.read().replace(",", ";")
-            file.close()
-            file = open(filename, "w")
-            file.write(replacement)
-            file.close()
+            for writer in self.writers:
+                writer.write_row(fields, row)
             # explorerhat.light[3].off()
+            metrics.cycle_duration.observe(time.time() - start, group=self.name)
+            metrics.samples_total.inc(group=self.name)
+            metrics.last_sample_time.set(time.time(), group=self.name)
 
-            print(f"Iteration took: {time.time() - start} s")
+            print(f"Iteration took: {time.time() - start} s (started {1000 * self.scheduler.last_lag:.1f} ms late)")
             #logging.info(f"Iteration took: {time.time() - start} s")
-
-            # Wait for 60 seconds
-            # print("waiting ...")
-            for minute in range(LOOP_TIME - 1):  # (min-1)
-                blink_freq = 2  # in sec  (for accurate results use even numbers that add up to 60)
-                blink_count = 60 // blink_freq  # how often do we need to blink with that freq for 1 min
-                for _ in range(blink_count):
-                    # explorerhat.light.red.on()
-                    time.sleep(blink_freq // 2)
-                    # explorerhat.light.red.off()
-                    time.sleep(blink_freq // 2)
-
-            # explorerhat.light[0].off()
-            # explorerhat.light[1].off()
-            # explorerhat.light[2].off()
-            # explorerhat.light[3].off()
         except Exception as e:
-            print(f"Exception occured: {e} \n waiting 5 minutes before trying again...")
-            logging.error(f"Exception occured: {e} \n waiting 5 minutes before trying again...")
+            print(f"Exception occured ({self.name}): {e} \n trying again at the next sample time...")
+            logging.error(f"Exception occured ({self.name}): {e} \n trying again at the next sample time...")
             print(f"Time: {datetime.now()}")
             logging.debug(f"Time: {datetime.now()}")
-            time.sleep(5 * 60)
-            print(f"done sleeping, retrying...")
-            logging.debug(f"done sleeping, retrying...")
             print()
+            metrics.failed_samples_total.inc(group=self.name)
+        self.update_metrics()
+
+    def update_metrics(self):
+        """
+        Count the bytes the writers wrote since the last sample and write the metrics file (if enabled).
+        """
+        for i, writer in enumerate(self.writers):
+            metrics.bytes_written.inc(writer.bytes_written - self.reported_bytes[i], group=self.name,
+                                      format=writer.format)
+            self.reported_bytes[i] = writer.bytes_written
+        if METRICS_FILE:
+            try:
+                metrics.registry.write_file(os.path.join(data_path, METRICS_FILE))
+            except OSError as e:
+                logging.warning(f"could not write the metrics file: {e}")
+
+    def run(self):
+        self.scheduler.run(self.collect_sample)
+        # write the rows that are still buffered
+        for writer in self.writers:
+            writer.close()
+        logging.info(f"data collection {self.name} stopped: {self.scheduler.stats()}")
+
+
+if SAMPLING_GROUPS is None:
+    # everything in one file with one period
+    SAMPLING_GROUPS = [{"name": "voltage", "period": COLLECTION_PERIOD,
+                        "channels": [c for c in channels if c not in cell_voltage_channels] + [CELLS], "file": file}]
+sampling_groups = [SamplingGroup(g["name"], g.get("period", COLLECTION_PERIOD), g["channels"],
+                                 g.get("file", f"fenecon_{g['name']}_data.csv")) for g in SAMPLING_GROUPS]
+stop_event = threading.Event()
+
+
+def stop_collection(signum, frame):
+    print("stopping ...")
+    logging.info(f"received signal {signum}, stopping the data collection")
+    stop_event.set()
 
-collection_loop()
\ No newline at end of file
+
+def collection_loop():
+    # collect data loop, every sampling group runs in its own thread with its own scheduler
+    # the scheduler keeps the sample times at a fixed period (without drift)
+    signal.signal(signal.SIGTERM, stop_collection)  # docker stop
+    signal.signal(signal.SIGINT, stop_collection)
+    if METRICS_PORT:
+        try:
+            metrics.registry.serve(METRICS_PORT, METRICS_HOST)
+        except OSError as e:
+            print(f"could not serve the metrics on port {METRICS_PORT}: {e}")
+            logging.error(f"could not serve the metrics on port {METRICS_PORT}: {e}")
+    threads = [threading.Thread(target=group.run, name=group.name) for group in sampling_groups]
+    for thread in threads:
+        thread.start()
+    while not stop_event.wait(1):
+        pass
+    for group in sampling_groups:
+        group.scheduler.stop()
+    for thread in threads:
+        thread.join()
+
+
+collection_loop()
@@ -0,0 +1,199 @@
+# Metrics of the data collection in the Prometheus text format
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+# Served on http://<ip>:<metrics_port>/metrics and/or written to a file (i.e. for the node exporter textfile collector)
+
+import os
+import math
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# request latencies of the FEMS box are in the range of milliseconds to the request timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CYCLE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A metric with optional labels, the values of all label combinations are kept in a dict.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), lock: threading.Lock = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = lock or threading.Lock()
+        if not self.labelnames and self.type in ("counter", "gauge"):
+            self.values[()] = 0  # metrics without labels are exported from the start
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self.lock:
+            key = self._key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 lock: threading.Lock = None):
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        with self.lock:
+            key = self._key(labels)
+            if key not in self.values:
+                self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            data = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data["buckets"][i] += 1
+                    break
+            data["sum"] += value
+            data["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, data in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data["buckets"]):
+                cumulative += count
+                le = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(data['sum'])}")
+            lines.append(f"{self.name}_count{labels} {data['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds all metrics and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self.metrics = []
+
+    def _add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames, self.lock))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames, self.lock))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets, self.lock))
+
+    def render(self) -> str:
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        # write to a temporary file and replace, so readers never see a half written file
+        with self.file_lock:
+            with open(path + ".tmp", "w") as f:
+                f.write(self.render())
+            os.replace(path + ".tmp", path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serve the metrics on http://host:port/metrics in a background thread.
+        :param host: address to listen on, only the local machine by default ("0.0.0.0" for every interface, there is
+            no authentication)
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # no log line for every scrape
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logging.info(f"serving metrics on {host}:{port}")
+        return server
+
+
+# metrics of the data collection
+registry = MetricsRegistry()
+request_latency = registry.histogram("fems_request_duration_seconds",
+                                     "Duration of a request to the FEMS REST API per channel (or batch pattern)",
+                                     ("channel", "outcome"))
+request_retries = registry.counter("fems_request_retries_total", "Retries of failed requests to the FEMS REST API")
+circuit_breaker_open = registry.gauge("fems_circuit_breaker_open", "1 while the FEMS box counts as down")
+cycle_duration = registry.histogram("collector_cycle_duration_seconds", "Duration of one sample (fetch and write)",
+                                    ("group",), CYCLE_BUCKETS)
+fetch_duration = registry.gauge("collector_fetch_duration_seconds", "Duration of fetching the last sample",
+                                ("group",))
+missing_channels = registry.gauge("collector_missing_channels", "Channels missing in the last sample", ("group",))
+missing_channels_total = registry.counter("collector_missing_channels_total", "Channels missing in all samples",
+                                          ("group",))
+bytes_written = registry.counter("collector_bytes_written_total", "Bytes written to the output files",
+                                 ("group", "format"))
+samples_total = registry.counter("collector_samples_total", "Samples written", ("group",))
+failed_samples_total = registry.counter("collector_failed_samples_total", "Samples that could not be written",
+                                        ("group",))
+last_sample_time = registry.gauge("collector_last_sample_timestamp_seconds",
+                                  "Unix time of the last successful sample", ("group",))
+scheduler_lag = registry.gauge("collector_scheduler_lag_seconds", "How late the last sample started", ("group",))
+scheduler_skipped = registry.gauge("collector_scheduler_skipped_ticks", "Samples skipped because of overruns",
+                                   ("group",))
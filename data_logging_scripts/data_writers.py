@@ -0,0 +1,332 @@
+# Writers for the collected rows
+
+import os
+import re
+import csv
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+
+
+class CsvAppender:
+    """
+    Appends rows to the csv file in the format the dashboard reads (';' separated, column names in the first line).
+    The file stays open between rows, so adding a row only costs the bytes of that row instead of rewriting the
+    whole file.
+    """
+    format = "csv"
+
+    def __init__(self, path: str, flush_rows: int = 1, fsync_rows: int = 0):
+        """
+        :param path: path of the csv file, it is created (with header) when the first row is written
+        :param flush_rows: flush the written rows to the OS every n rows (1 = every row is visible to the dashboard
+            right away)
+        :param fsync_rows: force the OS to write the rows to disk every n rows, 0 = leave it to the OS
+            (fewer writes on the SD card)
+        """
+        self.path = path
+        self.flush_rows = max(1, int(flush_rows))
+        self.fsync_rows = max(0, int(fsync_rows))
+        self.file = None
+        self.writer = None
+        self.inode = None
+        self.header_width = 0  # columns in the header of the file, rows are padded to it
+        self.rows_since_flush = 0
+        self.rows_since_fsync = 0
+        self.bytes_written = 0  # bytes appended since the start (rewrites of the header migration not counted)
+
+    def _open(self, fields: list):
+        """
+        Open the file for appending and add the header if the file is new or empty.
+        """
+        self.close()
+        self._migrate_header(fields)
+        self.file = open(self.path, "a", newline='')
+        # os.linesep as line ending, like the files written by earlier versions (rewritten in text mode)
+        self.writer = csv.writer(self.file, delimiter=";", lineterminator=os.linesep)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if self.file.tell() == 0:
+            self.writer.writerow(fields)
+            self.bytes_written += self.file.tell()
+            self.header_width = len(fields)
+            logging.info(f"created {self.path}")
+        else:
+            with open(self.path, "r", newline='') as f:
+                self.header_width = len(next(csv.reader(f, delimiter=";")))
+
+    def _migrate_header(self, fields: list):
+        """
+        If the existing file was written with other columns (i.e. an older version of this script), rewrite it once
+        with the new columns first, so the new rows fit the header. Values of new columns are left empty in the old
+        rows, columns that are no longer collected are kept at the end (and left empty in the new rows, see
+        write_row).
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "r", newline='') as f:
+            header = next(csv.reader(f, delimiter=";"))
+        if header[:len(fields)] == list(fields):
+            return
+
+        new_header = list(fields) + [name for name in header if name not in fields]
+        positions = {name: i for i, name in enumerate(header)}
+        logging.warning(f"columns of {self.path} changed, rewriting the file with {len(new_header)} columns")
+        with open(self.path, "r", newline='') as old_file, open(self.path + ".tmp", "w", newline='') as new_file:
+            reader = csv.reader(old_file, delimiter=";")
+            writer = csv.writer(new_file, delimiter=";", lineterminator=os.linesep)
+            next(reader)
+            writer.writerow(new_header)
+            for old_row in reader:
+                writer.writerow([old_row[positions[name]] if name in positions and positions[name] < len(old_row)
+                                 else "" for name in new_header])
+        os.replace(self.path + ".tmp", self.path)
+
+    def _file_replaced(self) -> bool:
+        """
+        Check if the file was deleted or replaced (i.e. moved away for backup) since it was opened.
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def write_row(self, fields: list, row: list):
+        """
+        Append one row. The header is only written if the file is new.
+        :param fields: the column names, used as header for a new file
+        :param row: the values for this row
+        """
+        if self.file is None or self._file_replaced():
+            self._open(fields)
+        size = self.file.tell()
+        if len(row) < self.header_width:
+            # empty values for the columns that are no longer collected, every row has the width of the header
+            row = list(row) + [""] * (self.header_width - len(row))
+        self.writer.writerow(row)
+        self.bytes_written += self.file.tell() - size
+
+        self.rows_since_flush += 1
+        self.rows_since_fsync += 1
+        if self.rows_since_flush >= self.flush_rows:
+            self.file.flush()
+            self.rows_since_flush = 0
+        if self.fsync_rows and self.rows_since_fsync >= self.fsync_rows:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.rows_since_fsync = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            self.file.close()
+        self.file = None
+        self.writer = None
+
+
+# Column types in the parquet archive. Cell voltages fit into int16 (mV), the timestamp is stored as
+# int64 microseconds since epoch (local time, like the csv), everything else as float64.
+ARCHIVE_TIMESTAMP_COLUMN = "Zeitstempel"
+ARCHIVE_MANIFEST = "manifest.json"
+INT16_COLUMNS = re.compile(r"^(Voltage .*|Global (Min|Max|Delta)|Module\d+ (Min|Max|Delta))$")
+INT8_COLUMNS = re.compile(r"^Module\d+ Arg(Min|Max)$")
+FLOAT32_COLUMNS = re.compile(r"^(Module_\d+|Module\d+ Std|Module Avg Delta)$")
+
+
+def archive_column_type(name: str):
+    import pyarrow as pa
+    if name == ARCHIVE_TIMESTAMP_COLUMN:
+        return pa.int64()
+    if INT16_COLUMNS.match(name):
+        return pa.int16()
+    if INT8_COLUMNS.match(name):
+        return pa.int8()
+    if FLOAT32_COLUMNS.match(name):
+        return pa.float32()
+    return pa.float64()
+
+
+def to_epoch_us(dt: datetime) -> int:
+    # naive local time is stored as is, so it reads back as the same wall clock time
+    return (dt - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+def concat_tables(tables: list):
+    """
+    Concat tables with possibly different columns (i.e. parts written before new columns were added).
+    """
+    import pyarrow as pa
+    try:
+        return pa.concat_tables(tables, promote_options="default")
+    except TypeError:
+        return pa.concat_tables(tables, promote=True)  # pyarrow < 14
+
+
+class ParquetArchiveWriter:
+    """
+    Writes the rows into a day partitioned parquet archive with typed columns:
+
+        archive/manifest.json
+        archive/day=2023-05-01/data.parquet         (a finished day, compacted into one file)
+        archive/day=2023-05-02/part-<epoch_us>.parquet   (the current day, one file per rows_per_file rows or
+                                                      flush_seconds)
+
+    The manifest lists the files, row count and time range of every partition, so readers only need to open the
+    partitions of the time range they want.
+    """
+    format = "parquet"
+
+    def __init__(self, path: str, rows_per_file: int = 6, flush_seconds: float = 300):
+        """
+        :param path: directory of the archive, created if it doesnt exist
+        :param rows_per_file: rows are buffered and written as one part file every n rows
+        :param flush_seconds: the buffer is also written when its first row is older than this, so the archive is
+            at most this far behind the csv file (with long sample periods the row count alone would take hours)
+        """
+        import pyarrow  # fail early if the optional dependency is missing
+        self.path = path
+        self.rows_per_file = max(1, int(rows_per_file))
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.buffer_started = None  # time.monotonic() of the first buffered row
+        self.last_row_time = None  # time.monotonic() of the last row, to estimate when the next row comes
+        self.buffer_day = None
+        self.fields = None
+        self.bytes_written = 0  # bytes of all files written since the start (including compaction and manifest)
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = self._load_manifest()
+        # days that were not compacted (i.e. the script was stopped) are compacted now, except for today
+        today = datetime.now().date().isoformat()
+        for day, partition in list(self.manifest["partitions"].items()):
+            if day != today and len(partition["files"]) > 1:
+                self._compact(day)
+
+    def _load_manifest(self) -> dict:
+        manifest_file = os.path.join(self.path, ARCHIVE_MANIFEST)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r") as f:
+                return json.loads(f.read())
+        return {"version": 1, "timestamp_column": ARCHIVE_TIMESTAMP_COLUMN, "timestamp_unit": "us",
+                "columns": {}, "partitions": {}}
+
+    def _save_manifest(self):
+        # write to a temporary file and replace, so readers never see a half written manifest
+        manifest_file = os.path.join(self.path, ARCHIVE_MANIFEST)
+        with open(manifest_file + ".tmp", "w") as f:
+            self.bytes_written += f.write(json.dumps(self.manifest, indent=1))
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+    def _write_table(self, table, day: str, file_name: str):
+        import pyarrow.parquet as pq
+        day_dir = os.path.join(self.path, f"day={day}")
+        os.makedirs(day_dir, exist_ok=True)
+        file_path = os.path.join(day_dir, file_name)
+        pq.write_table(table, file_path + ".tmp", compression="zstd")
+        self.bytes_written += os.path.getsize(file_path + ".tmp")
+        os.replace(file_path + ".tmp", file_path)
+        return f"day={day}/{file_name}"
+
+    def write_row(self, fields: list, row: list):
+        """
+        Buffer one row, the buffer is written when it is full, its first row is older than flush_seconds or the day
+        changes.
+        :param fields: the column names
+        :param row: the values for this row, the first value is the timestamp (datetime)
+        """
+        day = row[0].date().isoformat()
+        if self.buffer_day is not None and day != self.buffer_day:
+            finished_day = self.buffer_day
+            self.flush()
+            self._compact(finished_day)
+        elif fields != self.fields:
+            self.flush()  # columns changed, they are written to a new part file
+        self.fields = list(fields)
+        self.buffer_day = day
+        now = time.monotonic()
+        interval = now - self.last_row_time if self.last_row_time is not None else 0
+        self.last_row_time = now
+        if not self.buffer:
+            self.buffer_started = now
+        self.buffer.append(list(row))
+        # written now if the buffer would be older than flush_seconds when the next row comes (the rows come in
+        # the same interval, so with a long sample period every row is written at once)
+        if len(self.buffer) >= self.rows_per_file or now + interval - self.buffer_started >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a new part file of the current day.
+        """
+        import pyarrow as pa
+        if not self.buffer:
+            return
+        arrays = []
+        for i, name in enumerate(self.fields):
+            values = [r[i] for r in self.buffer]
+            if name == ARCHIVE_TIMESTAMP_COLUMN:
+                values = [to_epoch_us(v) for v in values]
+            arrays.append(pa.array(values, type=archive_column_type(name), from_pandas=True))
+        table = pa.Table.from_arrays(arrays, names=self.fields)
+        timestamps = table.column(ARCHIVE_TIMESTAMP_COLUMN).to_pylist()
+        file_name = self._write_table(table, self.buffer_day, f"part-{timestamps[0]}.parquet")
+
+        partition = self.manifest["partitions"].setdefault(
+            self.buffer_day, {"files": [], "rows": 0, "min_ts": timestamps[0], "max_ts": timestamps[-1]})
+        partition["files"].append(file_name)
+        partition["rows"] += len(timestamps)
+        partition["min_ts"] = min(partition["min_ts"], min(timestamps))
+        partition["max_ts"] = max(partition["max_ts"], max(timestamps))
+        for name in self.fields:
+            self.manifest["columns"][name] = str(archive_column_type(name))
+        self._save_manifest()
+        self.buffer = []
+        self.buffer_started = None
+
+    def _compact(self, day: str):
+        """
+        Combine all part files of a day into one file.
+        """
+        import pyarrow.parquet as pq
+        partition = self.manifest["partitions"].get(day)
+        if partition is None or len(partition["files"]) < 2:
+            return
+        old_files = list(partition["files"])
+        table = concat_tables([pq.read_table(os.path.join(self.path, f)) for f in old_files])
+        table = table.sort_by(ARCHIVE_TIMESTAMP_COLUMN)
+        partition["files"] = [self._write_table(table, day, "data.parquet")]
+        self._save_manifest()
+        for f in old_files:
+            if f not in partition["files"]:
+                os.remove(os.path.join(self.path, f))
+        logging.info(f"compacted {len(old_files)} files of {day} in the archive")
+
+    def import_csv(self, csv_path: str):
+        """
+        Copy the rows of an existing csv file into the archive (used once, when the archive is created).
+        """
+        import pyarrow as pa
+        import pyarrow.csv as pcsv
+        import pyarrow.compute as pc
+        table = pcsv.read_csv(csv_path, parse_options=pcsv.ParseOptions(delimiter=";"),
+                              convert_options=pcsv.ConvertOptions(
+                                  column_types={ARCHIVE_TIMESTAMP_COLUMN: pa.timestamp("us")}))
+        # csv files edited with other tools may contain an unnamed index column
+        table = table.select([n for n in table.column_names if n.strip() and not n.startswith("Unnamed")])
+        timestamps = table.column(ARCHIVE_TIMESTAMP_COLUMN).cast(pa.int64())
+        table = table.set_column(table.column_names.index(ARCHIVE_TIMESTAMP_COLUMN), ARCHIVE_TIMESTAMP_COLUMN,
+                                 timestamps)
+        table = table.cast(pa.schema([(n, archive_column_type(n)) for n in table.column_names]), safe=False)
+        days = pc.strftime(timestamps.cast(pa.timestamp("us")), format="%Y-%m-%d")
+        for day in pc.unique(days).to_pylist():
+            day_table = table.filter(pc.equal(days, day)).sort_by(ARCHIVE_TIMESTAMP_COLUMN)
+            day_ts = day_table.column(ARCHIVE_TIMESTAMP_COLUMN).to_pylist()
+            file_name = self._write_table(day_table, day, "data.parquet")
+            self.manifest["partitions"][day] = {"files": [file_name], "rows": len(day_ts),
+                                                "min_ts": day_ts[0], "max_ts": day_ts[-1]}
+        for name in table.column_names:
+            self.manifest["columns"][name] = str(archive_column_type(name))
+        self._save_manifest()
+        logging.info(f"imported {table.num_rows} rows from {csv_path} into the archive")
+
+    def close(self):
+        self.flush()
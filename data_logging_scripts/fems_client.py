@@ -0,0 +1,310 @@
+# Client for the FENECON FEMS REST API (channel values)
+# https://docs.fenecon.de/de/_/latest/fems/glossar.html
+
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FemsUnavailableError(Exception):
+    """
+    Raised instead of sending a request while the circuit breaker is open (the FEMS box seems to be down).
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a FEMS box that is down.
+    After failure_threshold fetch cycles in a row in which no request succeeded, the breaker opens and requests fail
+    at once (single failed requests of a flaky box don't count, they are retried). After reset_time seconds the
+    breaker is half open: one trial request is let through and the other requests wait for its result. If it
+    succeeds the breaker closes and the waiting requests are sent, if not it opens again with twice the reset time
+    (up to max_reset_time).
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_time: float = 60, max_reset_time: float = 600):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.base_reset_time = reset_time
+        self.max_reset_time = max_reset_time
+        self.reset_time = reset_time
+        self.failures = 0  # failed fetch cycles in a row
+        self.opened_at = None  # monotonic time the breaker opened, None while closed
+        self.trial_thread = None  # thread sending the trial request while half open
+        self.condition = threading.Condition()
+
+    def allow_request(self, wait: float = 30) -> bool:
+        """
+        :param wait: max seconds to wait for the result of the trial request while half open
+        :return: True if the request may be sent
+        """
+        deadline = time.monotonic() + wait
+        with self.condition:
+            while True:
+                if self.opened_at is None:
+                    return True
+                if time.monotonic() - self.opened_at < self.reset_time:
+                    return False
+                if self.trial_thread is None or self.trial_thread == threading.get_ident():
+                    self.trial_thread = threading.get_ident()  # half open: this request is the trial
+                    return True
+                # wait for the result of the trial request
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+
+    def release_trial(self):
+        """
+        Called when a request ends. If it was the trial request and it neither succeeded nor failed (i.e. another
+        exception), the next waiting request becomes the trial.
+        """
+        with self.condition:
+            if self.trial_thread == threading.get_ident():
+                self.trial_thread = None
+                self.condition.notify_all()
+
+    def record_success(self):
+        """
+        A request succeeded (the box answered).
+        """
+        with self.condition:
+            if self.opened_at is not None:
+                logging.info("FEMS box reachable again, closing the circuit breaker")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_thread = None
+            self.reset_time = self.base_reset_time
+            self.condition.notify_all()
+
+    def record_failure(self):
+        """
+        A request failed. Only the failure of the trial request opens the breaker again, the other failures are
+        counted per fetch cycle (record_cycle).
+        """
+        with self.condition:
+            if self.trial_thread == threading.get_ident():
+                # the trial request failed, wait longer until the next one
+                self.reset_time = min(self.max_reset_time, self.reset_time * 2)
+                self.opened_at = time.monotonic()
+                self.trial_thread = None
+                logging.warning(f"FEMS box still not reachable, next try in {self.reset_time} s")
+                self.condition.notify_all()
+
+    def record_cycle(self, succeeded: bool):
+        """
+        A fetch cycle (all requests of one sample) ended.
+        :param succeeded: at least one request of the cycle succeeded
+        """
+        with self.condition:
+            if succeeded:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                logging.error(f"no request succeeded in {self.failures} fetch cycles in a row, opening the circuit "
+                              f"breaker (no requests for {self.reset_time} s)")
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Open or half open (not closed).
+        """
+        return self.opened_at is not None
+
+    @property
+    def rejects_requests(self) -> bool:
+        """
+        Open and the reset time not over, requests fail at once (half open lets the trial request through).
+        """
+        with self.condition:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_time
+
+
+class FemsClient:
+    """
+    Fetches channel values from the FEMS REST API over one shared keep-alive session.
+    Requests are spread over a bounded thread pool, so at most max_workers requests hit the FEMS box at once.
+    Channels are addressed like in the REST URL, e.g. "_sum/GridActivePower".
+    Whole channel groups can be requested at once with a regex address, e.g. "_sum/.*" (batch mode).
+    Failed requests are retried with exponential backoff and jitter, channels that still fail are returned as None.
+    """
+
+    def __init__(self, host: str, user: str = "x", password: str = "user", timeout: float = 5.0,
+                 max_workers: int = 4, retries: int = 2, backoff: float = 0.5, backoff_max: float = 5.0,
+                 breaker: CircuitBreaker = None, request_observer=None):
+        """
+        :param host: ip (and port) of the FEMS box, e.g. "192.168.1.229:8084"
+        :param user: user for the REST API (default user is "x")
+        :param password: password for the REST API (default password is "user")
+        :param timeout: timeout in seconds for every single request
+        :param max_workers: max number of requests running at the same time
+        :param retries: how often a failed request is retried
+        :param backoff: wait time before the first retry in seconds, doubled for every further retry
+        :param backoff_max: max wait time between two retries in seconds
+        :param breaker: circuit breaker for the FEMS box (default: CircuitBreaker())
+        :param request_observer: optional function(address, seconds, outcome) called after every request attempt,
+            outcome is "ok", "retry" (failed, retried), "error" (failed after the retries) or "client_error" (4xx)
+        """
+        self.base_url = f"http://{host}/rest/channel"
+        self.timeout = timeout
+        self.max_workers = max(1, int(max_workers))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.request_observer = request_observer
+
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+        # one connection per worker, so every worker can keep its connection alive
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fems")
+
+        self.retry_count = 0  # number of retries since the start
+        self.retry_lock = threading.Lock()  # retry_count is counted by the pool threads
+        self.unsupported_patterns = set()  # batch patterns the FEMS box rejected, these are not requested again
+        logging.info(f"FEMS client: timeout {timeout} s, {self.max_workers} parallel requests, {self.retries} retries "
+                     f"(backoff {backoff} s doubled up to {backoff_max} s, with jitter), circuit breaker after "
+                     f"{self.breaker.failure_threshold} failed fetch cycles for {self.breaker.reset_time} s")
+
+    def _get_json(self, address: str):
+        """
+        Request an address, retrying on timeouts, connection errors and server errors.
+        Client errors (4xx, i.e. the channel doesn't exist) are not retried.
+        """
+        try:
+            return self._get_json_with_retries(address)
+        finally:
+            self.breaker.release_trial()
+
+    def _get_json_with_retries(self, address: str):
+        for attempt in range(self.retries + 1):
+            # while half open, wait for the trial request at most as long as a request can take (the timeout is
+            # for connecting and for reading)
+            if not self.breaker.allow_request(wait=2 * self.timeout):
+                raise FemsUnavailableError(f"circuit breaker open, {address} not requested")
+            start = time.monotonic()
+            try:
+                response = self.session.get(f"{self.base_url}/{address}", timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+            except requests.HTTPError as e:
+                if e.response is not None and 400 <= e.response.status_code < 500:
+                    self.breaker.record_success()  # the box answered
+                    self._observe(address, start, "client_error")
+                    raise
+                error = e
+            except (requests.RequestException, ValueError) as e:
+                error = e
+            else:
+                self.breaker.record_success()
+                self._observe(address, start, "ok")
+                return data
+
+            self.breaker.record_failure()
+            if attempt == self.retries:
+                self._observe(address, start, "error")
+                raise error
+            self._observe(address, start, "retry")
+            with self.retry_lock:
+                self.retry_count += 1
+            # exponential backoff with full jitter, so the retries of parallel requests don't all hit at once
+            delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+            logging.debug(f"request {address} failed ({error}), retry {attempt + 1} in {delay:.2f} s")
+            time.sleep(delay)
+
+    def _observe(self, address: str, start: float, outcome: str):
+        if self.request_observer is not None:
+            self.request_observer(address, time.monotonic() - start, outcome)
+
+    def get_channel(self, address: str):
+        """
+        Request a single channel.
+        :param address: channel address, e.g. "_sum/EssSoc"
+        :return: the value of the channel
+        """
+        return self._get_json(address)["value"]
+
+    def get_channel_group(self, pattern: str) -> dict:
+        """
+        Request all channels matching a regex address in one request.
+        :param pattern: regex channel address, e.g. "battery0/Tower0Module.*Cell.*Voltage"
+        :return: dict mapping the address of every matching channel to its value
+        """
+        data = self._get_json(pattern)
+        if isinstance(data, dict):
+            # a pattern matching only one channel may be answered like a single channel request
+            data = [data]
+        return {entry["address"]: entry["value"] for entry in data}
+
+    def fetch_channels(self, addresses: list, patterns: list = None) -> tuple:
+        """
+        Request every given channel exactly once, using the thread pool.
+        If patterns are given, the channel groups are requested first (one request per pattern) and only the
+        channels not covered by a group are requested one by one.
+        Channels that could not be fetched (after the retries) are returned as None and listed as missing.
+        The sampling groups share the client (in their own threads), so everything about a call is returned.
+        :param addresses: list of channel addresses
+        :param patterns: optional list of regex channel addresses used for batch requests
+        :return: dict mapping every address to its value (or None), list of the missing channels and the duration of
+            the call in seconds
+        """
+        start = time.monotonic()
+        values = {}
+        if patterns and not self.breaker.rejects_requests:
+            values = self._fetch_channel_groups([p for p in patterns if p not in self.unsupported_patterns],
+                                                addresses)
+        single = [address for address in addresses if address not in values]
+        futures = {address: self.executor.submit(self.get_channel, address) for address in single}
+        errors = {}
+        for address, future in futures.items():
+            try:
+                values[address] = future.result()
+            except (requests.RequestException, ValueError, KeyError, TypeError, FemsUnavailableError) as e:
+                values[address] = None
+                errors[address] = e
+
+        # the box counts as down after cycles without any value (single failed requests of a flaky box don't count)
+        self.breaker.record_cycle(any(value is not None for value in values.values()))
+        seconds = time.monotonic() - start
+        logging.debug(f"fetched {len(addresses)} channels ({len(single)} single requests) in {seconds:.3f} s")
+        if errors:
+            first = next(iter(errors))
+            logging.warning(f"{len(errors)} of {len(addresses)} channels missing, i.e. {first}: {errors[first]}")
+        return values, list(errors), seconds
+
+    def _fetch_channel_groups(self, patterns: list, addresses: list) -> dict:
+        """
+        Request the channel groups and keep only the requested addresses.
+        Failing groups are skipped (their channels are then requested one by one). A group answered with a
+        client error (4xx) is marked as unsupported, e.g. on older FEMS versions without regex support.
+        """
+        wanted = set(addresses)
+        futures = {pattern: self.executor.submit(self.get_channel_group, pattern) for pattern in patterns}
+        values = {}
+        for pattern, future in futures.items():
+            try:
+                group_values = future.result()
+            except requests.HTTPError as e:
+                if e.response is not None and 400 <= e.response.status_code < 500:
+                    self.unsupported_patterns.add(pattern)
+                    logging.warning(f"batch request {pattern} not supported ({e}), using single requests instead")
+                else:
+                    logging.warning(f"batch request {pattern} failed ({e}), using single requests instead")
+                continue
+            except (requests.RequestException, ValueError, KeyError, TypeError, FemsUnavailableError) as e:
+                logging.warning(f"batch request {pattern} failed ({e}), using single requests instead")
+                continue
+            values.update({address: value for address, value in group_values.items() if address in wanted})
+        return values
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
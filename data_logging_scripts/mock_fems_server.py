@@ -0,0 +1,106 @@
+# Local mock of the FEMS REST API, to test the data collection without a battery tower.
+# Start it and set "batteryIP" in config.json to "127.0.0.1:8084":
+#   python mock_fems_server.py --port 8084
+
+import argparse
+import json
+import random
+import re
+import time
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SUM_CHANNELS = ["GridActivePower", "GridBuyActiveEnergy", "GridSellActiveEnergy", "EssSoc", "EssActivePower",
+                "EssActiveChargeEnergy", "EssActiveDischargeEnergy", "EssDcChargeEnergy", "EssDcDischargeEnergy",
+                "EssCapacity", "ProductionActivePower", "ProductionAcActivePower", "ProductionDcActualPower",
+                "ProductionActiveEnergy", "ProductionAcActiveEnergy", "ProductionDcActiveEnergy",
+                "ConsumptionActivePower", "ConsumptionActiveEnergy", "State"]
+
+
+def create_channels(towers: int, modules: int, cells: int) -> dict:
+    """
+    Create the channel addresses of a simulated system with a start value for every channel.
+    :return: dict mapping channel address to value
+    """
+    channels = {f"_sum/{name}": random.randint(0, 10000) for name in SUM_CHANNELS}
+    channels["_sum/EssSoc"] = random.randint(20, 100)
+    channels["_sum/State"] = 0
+    for t in range(towers):
+        for m in range(modules):
+            for c in range(cells):
+                channels[f"battery0/Tower{t}Module{m}Cell{c:03d}Voltage"] = random.randint(3300, 3330)
+    return channels
+
+
+def channel_entry(address: str, value) -> dict:
+    # same fields as the FEMS REST API returns
+    return {"address": address, "type": "INTEGER", "accessMode": "RO", "text": "", "unit": "", "value": value}
+
+
+class MockFemsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive like the real FEMS box
+    wbufsize = 64 * 1024  # send header and body in one packet (avoids delayed ACK stalls on keep-alive)
+    channels = {}
+    allow_regex = True
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.send_json(500, {"error": "simulated error"})
+        prefix = "/rest/channel/"
+        if not self.path.startswith(prefix) or self.path.count("/") != 4:
+            return self.send_json(404, {"error": "not found"})
+        address = unquote(self.path[len(prefix):])
+
+        if address in self.channels:
+            # let the values move a little between requests
+            self.channels[address] += random.choice([-1, 0, 0, 1])
+            return self.send_json(200, channel_entry(address, self.channels[address]))
+
+        if not self.allow_regex:
+            return self.send_json(404, {"error": f"channel {address} not found"})
+        try:
+            pattern = re.compile(address)
+        except re.error:
+            return self.send_json(400, {"error": f"invalid pattern {address}"})
+        matches = [channel_entry(a, v) for a, v in self.channels.items() if pattern.fullmatch(a)]
+        if not matches:
+            return self.send_json(404, {"error": f"channel {address} not found"})
+        return self.send_json(200, matches)
+
+    def send_json(self, status: int, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # no log line for every request
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mock FEMS REST API for offline testing.')
+    parser.add_argument('--port', type=int, default=8084, help='Port to listen on. Default is 8084')
+    parser.add_argument('--towers', type=int, default=1, help='Number of battery towers. Default is 1')
+    parser.add_argument('--modules', type=int, default=10, help='Number of modules per tower. Default is 10')
+    parser.add_argument('--cells', type=int, default=14, help='Number of cells per module. Default is 14')
+    parser.add_argument('--no-regex', action='store_true',
+                        help='Answer regex (batch) requests with 404 like a FEMS box without regex support')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay in seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a server error (500), i.e. 0.1')
+    args = parser.parse_args()
+
+    MockFemsHandler.channels = create_channels(args.towers, args.modules, args.cells)
+    MockFemsHandler.allow_regex = not args.no_regex
+    MockFemsHandler.latency = args.latency
+    MockFemsHandler.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), MockFemsHandler)
+    print(f"mock FEMS REST API with {len(MockFemsHandler.channels)} channels on port {args.port}")
+    server.serve_forever()
@@ -0,0 +1,93 @@
+# Periodic scheduler for the data collection
+
+import time
+import math
+import logging
+import threading
+
+
+class PeriodicScheduler:
+    """
+    Runs a task every period seconds. The deadlines are kept on the monotonic clock (start + n * period), so the time
+    the task takes does not add up to the period and the samples don't drift.
+    If the task takes longer than a period, the missed ticks are skipped instead of running them late one after
+    another.
+    """
+
+    def __init__(self, period: float, name: str = "scheduler", log_every: int = None):
+        """
+        :param period: time between two ticks in seconds
+        :param name: name used in the log
+        :param log_every: log the jitter and overrun statistics every n ticks (default: about once per hour)
+        """
+        self.period = float(period)
+        self.name = name
+        self.log_every = log_every or max(1, int(3600 // self.period))
+        self.stop_event = threading.Event()
+        self.next_deadline = None
+
+        self.ticks = 0
+        self.skipped_ticks = 0
+        self.overruns = 0
+        self.last_lag = 0.0  # how late the last tick started in seconds
+        self.max_lag = 0.0
+        self.sum_lag = 0.0
+        self.last_duration = 0.0  # how long the last task took in seconds
+
+    def wait_for_next_tick(self) -> bool:
+        """
+        Sleep until the next deadline.
+        :return: False if the scheduler was stopped while waiting
+        """
+        if self.next_deadline is None:
+            self.next_deadline = time.monotonic()
+        timeout = self.next_deadline - time.monotonic()
+        if timeout > 0 and self.stop_event.wait(timeout):
+            return False
+        return not self.stop_event.is_set()
+
+    def _tick_done(self, tick_start: float):
+        """
+        Update the statistics and move the deadline to the next tick that is still in the future.
+        """
+        now = time.monotonic()
+        self.last_duration = now - tick_start
+        self.ticks += 1
+        self.next_deadline += self.period
+        if now > self.next_deadline:
+            missed = math.floor((now - self.next_deadline) / self.period) + 1
+            self.next_deadline += missed * self.period
+            self.skipped_ticks += missed
+            self.overruns += 1
+            logging.warning(f"{self.name}: tick took {self.last_duration:.2f} s (period {self.period} s), "
+                            f"skipping {missed} tick(s)")
+        if self.ticks % self.log_every == 0:
+            logging.info(f"{self.name}: {self.stats()}")
+
+    def run(self, task):
+        """
+        Run the task every period until stop() is called. Exceptions of the task are logged and the next tick runs
+        as scheduled.
+        :param task: function without arguments
+        """
+        while self.wait_for_next_tick():
+            tick_start = time.monotonic()
+            self.last_lag = tick_start - self.next_deadline
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self.sum_lag += self.last_lag
+            try:
+                task()
+            except Exception as e:
+                logging.exception(f"{self.name}: task failed: {e}")
+            self._tick_done(tick_start)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self) -> dict:
+        return {"ticks": self.ticks,
+                "skipped_ticks": self.skipped_ticks,
+                "overruns": self.overruns,
+                "mean_lag_ms": round(1000 * self.sum_lag / max(1, self.ticks), 2),
+                "max_lag_ms": round(1000 * self.max_lag, 2),
+                "last_duration_s": round(self.last_duration, 3)}
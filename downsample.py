@@ -0,0 +1,105 @@
+# Downsampling of line traces before they are sent to the browser. A trace with more points than the chart can show
+# is reduced to a fixed number of points that keep its shape:
+#   minmax  the lowest and highest value of equally sized buckets (keeps every peak, i.e. a cell voltage spike)
+#   lttb    largest triangle three buckets, the point of every bucket that spans the largest triangle with the points
+#           chosen before and after it (Steinarsson 2013, looks closest to the original line)
+# All traces of a figure share the x values and are reduced together, vectorized over the traces.
+
+import numpy as np
+
+MODES = ("minmax", "lttb", "off")
+
+
+def _as_numbers(x) -> np.ndarray:
+    # datetimes as ns relative to the first value, so the areas of lttb stay in the float64 precision
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").view(np.int64)
+        return (x - x[0]).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def minmax_indices(values: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Index of the min and max value of every bucket (n_out / 2 buckets with the same number of rows) per trace,
+    plus the first and last row.
+    :param values: traces x rows (every trace contiguous in memory)
+    :return: indices (n_out x traces), sorted per trace
+    """
+    k, n = values.shape
+    buckets = max((n_out - 2) // 2, 1)
+    size = -(-n // buckets)  # ceil
+    # missing values (and the padding of the last bucket) are never the min or max (unless the whole bucket is missing)
+    missing = np.isnan(values)
+    padded = np.full((k, buckets * size), np.inf, dtype=values.dtype)
+    padded[:, :n] = np.where(missing, np.inf, values)
+    argmin = np.argmin(padded.reshape(k, buckets, size), axis=2)
+    padded[:, :n][missing] = -np.inf
+    padded[:, n:] = -np.inf
+    argmax = np.argmax(padded.reshape(k, buckets, size), axis=2)
+    offsets = np.arange(buckets) * size
+    pairs = np.sort(np.stack([argmin + offsets, argmax + offsets], axis=2), axis=2).reshape(k, 2 * buckets)
+    first = np.zeros((k, 1), dtype=np.int64)
+    last = np.full((k, 1), n - 1, dtype=np.int64)
+    return np.minimum(np.hstack([first, pairs, last]), n - 1).T
+
+
+def lttb_indices(x: np.ndarray, values: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Index of the points chosen by largest triangle three buckets per column. The first and last row are always kept,
+    the rows between them are split into n_out - 2 buckets.
+    :param x: x values as numbers (rows)
+    :param values: rows x columns
+    :return: indices (n_out x columns)
+    """
+    n, k = values.shape
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # average point of every bucket (compared to in the bucket before it), the last row after the last bucket
+    missing = np.isnan(values[:n - 1])
+    counts = np.add.reduceat(~missing, edges[:-1], axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_y = np.add.reduceat(np.where(missing, 0, values[:n - 1]), edges[:-1], axis=0) / counts
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / np.diff(edges)
+    avg_y = np.vstack([avg_y, values[-1:]])
+    avg_x = np.r_[avg_x, x[-1]]
+
+    selected = np.empty((n_out, k), dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    columns = np.arange(k)
+    a_x = np.full(k, x[0])
+    a_y = values[0]
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        b_x = x[lo:hi, None]
+        b_y = values[lo:hi]
+        area = np.abs((a_x - avg_x[b + 1]) * (b_y - a_y) - (a_x - b_x) * (avg_y[b + 1] - a_y))
+        chosen = np.argmax(np.nan_to_num(area, nan=-1.0), axis=0)
+        selected[b + 1] = lo + chosen
+        a_x = x[lo + chosen]
+        a_y = b_y[chosen, columns]
+    return selected
+
+
+def downsample(x, ys: list, n_out: int = 2000, mode: str = "minmax") -> list:
+    """
+    Reduce traces with the same x values to about n_out points each.
+    :param x: x values (numbers or datetimes)
+    :param ys: y values of every trace, each with the length of x
+    :param n_out: points per trace (traces with fewer points are not changed)
+    :param mode: "minmax", "lttb" or "off"
+    :return: list with x and y values (numpy arrays) of every trace
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown downsampling mode {mode}, use one of {MODES}")
+    x = np.asarray(x)
+    ys = [np.asarray(y) for y in ys]
+    if mode == "off" or len(x) <= max(n_out, 3) or not ys:
+        return [(x, y) for y in ys]
+
+    if mode == "lttb":
+        indices = lttb_indices(_as_numbers(x), np.column_stack(ys).astype(np.float64), max(n_out, 3))
+    else:
+        # float32 values (cell voltages) are compared as float32
+        indices = minmax_indices(np.stack(ys).astype(np.result_type(np.float32, *ys), copy=False), n_out)
+    return [(x[indices[:, i]], y[indices[:, i]]) for i, y in enumerate(ys)]
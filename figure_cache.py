@@ -0,0 +1,121 @@
+# Cache of the figures built by the dashboard callbacks, shared by all callbacks (and browser tabs) of a process.
+# The least recently used figures are removed when the cache is larger than its memory limit, all figures are removed
+# when the data changes (new rows).
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from single_flight import SingleFlight
+
+FIGURE_OVERHEAD = 4096  # bytes of a figure besides the values of its traces (layout, trace settings)
+
+
+def figure_size(fig) -> int:
+    """
+    Approximate memory of a figure (or figure dict): the x and y values of its traces.
+    """
+    size = FIGURE_OVERHEAD
+    for trace in fig["data"]:
+        for prop in ("x", "y", "z"):
+            values = trace.get(prop) if isinstance(trace, dict) else getattr(trace, prop, None)
+            if values is None:
+                continue
+            if isinstance(values, dict):
+                size += len(values.get("bdata", ""))  # base64 encoded (see browser_payload.py)
+            elif isinstance(values, np.ndarray):
+                size += values.nbytes
+            else:
+                size += 32 * len(values)  # lists and tuples of python objects
+    return size
+
+
+class FigureCache:
+    """
+    LRU cache of figures with a memory limit. The cached figures are returned to every caller, they must not be
+    changed after they were added.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: memory limit of the cached figures (see figure_size), 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (figure, size), the last entry is the most recently used
+        self.bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.single_flight = SingleFlight()  # a figure requested by concurrent callbacks is built once
+        self.lock = threading.Lock()
+
+    def set_version(self, version):
+        """
+        Remove all figures if the data version changed (the figures were built from older data).
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            if self.entries:
+                self.invalidations += 1
+                logging.debug(f"figure cache: data version {version}, removing {len(self.entries)} figures")
+            self.entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, fig):
+        size = figure_size(fig)
+        with self.lock:
+            if size > self.max_bytes:
+                return
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (fig, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, removed_size) = self.entries.popitem(last=False)
+                self.bytes -= removed_size
+                self.evictions += 1
+
+    def get_or_create(self, key, create):
+        """
+        :param key: hashable key of the figure, including everything the figure depends on
+        :param create: function without arguments that builds the figure if it isnt cached
+        :return: the figure
+        """
+        fig = self.get(key)
+        if fig is None:
+            fig = self.single_flight.do(key, lambda: self._create(key, create))
+        return fig
+
+    def _create(self, key, create):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:  # built by a call that finished just before this one started
+            return entry[0]
+        fig = create()
+        self.put(key, fig)
+        return fig
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / requests, 3) if requests else None,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "shared_builds": self.single_flight.shared,
+                    "figures": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
@@ -0,0 +1,221 @@
+# Rollup tiers of the collected data: min, max, mean and last value of every column per time bucket
+# (i.e. per 1 minute, 5 minutes, 30 minutes, ... 1 day, chosen for the time between samples). Long time ranges are plotted from the buckets of a tier
+# instead of every sample. The tiers are updated with the rows added since the last update only.
+
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from time_index import TimeIndexedFrame, to_ns
+
+AUTO = "auto"  # tiers chosen for the time between samples (see tiers_for_spacing)
+ROLLUP_TIERS = AUTO
+MIN_REDUCTION = 4  # a tier is only kept if its buckets are at least 4 times longer than the time between samples
+# bucket widths the automatic tiers are chosen from, every tier is at least TIER_STEP times longer than the previous
+TIER_WIDTHS = ("5s", "10s", "30s", "1min", "2min", "5min", "10min", "15min", "30min", "1h", "2h", "3h", "6h", "12h",
+               "1d")
+TIER_STEP = 4
+CHUNK_ROWS = 20000  # rows aggregated at once (limits the temporary memory when all data is rolled up)
+STATS = ("min", "max", "mean", "last")
+
+
+def tiers_for_spacing(spacing: float) -> list:
+    """
+    Rollup tiers for data with the given time between samples: the first tier is at least MIN_REDUCTION times longer
+    than the time between samples, every further tier at least TIER_STEP times longer than the previous one (and a
+    multiple of it), the last tier is 1 day. I.e. 1min, 5min, 30min, 2h, 12h, 1d for 10 s and 1h, 6h, 1d for 10 min.
+    :param spacing: median time between samples in ns
+    :return: the names of the tiers from fine to coarse
+    """
+    tiers = []
+    for name in TIER_WIDTHS:
+        width = pd.Timedelta(name).value
+        if not tiers:
+            if width >= MIN_REDUCTION * spacing:
+                tiers.append(name)
+            continue
+        previous = pd.Timedelta(tiers[-1]).value
+        if width % previous == 0 and (width >= TIER_STEP * previous or name == TIER_WIDTHS[-1]):
+            tiers.append(name)
+    return tiers
+
+
+def reduce_buckets(ids, count, minimum, maximum, total, last, width):
+    """
+    Combine partial aggregates (one row per bucket of a finer tier or per sample) into buckets of the given width.
+    The ids (bucket start in ns) must be sorted.
+    :return: ids, count, min, max, sum and last value per bucket of the width
+    """
+    new_ids = ids - ids % width
+    starts = np.flatnonzero(np.r_[True, new_ids[1:] != new_ids[:-1]])
+    ends = np.r_[starts[1:], len(new_ids)]
+    # fmin/fmax ignore NaN (missing values) unless every value in the bucket is missing
+    return (new_ids[starts], np.add.reduceat(count, starts, axis=0), np.fmin.reduceat(minimum, starts, axis=0),
+            np.fmax.reduceat(maximum, starts, axis=0), np.add.reduceat(total, starts, axis=0), last[ends - 1])
+
+
+class RollupTier:
+    """
+    The buckets of one width. Per bucket and column: number of values, min, max, sum (for the mean) and last value.
+    """
+
+    def __init__(self, name: str, columns: list):
+        self.name = name
+        self.width = pd.Timedelta(name).value
+        self.columns = columns
+        self.ids = np.empty(0, dtype=np.int64)  # bucket start (ns)
+        self.count = np.empty((0, len(columns)), dtype=np.int32)
+        self.min = np.empty((0, len(columns)), dtype=np.float32)
+        self.max = np.empty((0, len(columns)), dtype=np.float32)
+        self.sum = np.empty((0, len(columns)), dtype=np.float64)
+        self.last = np.empty((0, len(columns)), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def merge(self, ids, count, minimum, maximum, total, last):
+        """
+        Add buckets (reduced to the width of this tier). A bucket that is already in the tier (the last one,
+        which was still filling up at the last update) is combined with the new values.
+        """
+        if len(self.ids) and len(ids) and ids[0] == self.ids[-1]:
+            self.count[-1] += count[0]
+            self.min[-1] = np.fmin(self.min[-1], minimum[0])
+            self.max[-1] = np.fmax(self.max[-1], maximum[0])
+            self.sum[-1] += total[0]
+            self.last[-1] = last[0]
+            ids, count, minimum, maximum, total, last = ids[1:], count[1:], minimum[1:], maximum[1:], total[1:], last[1:]
+        if len(ids):
+            self.ids = np.concatenate([self.ids, ids])
+            self.count = np.concatenate([self.count, count])
+            self.min = np.concatenate([self.min, minimum])
+            self.max = np.concatenate([self.max, maximum])
+            self.sum = np.concatenate([self.sum, total])
+            self.last = np.concatenate([self.last, last])
+
+    def bucket_range(self, from_val=None, to_val=None) -> tuple:
+        """
+        :return: first and end index of the buckets that start within from_val <= time <= to_val
+        """
+        start = 0 if from_val is None else np.searchsorted(self.ids, to_ns(from_val) - self.width + 1, side="left")
+        end = len(self.ids) if to_val is None else np.searchsorted(self.ids, to_ns(to_val), side="right")
+        return start, end
+
+    def values(self, stat: str, start: int, end: int, indices) -> np.ndarray:
+        if stat == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return (self.sum[start:end, indices] / self.count[start:end, indices]).astype(np.float32)
+        return getattr(self, stat)[start:end, indices]
+
+
+class RollupTiers:
+    """
+    All rollup tiers of the data, updated from the TimeIndexedFrame of all data. Only the rows added since the last
+    update are aggregated, everything is rolled up again if older rows changed (i.e. the file was replaced).
+    """
+
+    def __init__(self, timecolumn: str = "Zeitstempel", tiers=ROLLUP_TIERS):
+        """
+        :param timecolumn: the datetime column
+        :param tiers: AUTO (tiers for the time between samples of the data) or bucket widths from fine to coarse
+            (pandas timedelta strings), every width has to be a multiple of the previous one
+        """
+        if tiers != AUTO:
+            widths = [pd.Timedelta(name).value for name in tiers]
+            if any(coarse % fine for fine, coarse in zip(widths, widths[1:])):
+                raise ValueError(f"every rollup tier has to be a multiple of the previous one: {tiers}")
+            tiers = tuple(tiers)
+        self.timecolumn = timecolumn
+        self.tier_names = tiers
+        self.tiers = []  # tiers used for the current data (without those that are not coarser than the samples)
+        self.columns = None
+        self.rows = 0  # rows of the data that are rolled up
+        self.first_time = None
+        self.last_time = None
+        self.updates = 0
+        self.lock = threading.Lock()
+
+    def _changed(self, data: TimeIndexedFrame, columns: list) -> bool:
+        if columns != self.columns or len(data) < self.rows:
+            return True
+        return self.rows > 0 and (data.times[0] != self.first_time or data.times[self.rows - 1] != self.last_time)
+
+    def _rebuild(self, data: TimeIndexedFrame, columns: list):
+        self.columns = columns
+        self.rows = 0
+        spacing = np.median(np.diff(data.times[:100000])) if len(data) > 1 else 0
+        if self.tier_names == AUTO:
+            names = tiers_for_spacing(spacing)
+        else:
+            names = [name for name in self.tier_names if pd.Timedelta(name).value >= MIN_REDUCTION * spacing]
+        self.tiers = [RollupTier(name, columns) for name in names]
+        logging.info(f"rollup tiers {[tier.name for tier in self.tiers]} for {len(data)} rows "
+                     f"(median time between samples {pd.Timedelta(spacing)})")
+
+    def update(self, data: TimeIndexedFrame):
+        """
+        Aggregate the rows added to the data since the last update.
+        :param data: all data, sorted by time
+        """
+        columns = [c for c in data.df.columns
+                   if c != self.timecolumn and pd.api.types.is_numeric_dtype(data.df[c].dtype)]
+        with self.lock:
+            if self._changed(data, columns):
+                self._rebuild(data, columns)
+            if not self.tiers or len(data) == self.rows:
+                return
+            for start in range(self.rows, len(data), CHUNK_ROWS):
+                end = min(start + CHUNK_ROWS, len(data))
+                values = data.df[columns].iloc[start:end].to_numpy(dtype=np.float64)
+                missing = np.isnan(values)
+                partial = (data.times[start:end], (~missing).astype(np.int32), values, values,
+                           np.where(missing, 0, values), values)
+                for tier in self.tiers:
+                    # the buckets of a tier are combined from the (new) buckets of the finer tier
+                    partial = reduce_buckets(*partial, tier.width)
+                    tier.merge(*partial)
+            self.rows = len(data)
+            self.first_time = data.times[0]
+            self.last_time = data.times[-1]
+            self.updates += 1
+            logging.debug(f"rollup tiers updated to {self.rows} rows: "
+                          f"{', '.join(f'{tier.name} {len(tier)}' for tier in self.tiers)} buckets")
+
+    def select(self, from_val, to_val, points: int) -> RollupTier:
+        """
+        The coarsest tier that still has at least the given number of buckets in the time range.
+        :param points: points needed (i.e. the width of the chart in pixel)
+        :return: the tier, None if no tier has enough buckets (the samples have to be used)
+        """
+        for tier in reversed(self.tiers):
+            start, end = tier.bucket_range(from_val, to_val)
+            if end - start >= points:
+                return tier
+        return None
+
+    def frame(self, from_val, to_val, points: int, columns: list = None, stat: str = "mean") -> pd.DataFrame:
+        """
+        The data of the time range from the tier selected for the number of points (see select).
+        :param from_val: start time, None for the first bucket
+        :param to_val: end time, None for the last bucket
+        :param points: points needed (i.e. the width of the chart in pixel)
+        :param columns: columns to return, None for all rolled up columns
+        :param stat: "min", "max", "mean" or "last" value per bucket
+        :return: dataframe with the bucket start as time column and the stat of every column, None if the samples
+            have to be used
+        """
+        if stat not in STATS:
+            raise ValueError(f"unknown stat {stat}, use one of {STATS}")
+        with self.lock:
+            tier = self.select(from_val, to_val, points)
+            if tier is None:
+                return None
+            columns = self.columns if columns is None else [c for c in columns if c in self.columns]
+            indices = [self.columns.index(c) for c in columns]
+            start, end = tier.bucket_range(from_val, to_val)
+            df = pd.DataFrame(tier.values(stat, start, end, indices), columns=columns, copy=False)
+            df.insert(0, self.timecolumn, tier.ids[start:end].view("datetime64[ns]"))
+        logging.debug(f"using rollup tier {tier.name}: {len(df)} buckets for {points} points")
+        return df
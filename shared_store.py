@@ -0,0 +1,251 @@
+# Read-only data store shared by the dashboard processes (gunicorn workers).
+# One process (the loader) parses the collected data and publishes it as memory mapped numpy files, the other
+# processes attach to the files instead of parsing the data themselves. The pages of the files are in the page cache
+# only once, no matter how many workers map them.
+#
+#   dashboard_store/meta.json                    version, rows, columns and the state of the source (i.e. csv offset)
+#   dashboard_store/g<generation>-time.npy       timestamps (int64 ns)
+#   dashboard_store/g<generation>-float64.npy    float64 columns (columns x capacity)
+#   dashboard_store/g<generation>-float32.npy    float32 columns (columns x capacity), i.e. the cell voltages
+#
+# The files have room for more rows than published (capacity). New rows are written into the free space and
+# published with a new version in meta.json (append), so a refresh only writes the new rows and the processes keep
+# their mapping and only take a longer view of it. The files are only written again as the next generation when they
+# are full or the data changed otherwise (publish). Processes that still map an older generation keep their mapping
+# (the files are only unlinked).
+#
+# The loader is the process holding the lock file (flock), if it exits another process takes over at its next refresh.
+
+import os
+import json
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows, the store is not used there
+    fcntl = None
+
+STORE_META = "meta.json"
+STORE_FORMAT = 2  # meta data of other formats (i.e. written by an older version) is ignored
+LOCK_FILE = "loader.lock"
+FREE_ROWS = 0.25  # free space of a new generation for appended rows, relative to its rows
+MIN_FREE_ROWS = 20000  # at least this many free rows (about 2 days with a collection period of 10 s)
+
+
+class SharedDataStore:
+    """
+    Publishes a dataframe (loader) and attaches to the latest published version (every process).
+    The attached dataframe is read only (its values are memory mapped), use copies to change it. Its first column is
+    the time column, followed by the float64 and the float32 columns.
+    Only one process may call publish() and append(): the one for which try_become_loader() returned True.
+    """
+
+    def __init__(self, path: str, timecolumn: str = "Zeitstempel"):
+        """
+        :param path: directory of the store files, created if it doesnt exist
+        :param timecolumn: the datetime column
+        """
+        self.path = path
+        self.timecolumn = timecolumn
+        self.lock_file = None
+        self.is_loader = False
+        self.meta = None
+        self.version = None  # attached version
+        self.generation = None  # generation of the mapped arrays
+        self.arrays = None  # mapped arrays of the generation (the whole capacity)
+        self.df = None  # attached dataframe
+        self.attach_count = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def try_become_loader(self) -> bool:
+        """
+        Take the loader lock if no other process holds it.
+        :return: True if this process is the loader
+        """
+        if self.is_loader:
+            return True
+        lock_file = open(os.path.join(self.path, LOCK_FILE), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file  # kept open, the lock is released when the process exits
+        self.is_loader = True
+        logging.info(f"process {os.getpid()} is the data loader of {self.path}")
+        return True
+
+    def read_meta(self) -> dict:
+        """
+        :return: the meta data of the latest version, None if nothing was published yet
+        """
+        try:
+            with open(os.path.join(self.path, STORE_META), "r") as f:
+                meta = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("format") == STORE_FORMAT else None
+
+    def _write_meta(self, meta: dict):
+        # write to a temporary file and replace, so readers never see a half written file
+        with open(os.path.join(self.path, STORE_META + ".tmp"), "w") as f:
+            f.write(json.dumps(meta))
+        os.replace(os.path.join(self.path, STORE_META + ".tmp"), os.path.join(self.path, STORE_META))
+
+    def _file(self, generation: int, part: str) -> str:
+        return os.path.join(self.path, f"g{generation}-{part}.npy")
+
+    def publish(self, df: pd.DataFrame, source: dict = None) -> int:
+        """
+        Write the dataframe as next generation (with free space for appended rows, see append).
+        Columns that are neither numbers nor the time column are left out.
+        :param df: the data, with the time column as datetime, sorted by time
+        :param source: state of the source the data was read from (i.e. file and offset), stored in the meta data
+        :return: the published version
+        """
+        meta = self.read_meta()
+        version = (meta["version"] if meta else 0) + 1
+        generation = (meta["generation"] if meta else 0) + 1
+        float32_columns = [c for c in df.columns if df[c].dtype == np.float32]
+        float64_columns = [c for c in df.columns if c != self.timecolumn and c not in float32_columns
+                           and pd.api.types.is_numeric_dtype(df[c].dtype)]
+        skipped = [c for c in df.columns if c != self.timecolumn and c not in float32_columns + float64_columns]
+        if skipped:
+            logging.warning(f"columns without numbers are not shared: {skipped}")
+
+        # one row per column, so every column is a contiguous block of memory (the free space is not written, the
+        # files are sparse until rows are appended)
+        rows = len(df)
+        capacity = rows + max(MIN_FREE_ROWS, int(rows * FREE_ROWS))
+        timestamps = np.lib.format.open_memmap(self._file(generation, "time"), "w+", np.int64, (capacity,))
+        timestamps[:rows] = df[self.timecolumn].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        timestamps.flush()
+        for part, dtype, columns in (("float64", np.float64, float64_columns), ("float32", np.float32, float32_columns)):
+            values = np.lib.format.open_memmap(self._file(generation, part), "w+", dtype, (len(columns), capacity))
+            for i, column in enumerate(columns):
+                values[i, :rows] = df[column].to_numpy(dtype=dtype)
+            values.flush()
+
+        self._write_meta({"format": STORE_FORMAT, "version": version, "generation": generation, "rows": rows,
+                          "capacity": capacity, "timecolumn": self.timecolumn,
+                          "float64_columns": float64_columns, "float32_columns": float32_columns,
+                          "published": time.time(), "source": source or {}})
+
+        # older generations are no longer needed, processes that still map them keep their mapping
+        for name in os.listdir(self.path):
+            if name[0] in "gv" and name.endswith(".npy") and not name.startswith(f"g{generation}-"):
+                os.remove(os.path.join(self.path, name))
+        logging.info(f"published version {version} ({rows} rows, room for {capacity}) to {self.path}")
+        return version
+
+    def append(self, rows: pd.DataFrame, source: dict = None) -> int:
+        """
+        Publish rows that come after the published rows. Only the new rows are written, into the free space of the
+        files. If they don't fit (no space left, other columns or older times), the published rows and the new rows
+        are published as next generation.
+        :param rows: the new rows, with the time column as datetime
+        :param source: state of the source after the new rows, stored in the meta data
+        :return: the published version
+        """
+        meta = self.read_meta()
+        if meta is None:
+            return self.publish(rows, source)
+        if not len(rows):
+            self._write_meta(dict(meta, source=source or {}))  # nothing new, only the state of the source
+            return meta["version"]
+
+        published = self.attach()
+        start, end = meta["rows"], meta["rows"] + len(rows)
+        times = rows[self.timecolumn].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        columns = [c for c in rows.columns if c != self.timecolumn]
+        fits = (end <= meta["capacity"]
+                and sorted(columns) == sorted(meta["float64_columns"] + meta["float32_columns"])
+                and all(pd.api.types.is_numeric_dtype(rows[c].dtype) for c in columns)
+                and (start == 0 or times[0] >= self.arrays["time"][start - 1]) and np.all(np.diff(times) >= 0))
+        if not fits:
+            df = pd.concat([published, rows], ignore_index=True)
+            if not df[self.timecolumn].is_monotonic_increasing:
+                df = df.sort_values(self.timecolumn, kind="stable", ignore_index=True)
+            return self.publish(df, source)
+
+        # written through a writable mapping of the same files, the other processes see the rows in their mapping
+        for part in ("time", "float64", "float32"):
+            values = np.load(self._file(meta["generation"], part), mmap_mode="r+")
+            if part == "time":
+                values[start:end] = times
+            else:
+                for i, column in enumerate(meta[f"{part}_columns"]):
+                    values[i, start:end] = rows[column].to_numpy(dtype=values.dtype)
+            values.flush()
+        version = meta["version"] + 1
+        self._write_meta(dict(meta, version=version, rows=end, published=time.time(), source=source or {}))
+        logging.debug(f"appended {len(rows)} rows as version {version} to {self.path}")
+        return version
+
+    def attach(self) -> pd.DataFrame:
+        """
+        The latest published version. The files are only mapped again for a new generation, a new version of the
+        same generation (appended rows) is a longer view of the mapped arrays.
+        :return: the dataframe (read only), None if nothing was published yet
+        """
+        for _ in range(3):
+            meta = self.read_meta()
+            if meta is None:
+                return None
+            if meta["version"] == self.version:
+                return self.df
+            try:
+                if meta["generation"] != self.generation:
+                    self.arrays = self._map(meta["generation"])
+                    self.generation = meta["generation"]
+            except FileNotFoundError:
+                continue  # a newer generation was published while mapping, read the meta data again
+            self.df = self._frame(meta)
+            self.meta = meta
+            self.version = meta["version"]
+            self.attach_count += 1
+            logging.debug(f"attached to version {self.version} of {self.path}")
+            return self.df
+        return self.df
+
+    def _map(self, generation: int) -> dict:
+        return {part: np.load(self._file(generation, part), mmap_mode="r") for part in ("time", "float64", "float32")}
+
+    def _frame(self, meta: dict) -> pd.DataFrame:
+        # one frame per dtype, views of the mapped arrays (the transposed arrays are views too), concatenated without
+        # copying: every dtype stays one block. The time column comes first, a column of another dtype between the
+        # float64 columns would split them into two blocks and concat would copy them into one
+        rows = meta["rows"]
+        frames = [pd.DataFrame({self.timecolumn: self.arrays["time"][:rows].view("datetime64[ns]")}, copy=False),
+                  pd.DataFrame(self.arrays["float64"][:, :rows].T, columns=meta["float64_columns"], copy=False)]
+        if meta["float32_columns"]:
+            frames.append(pd.DataFrame(self.arrays["float32"][:, :rows].T, columns=meta["float32_columns"],
+                                       copy=False))
+        return pd.concat(frames, axis=1, copy=False)
+
+    def wait_for_version(self, timeout: float) -> pd.DataFrame:
+        """
+        Wait until the loader published the data (used by the other processes at startup).
+        :return: the dataframe, None if nothing was published within the timeout
+        """
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            df = self.attach()
+            if df is not None:
+                return df
+            time.sleep(0.5)
+        return None
+
+
+def create_store(path: str, timecolumn: str) -> SharedDataStore:
+    """
+    :return: the store, None if it can't be used on this system (no flock)
+    """
+    if fcntl is None:
+        logging.info("no shared data store on this system, every process reads the data itself")
+        return None
+    return SharedDataStore(path, timecolumn)
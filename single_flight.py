@@ -0,0 +1,86 @@
+# Computations shared by concurrent callbacks: a result is computed once per key, callers that ask for the same key
+# while it is computed wait for that computation instead of starting their own.
+
+import threading
+from collections import OrderedDict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function at most once at a time per key. Concurrent calls with the same key get the result
+    (or the exception) of the running call.
+    """
+
+    def __init__(self):
+        self.calls = {}  # key -> running _Call
+        self.shared = 0  # calls that waited for the result of another call
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            running = call is not None
+            if running:
+                self.shared += 1
+            else:
+                call = self.calls[key] = _Call()
+        if running:
+            call.done.wait()
+        else:
+            try:
+                call.result = function()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class SharedResults:
+    """
+    The last results by key (LRU), computed with SingleFlight: every result is only computed once, even if
+    several callbacks ask for it at the same time. The results are shared, they must not be changed.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.single_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        :param key: hashable key, including everything the result depends on (i.e. the data version)
+        :param compute: function without arguments that computes the result
+        """
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+        return self.single_flight.do(key, lambda: self._compute(key, compute))
+
+    def _compute(self, key, compute):
+        with self.lock:
+            if key in self.results:  # computed by a call that finished just before this one started
+                return self.results[key]
+        result = compute()
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
@@ -0,0 +1,94 @@
+# Snapshot of the parsed csv file (feather file, with the types of the parsed columns), so a restarted dashboard
+# doesn't parse the whole csv file again: the snapshot is read and only the rows appended since it was written are
+# parsed (see IncrementalCsvReader).
+#
+#   snapshot/data.feather   the parsed rows
+#   snapshot/meta.json      state of the reader (inode, offset, header), size and mtime of the csv file, schema hash
+#
+# A snapshot is only used for the same csv file (same inode and header, at least as large as when the snapshot was
+# written) and the same parser and column types (schema hash). If the csv file has the size and mtime of the snapshot,
+# nothing is parsed at all.
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+import pandas as pd
+
+SNAPSHOT_FILE = "data.feather"
+SNAPSHOT_META = "meta.json"
+SNAPSHOT_INTERVAL = 3600  # seconds between snapshots of the appended rows (a full read is always saved)
+
+
+def schema_hash(header_line: bytes, parser: str, column_types: str) -> str:
+    """
+    Hash of everything the types of the parsed columns depend on: the header of the csv file, the parser and the
+    rules for the column types.
+    """
+    return hashlib.sha1(header_line + parser.encode() + column_types.encode()).hexdigest()
+
+
+class CsvSnapshot:
+    """
+    Writes and reads the snapshot of one csv file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: directory of the snapshot, created if it doesnt exist
+        """
+        self.path = path
+        self.saved = 0  # time of the last save
+        self.loads = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def load(self, csv_path: str, schema: str) -> tuple:
+        """
+        :param csv_path: the csv file
+        :param schema: schema_hash of the reader
+        :return: dataframe and state of the reader (see IncrementalCsvReader.resume), None, None if there is no
+            snapshot that fits the csv file
+        """
+        try:
+            with open(os.path.join(self.path, SNAPSHOT_META), "r") as f:
+                meta = json.loads(f.read())
+            stat = os.stat(csv_path)
+        except (OSError, ValueError):
+            return None, None
+        state = meta["state"]
+        if (state["path"] != csv_path or meta["schema"] != schema or state["inode"] != stat.st_ino
+                or stat.st_size < state["offset"]):
+            logging.info(f"snapshot in {self.path} doesnt fit {csv_path}, reading it completely")
+            return None, None
+        try:
+            df = pd.read_feather(os.path.join(self.path, SNAPSHOT_FILE))
+        except (OSError, ValueError) as e:  # missing or half written (i.e. power loss)
+            logging.warning(f"snapshot in {self.path} can't be read: {e}")
+            return None, None
+        if len(df) != meta["rows"]:
+            return None, None
+        unchanged = stat.st_size == meta["size"] and stat.st_mtime_ns == meta["mtime_ns"]
+        appended = "csv unchanged" if unchanged else f"{stat.st_size - state['offset']} bytes appended since"
+        logging.info(f"read snapshot of {csv_path}: {len(df)} rows, {appended}")
+        self.loads += 1
+        self.saved = time.time()  # the snapshot is recent, the next save is after the interval
+        return df, state
+
+    def save(self, df: pd.DataFrame, state: dict, schema: str, stat: os.stat_result):
+        """
+        :param df: all parsed rows
+        :param state: state of the reader that parsed them
+        :param stat: os.stat of the csv file when it was read
+        """
+        pid = os.getpid()  # several processes without shared store can save at the same time
+        df.reset_index(drop=True).to_feather(os.path.join(self.path, f"{SNAPSHOT_FILE}.{pid}.tmp"))
+        os.replace(os.path.join(self.path, f"{SNAPSHOT_FILE}.{pid}.tmp"), os.path.join(self.path, SNAPSHOT_FILE))
+        meta = {"state": state, "schema": schema, "rows": len(df), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "saved": time.time()}
+        with open(os.path.join(self.path, f"{SNAPSHOT_META}.{pid}.tmp"), "w") as f:
+            f.write(json.dumps(meta))
+        os.replace(os.path.join(self.path, f"{SNAPSHOT_META}.{pid}.tmp"), os.path.join(self.path, SNAPSHOT_META))
+        self.saved = time.time()
+        logging.info(f"saved snapshot of {state['path']}: {len(df)} rows")
@@ -0,0 +1,54 @@
+# Tests of the calendar buckets of the rangeslider.
+#   python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+from calendar_index import CalendarIndex, granularity_for  # noqa: E402
+
+
+def create_times() -> np.ndarray:
+    # 10 days every 10 minutes, without data on the 4th day
+    times = pd.date_range("2030-01-01", "2030-01-10 23:50", freq="10min")
+    times = times[times.normalize() != pd.Timestamp("2030-01-04")]
+    return times.to_numpy().view(np.int64)
+
+
+def test_clamp_keeps_the_values_within_the_buckets():
+    times = create_times()
+    slider = CalendarIndex(times).slider(pd.Timestamp(times[0]), pd.Timestamp(times[-1]))
+    assert slider.granularity == "day" and len(slider) == 9  # no step for the day without data
+    assert slider.clamp(0, 8) == (0, 8)
+    assert slider.clamp(2, 13) == (2, 8)  # set for more steps before the data was reloaded
+    assert slider.clamp(11, 13) == (8, 8)
+    assert slider.clamp(-1, 3) == (0, 3)
+    assert slider.clamp(5, 2) == (5, 5)  # the end is never before the start
+    assert slider.clamp(1.0, 4.0) == (1, 4)
+
+    empty = CalendarIndex(times).slider(pd.Timestamp("2031-01-01"), pd.Timestamp("2031-02-01"))
+    assert len(empty) == 0 and empty.clamp(0, 5) == (None, None)
+
+
+def test_time_and_row_range_of_the_buckets():
+    times = create_times()
+    # the slider starts and ends within a day: the first and last bucket are cut to the range
+    from_val, to_val = pd.Timestamp("2030-01-02 12:00"), pd.Timestamp("2030-01-06 06:00")
+    slider = CalendarIndex(times).slider(from_val, to_val)
+    assert slider.labels() == ["02/01/30", "03/01/30", "05/01/30", "06/01/30"]
+    assert slider.time_range(0, 3) == (from_val, to_val)
+    assert slider.time_range(1, 2) == (pd.Timestamp("2030-01-03"), pd.Timestamp("2030-01-06") - pd.Timedelta(1))
+    first, end = slider.row_range(1, 2)
+    assert pd.Timestamp(times[first]) == pd.Timestamp("2030-01-03") and \
+        pd.Timestamp(times[end - 1]) == pd.Timestamp("2030-01-05 23:50") and end - first == 2 * 144
+
+
+def test_granularity_for_the_timespan():
+    assert granularity_for(pd.Timedelta(90, "min")) == "minute"
+    assert granularity_for(pd.Timedelta(1, "d")) == "hour"
+    assert granularity_for(pd.Timedelta(14, "d")) == "day"
+    assert granularity_for(pd.Timedelta(180, "d")) == "month"
@@ -0,0 +1,75 @@
+# Tests of the incremental reading of the csv file of the data collection.
+#   python -m pytest tests
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+from data_loader import IncrementalCsvReader  # noqa: E402
+
+HEADER = "Zeitstempel;Ladezustand [%];Voltage Module1 Cell001\n"
+
+
+def rows(start: int, count: int, soc: float = 50.0) -> str:
+    times = pd.date_range("2030-01-01", periods=start + count, freq="10s")[start:]
+    return "".join(f"{time:%Y-%m-%d %H:%M:%S.%f};{soc + i % 10};{3300 + i}\n"
+                   for i, time in zip(range(start, start + count), times))
+
+
+def write(path, text: str, mode: str = "w"):
+    with open(path, mode) as f:
+        f.write(text)
+
+
+@pytest.fixture(params=["pandas", "pyarrow"])
+def reader(request, tmp_path):
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    path = tmp_path / "data.csv"
+    write(path, HEADER + rows(0, 100))
+    return IncrementalCsvReader(str(path), parser=request.param)
+
+
+def test_only_appended_rows_are_parsed(reader):
+    assert len(reader.read()) == 100 and reader.full_reads == 1
+    assert reader.read_new_rows() == (None, False)
+
+    text = rows(100, 20)
+    write(reader.path, text + "2030-01-01 00:20:00.000000;5", "a")  # the last row is still being written
+    df = reader.read()
+    assert len(df) == 120 and reader.full_reads == 1 and reader.incremental_reads == 1
+    assert df["Zeitstempel"].iloc[-1] == pd.Timestamp("2030-01-01 00:19:50")
+
+    write(reader.path, "0.0;3420\n", "a")  # the rest of the row
+    df = reader.read()
+    assert len(df) == 121 and reader.full_reads == 1 and df["Ladezustand [%]"].iloc[-1] == 50.0
+    assert df["Zeitstempel"].is_monotonic_increasing
+
+
+def test_truncated_file_is_read_completely(reader):
+    reader.read()
+    write(reader.path, HEADER + rows(0, 10, soc=20.0))  # same inode, smaller than the parsed part
+    df = reader.read()
+    assert len(df) == 10 and reader.full_reads == 2 and df["Ladezustand [%]"].iloc[0] == 20.0
+
+
+def test_replaced_file_is_read_completely(reader, tmp_path):
+    reader.read()
+    # rotated: a new file (other inode) that is larger than the parsed part, with the same header
+    new_path = tmp_path / "new.csv"
+    write(new_path, HEADER + rows(0, 150, soc=20.0))
+    os.replace(new_path, reader.path)
+    df = reader.read()
+    assert len(df) == 150 and reader.full_reads == 2 and df["Ladezustand [%]"].iloc[0] == 20.0
+
+    # rewritten in place with another header (i.e. a new column)
+    write(reader.path, HEADER.rstrip("\n") + ";Netzbezug Energie [Wh]\n"
+          + "".join(line + ";1.0\n" for line in rows(0, 150).splitlines()))
+    df = reader.read()
+    assert reader.full_reads == 3 and list(df.columns)[-1] == "Netzbezug Energie [Wh]" and len(df) == 150
+    new_rows, full_read = reader.read_new_rows()
+    assert new_rows is None and not full_read
@@ -0,0 +1,58 @@
+# Tests of the csv writer of the data collection together with the csv reader of the dashboard.
+#   python -m pytest tests
+
+import os
+import sys
+import csv
+import shutil
+import logging
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "data_logging_scripts"))
+from data_writers import CsvAppender  # noqa: E402
+from data_loader import IncrementalCsvReader  # noqa: E402
+
+SAMPLE_CSV = os.path.join(ROOT, "data", "REP_fenecon_voltage_data_v5_test.csv")
+
+
+def read_header(path: str) -> list:
+    with open(path, "r", newline='') as f:
+        return next(csv.reader(f, delimiter=";"))
+
+
+def test_rows_after_header_migration_have_the_width_of_the_header(tmp_path, caplog):
+    path = str(tmp_path / "fenecon_voltage_data.csv")
+    shutil.copy(SAMPLE_CSV, path)
+    old_header = read_header(path)
+    # the collector no longer writes the unnamed index column and one of the old columns, and adds a new one
+    fields = [name for name in old_header if name and name != old_header[-1]] + ["New Column"]
+
+    writer = CsvAppender(path)
+    for i in range(3):
+        writer.write_row(fields, [datetime(2030, 1, 1, 0, i)] + [1.0] * (len(fields) - 1))
+    writer.close()
+
+    header = read_header(path)
+    assert header[:len(fields)] == fields
+    assert sorted(header[len(fields):]) == sorted(["", old_header[-1]])
+    with open(path, "r", newline='') as f:
+        assert all(len(row) == len(header) for row in csv.reader(f, delimiter=";"))
+
+    # the typed parser reads the file without falling back to the pandas parser
+    with caplog.at_level(logging.WARNING):
+        df = IncrementalCsvReader(path, parser="pyarrow").read()
+    assert "using the pandas parser" not in caplog.text
+    assert df["New Column"].notna().sum() == 3
+    assert df["Zeitstempel"].iloc[-1] == datetime(2030, 1, 1, 0, 2)
+
+    # and the rows appended by a restarted collector (header already migrated) too
+    writer = CsvAppender(path)
+    writer.write_row(fields, [datetime(2030, 1, 1, 0, 3)] + [2.0] * (len(fields) - 1))
+    writer.close()
+    reader = IncrementalCsvReader(path, parser="pyarrow")
+    with caplog.at_level(logging.WARNING):
+        df = reader.read()
+    assert "using the pandas parser" not in caplog.text
+    assert df["New Column"].iloc[-1] == 2.0
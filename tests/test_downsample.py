@@ -0,0 +1,80 @@
+# Tests of the downsampling of line traces (minmax and lttb).
+#   python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+from downsample import downsample  # noqa: E402
+
+
+def create_traces(rows: int = 10007) -> tuple:
+    rng = np.random.default_rng(3)
+    x = pd.date_range("2030-01-01", periods=rows, freq="10s").to_numpy()
+    cell = (3300 + np.cumsum(rng.normal(0, 1, rows))).astype(np.float32)
+    cell[rows // 8] = 3600  # a voltage spike
+    soc = np.cumsum(rng.normal(0, 0.1, rows)) + 50
+    soc[rows // 20:rows // 14] = np.nan  # missing values
+    return x, [cell, soc]
+
+
+def lttb_reference(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # largest triangle three buckets point by point, with the buckets of downsample.lttb_indices
+    n = len(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = [0]
+    for b in range(n_out - 2):
+        if b + 1 < n_out - 2:
+            next_x, next_y = x[edges[b + 1]:edges[b + 2]].mean(), y[edges[b + 1]:edges[b + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        a = selected[-1]
+        areas = [abs((x[a] - next_x) * (y[i] - y[a]) - (x[a] - x[i]) * (next_y - y[a]))
+                 for i in range(edges[b], edges[b + 1])]
+        selected.append(edges[b] + int(np.argmax(areas)))
+    return np.array(selected + [n - 1])
+
+
+def test_minmax_keeps_min_and_max_of_every_bucket():
+    x, ys = create_traces()
+    result = downsample(x, ys, n_out=200, mode="minmax")
+    buckets = 99
+    size = -(-len(x) // buckets)
+    for (x_out, y_out), y in zip(result, ys):
+        assert len(x_out) == len(y_out) == 200 and np.all(np.diff(x_out) >= np.timedelta64(0))
+        assert x_out[0] == x[0] and x_out[-1] == x[-1]
+        for bucket in range(buckets):
+            values = y[bucket * size:(bucket + 1) * size]
+            kept = y_out[1 + 2 * bucket:3 + 2 * bucket]
+            if np.all(np.isnan(values)):
+                continue
+            assert np.nanmin(kept) == np.nanmin(values) and np.nanmax(kept) == np.nanmax(values)
+    assert 3600 in result[0][1]  # the spike is kept
+    assert result[0][1].dtype == np.float32
+
+
+def test_lttb_equals_point_by_point_version():
+    x, ys = create_traces(5003)
+    numbers = (x - x[0]).astype(np.int64).astype(np.float64)
+    ys = [ys[0], np.sin(np.arange(len(x)) / 100.0)]
+    result = downsample(x, ys, n_out=300, mode="lttb")
+    for (x_out, y_out), y in zip(result, ys):
+        indices = lttb_reference(numbers, y.astype(np.float64), 300)
+        np.testing.assert_array_equal(x_out, x[indices])
+        np.testing.assert_array_equal(y_out, y[indices])
+    assert 3600 in result[0][1]
+
+
+def test_short_traces_and_off_are_not_changed():
+    x, ys = create_traces(100)
+    for mode in ("minmax", "lttb"):
+        assert all(y_out is y for (_, y_out), y in zip(downsample(x, ys, n_out=100, mode=mode), ys))
+    x, ys = create_traces()
+    assert all(y_out is y for (_, y_out), y in zip(downsample(x, ys, n_out=100, mode="off"), ys))
+    with pytest.raises(ValueError):
+        downsample(x, ys, mode="average")
@@ -0,0 +1,82 @@
+# Tests of the circuit breaker of the FEMS client.
+#   python -m pytest tests
+
+import os
+import sys
+import time
+import threading
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "data_logging_scripts"))
+from fems_client import CircuitBreaker  # noqa: E402
+
+
+def run_in_thread(function) -> list:
+    # the result of function() in another thread, the trial request belongs to the thread that got it
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join(5)
+    return result
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_cycle(False)
+
+
+def test_opens_after_failed_cycles_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=2, reset_time=60)
+    breaker.record_cycle(False)
+    breaker.record_cycle(True)  # a cycle with values in between starts the count again
+    breaker.record_cycle(False)
+    assert not breaker.is_open and breaker.allow_request()
+    breaker.record_failure()  # failed requests of a closed breaker don't count
+    breaker.record_cycle(False)
+    assert breaker.is_open and breaker.rejects_requests and not breaker.allow_request()
+
+
+def test_half_open_trial_closes_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_time=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.is_open and not breaker.rejects_requests  # half open
+    assert breaker.allow_request()  # the trial
+
+    # another request waits for the result of the trial
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(breaker.allow_request(wait=5)))
+    waiting.start()
+    time.sleep(0.05)
+    assert not results
+    breaker.record_success()
+    waiting.join(5)
+    assert results == [True] and not breaker.is_open and breaker.failures == 0
+
+
+def test_failed_trial_opens_the_breaker_with_twice_the_reset_time():
+    breaker = CircuitBreaker(failure_threshold=1, reset_time=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(breaker.allow_request(wait=5)))
+    waiting.start()
+    time.sleep(0.05)
+    breaker.record_failure()
+    waiting.join(5)
+    assert results == [False] and breaker.rejects_requests and breaker.reset_time == 0.1
+
+
+def test_waiting_for_a_trial_without_result_ends():
+    breaker = CircuitBreaker(failure_threshold=1, reset_time=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow_request()  # the trial never records a result
+    start = time.monotonic()
+    assert run_in_thread(lambda: breaker.allow_request(wait=0.1)) == [False]
+    assert time.monotonic() - start < 1
+
+    # the trial ended with another exception: the next request becomes the trial
+    breaker.release_trial()
+    assert run_in_thread(lambda: breaker.allow_request(wait=0.1)) == [True]
@@ -0,0 +1,67 @@
+# Tests of the rollup tiers (buckets for long time ranges).
+#   python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+from rollup import RollupTiers, tiers_for_spacing  # noqa: E402
+from time_index import TimeIndexedFrame  # noqa: E402
+
+
+def create_data(rows: int, freq: str = "10s") -> pd.DataFrame:
+    values = np.sin(np.arange(rows) / 50.0) * 100
+    values[::7] = np.nan  # missing values
+    return pd.DataFrame({"Zeitstempel": pd.date_range("2030-01-01", periods=rows, freq=freq),
+                         "Ladezustand [%]": values})
+
+
+def test_tiers_for_the_time_between_samples():
+    seconds = pd.Timedelta("1s").value
+    assert tiers_for_spacing(10 * seconds) == ["1min", "5min", "30min", "2h", "12h", "1d"]
+    assert tiers_for_spacing(600 * seconds) == ["1h", "6h", "1d"]
+    assert tiers_for_spacing(seconds) == ["5s", "30s", "2min", "10min", "1h", "6h", "1d"]
+    assert tiers_for_spacing(pd.Timedelta("1d").value) == []
+
+
+def test_configured_tiers_are_kept_if_coarse_enough():
+    rollups = RollupTiers(tiers=["1min", "15min", "1h", "1d"])
+    rollups.update(TimeIndexedFrame(create_data(1000, "10min")))
+    assert [tier.name for tier in rollups.tiers] == ["1h", "1d"]
+    with pytest.raises(ValueError):
+        RollupTiers(tiers=["15min", "1h", "90min"])
+
+
+def test_incremental_update_equals_rollup_of_all_rows():
+    data = create_data(20000)
+    incremental = RollupTiers()
+    for end in (5000, 5003, 12000, 20000):  # the last bucket is still filling up at every update
+        incremental.update(TimeIndexedFrame(data.iloc[:end]))
+    complete = RollupTiers()
+    complete.update(TimeIndexedFrame(data))
+
+    assert [tier.name for tier in incremental.tiers] == ["1min", "5min", "30min", "2h", "12h", "1d"]
+    for tier, expected in zip(incremental.tiers, complete.tiers):
+        for stat in ("ids", "count", "min", "max", "last"):
+            np.testing.assert_array_equal(getattr(tier, stat), getattr(expected, stat))
+        np.testing.assert_allclose(tier.sum, expected.sum)
+
+    # the mean of a bucket is the mean of its samples without the missing values
+    half_hourly = data.set_index("Zeitstempel")["Ladezustand [%]"].resample("30min").mean().to_numpy(dtype=np.float32)
+    np.testing.assert_allclose(incremental.tiers[2].values("mean", 0, None, [0])[:, 0], half_hourly, rtol=1e-5)
+
+
+def test_select_uses_the_coarsest_tier_with_enough_buckets():
+    rollups = RollupTiers()
+    rollups.update(TimeIndexedFrame(create_data(20000)))  # ~2.3 days
+    start, end = pd.Timestamp("2030-01-01"), pd.Timestamp("2030-01-03")
+    assert rollups.select(start, end, 500).name == "5min"
+    assert rollups.select(start, end, 50).name == "30min"
+    assert rollups.select(start, end, 5000) is None  # the samples are used
+    df = rollups.frame(start, end, 500)
+    assert list(df.columns) == ["Zeitstempel", "Ladezustand [%]"] and len(df) == 24 * 12 * 2 + 1
@@ -0,0 +1,77 @@
+# Tests of the periodic scheduler of the data collection (on a simulated monotonic clock).
+#   python -m pytest tests
+
+import os
+import sys
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "data_logging_scripts"))
+import scheduler  # noqa: E402
+from scheduler import PeriodicScheduler  # noqa: E402
+
+
+class SimulatedClock:
+    """
+    Monotonic clock and stop event of the scheduler: waiting moves the clock forward instead of sleeping.
+    """
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.stopped = False
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def wait(self, timeout: float) -> bool:
+        self.now += timeout
+        return self.stopped
+
+    def is_set(self) -> bool:
+        return self.stopped
+
+    def set(self):
+        self.stopped = True
+
+
+def run_ticks(monkeypatch, period: float, durations: list) -> tuple:
+    """
+    Run the scheduler for one tick per duration, every tick takes its duration on the clock.
+    :return: start times of the ticks relative to the first one, and the scheduler
+    """
+    clock = SimulatedClock()
+    monkeypatch.setattr(scheduler, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    periodic = PeriodicScheduler(period, log_every=1000)
+    periodic.stop_event = clock
+    starts = []
+
+    def task():
+        starts.append(clock.now)
+        duration = durations[len(starts) - 1]
+        clock.now += abs(duration)
+        if len(starts) == len(durations):
+            periodic.stop()
+        if duration < 0:
+            raise RuntimeError("task failed")
+
+    periodic.run(task)
+    return [start - starts[0] for start in starts], periodic
+
+
+def test_ticks_dont_drift(monkeypatch):
+    # the time the task takes is not added to the period
+    starts, periodic = run_ticks(monkeypatch, 10, [0.1, 3.7, 9.9, 0.0] * 250)
+    assert starts == [10.0 * n for n in range(1000)]
+    assert periodic.ticks == 1000 and periodic.skipped_ticks == 0 and periodic.max_lag == 0
+
+
+def test_missed_ticks_are_skipped(monkeypatch):
+    # the third tick takes 2.5 periods: the ticks at 3 and 4 are skipped, the next one runs at 5 (not late at 4.5)
+    starts, periodic = run_ticks(monkeypatch, 1, [0.25, 0.25, 2.5, 0.25, 0.25])
+    assert starts == [0, 1, 2, 5, 6]
+    assert periodic.skipped_ticks == 2 and periodic.overruns == 1 and periodic.last_duration == 0.25
+
+
+def test_failing_task_keeps_the_schedule(monkeypatch):
+    starts, periodic = run_ticks(monkeypatch, 5, [0.5, -0.5, 0.5])  # the second tick raises an exception
+    assert starts == [0, 5, 10] and periodic.ticks == 3
@@ -0,0 +1,58 @@
+# Tests of the shared data store of the dashboard processes (loader and attached processes).
+#   python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+import shared_store  # noqa: E402
+from shared_store import SharedDataStore  # noqa: E402
+
+
+def create_rows(start: int, count: int) -> pd.DataFrame:
+    df = pd.DataFrame({"Unnamed: 0": np.arange(start, start + count, dtype=np.int64),
+                       "Zeitstempel": pd.date_range("2030-01-01", periods=start + count, freq="10s")[start:],
+                       "Ladezustand [%]": np.arange(start, start + count, dtype=np.float64)})
+    df["Voltage Module1 Cell001"] = np.full(count, 3.3, dtype=np.float32)
+    return df
+
+
+def test_non_loader_sees_appended_rows_in_the_same_mapping(tmp_path):
+    loader = SharedDataStore(str(tmp_path))
+    worker = SharedDataStore(str(tmp_path))
+    assert loader.try_become_loader() and not worker.try_become_loader()
+    loader.publish(create_rows(0, 100))
+    df = worker.attach()
+    assert list(df.columns) == ["Zeitstempel", "Unnamed: 0", "Ladezustand [%]", "Voltage Module1 Cell001"]
+    generation = worker.generation
+
+    loader.append(create_rows(100, 50), {"offset": 150})
+    df = worker.attach()
+    assert len(df) == 150 and worker.generation == generation and worker.meta["source"] == {"offset": 150}
+    pd.testing.assert_frame_equal(df, create_rows(0, 150)[df.columns], check_dtype=False)
+    # every column is a view of the mapped files, nothing is copied
+    assert np.shares_memory(df["Zeitstempel"].to_numpy(), worker.arrays["time"])
+    for column in ("Unnamed: 0", "Ladezustand [%]"):
+        assert np.shares_memory(df[column].to_numpy(), worker.arrays["float64"])
+    assert np.shares_memory(df["Voltage Module1 Cell001"].to_numpy(), worker.arrays["float32"])
+
+
+def test_rows_that_dont_fit_are_published_as_next_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store, "MIN_FREE_ROWS", 10)
+    store = SharedDataStore(str(tmp_path))
+    store.publish(create_rows(0, 100))
+    generation = store.meta["generation"] if store.attach() is not None else None
+
+    store.append(create_rows(100, 50))  # more than the free space
+    df = store.attach()
+    assert store.generation == generation + 1
+    pd.testing.assert_frame_equal(df, create_rows(0, 150)[df.columns], check_dtype=False)
+    assert sorted(os.listdir(tmp_path)) == sorted(f"g{store.generation}-{part}.npy"
+                                                  for part in ("time", "float64", "float32")) + ["meta.json"]
+
+    store.append(create_rows(10, 5))  # older rows
+    assert store.attach()["Zeitstempel"].is_monotonic_increasing and len(store.df) == 155
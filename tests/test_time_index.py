@@ -0,0 +1,55 @@
+# Tests of the time range access by binary search (TimeIndexedFrame).
+#   python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+from time_index import TimeIndexedFrame  # noqa: E402
+
+
+def create_data(rows: int = 1000) -> pd.DataFrame:
+    # irregular timestamps with duplicates (i.e. two samples in the same second)
+    rng = np.random.default_rng(1)
+    times = pd.Timestamp("2030-01-01") + pd.to_timedelta(np.cumsum(rng.integers(0, 600, rows)), unit="s")
+    return pd.DataFrame({"Zeitstempel": times, "Ladezustand [%]": np.arange(rows, dtype=np.float64)})
+
+
+def test_slice_equals_the_rows_in_the_range():
+    df = create_data()
+    data = TimeIndexedFrame(df)
+    times = df["Zeitstempel"]
+    for from_val, to_val in [(times[10], times[500]), (times[3] - pd.Timedelta("1s"), times[3]),
+                             ("2029-12-31", "2030-01-02 12:00"), (times[999], "2031-01-01"),
+                             ("2031-01-01", "2031-02-01")]:
+        expected = df[(times >= pd.Timestamp(from_val)) & (times <= pd.Timestamp(to_val))]
+        pd.testing.assert_frame_equal(data.slice(from_val, to_val), expected)  # both ends included
+    assert len(data.slice()) == 1000 and len(data.slice(None, times[9])) == len(df[times <= times[9]])
+    # a view of the data, nothing is copied
+    assert np.shares_memory(data.slice(times[10], times[500])["Ladezustand [%]"].to_numpy(),
+                            df["Ladezustand [%]"].to_numpy())
+
+
+def test_unsorted_data_is_sorted_once():
+    df = create_data()
+    shuffled = df.sample(frac=1, random_state=2).reset_index(drop=True)
+    data = TimeIndexedFrame(shuffled)
+    assert data.df["Zeitstempel"].is_monotonic_increasing and len(data) == 1000
+    assert data.first_time() == df["Zeitstempel"].min() and data.last_time() == df["Zeitstempel"].max()
+
+
+def test_last_days_relative_to_the_newest_row():
+    df = create_data()
+    data = TimeIndexedFrame(df)
+    newest = df["Zeitstempel"].iloc[-1]
+    pd.testing.assert_frame_equal(data.last_days(1.5), df[df["Zeitstempel"] >= newest - pd.Timedelta(days=1.5)])
+    assert data.last_days(None) is df
+
+    last_two_days = data.sub_index(2)
+    pd.testing.assert_frame_equal(last_two_days.df, data.last_days(2))
+    pd.testing.assert_frame_equal(last_two_days.last_days(1), data.last_days(1))
+    assert len(TimeIndexedFrame(df.iloc[:0]).last_days(3)) == 0
@@ -0,0 +1,66 @@
+# Time range access to the collected data by binary search on the sorted timestamps.
+
+import numpy as np
+import pandas as pd
+
+
+def to_ns(value) -> int:
+    # timestamps are compared as int64 nanoseconds (same as datetime64[ns])
+    return pd.Timestamp(value).value
+
+
+class TimeIndexedFrame:
+    """
+    The data sorted by time with the timestamps as int64 array. Time ranges are found with searchsorted
+    (O(log n)) and returned as row slices of the dataframe (views, no copy of the data).
+    The returned dataframes must not be changed in place, they share the memory with the whole data.
+    """
+
+    def __init__(self, df: pd.DataFrame, timecolumn: str = "Zeitstempel", is_sorted: bool = False):
+        """
+        :param df: the data with the time column as datetime, sorted by time if possible (otherwise it is sorted once)
+        :param timecolumn: the datetime column
+        :param is_sorted: the data is known to be sorted (skips the check)
+        """
+        self.timecolumn = timecolumn
+        if not is_sorted and not df[timecolumn].is_monotonic_increasing:
+            # i.e. the clock was set back (daylight saving time ends)
+            df = df.sort_values(timecolumn, kind="stable", ignore_index=True)
+        self.df = df
+        self.times = df[timecolumn].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def first_time(self) -> pd.Timestamp:
+        return pd.Timestamp(self.times[0])
+
+    def last_time(self) -> pd.Timestamp:
+        return pd.Timestamp(self.times[-1])
+
+    def slice(self, from_val=None, to_val=None) -> pd.DataFrame:
+        """
+        The rows with from_val <= time <= to_val.
+        :param from_val: start time (anything pd.Timestamp accepts), None for the first row
+        :param to_val: end time, None for the last row
+        :return: view of the rows in the range
+        """
+        start = 0 if from_val is None else np.searchsorted(self.times, to_ns(from_val), side="left")
+        end = len(self.times) if to_val is None else np.searchsorted(self.times, to_ns(to_val), side="right")
+        return self.df.iloc[start:end]
+
+    def last_days(self, days: float) -> pd.DataFrame:
+        """
+        The rows of the last x days, relative to the newest row.
+        :return: view of the rows
+        """
+        if days is None or not len(self.times):
+            return self.df
+        to_val = self.last_time()
+        return self.slice(to_val - pd.Timedelta(days=days), to_val)
+
+    def sub_index(self, days: float) -> "TimeIndexedFrame":
+        """
+        Index of the last x days, to slice further within them without searching the whole data again.
+        """
+        return TimeIndexedFrame(self.last_days(days), self.timecolumn, is_sorted=True)
@@ -0,0 +1,157 @@
+# Time spent per callback and stage (load, slice, transform, figure build, serialize), to find out what makes a
+# refresh slow. A stage is timed with "with timings.stage(name):" anywhere in the code called by a callback, the time
+# of nested stages is only counted for the inner stage. The time of a callback that is not in a stage is "other".
+# Only a perf_counter call and a few dict updates per stage, cheap enough to leave enabled.
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+NO_CALLBACK = "(no callback)"  # stages outside of a callback, i.e. the data loading at startup
+STAGE_ORDER = ("load", "slice", "transform", "figure_build", "serialize", "other", "total")  # columns of format_table
+
+
+class _Run:
+    # stages of the running callback of a thread
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.stages = {}  # stage -> seconds (without nested stages)
+        self.stack = []  # [stage, start, seconds of nested stages]
+
+
+class CallbackTimings:
+    """
+    Times of the stages of every callback: number of calls, total, last and max milliseconds per stage, and the
+    bytes of the responses.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.callbacks = {}  # callback -> {"calls", "stages": {stage -> stats}, "response_bytes": stats}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def timed(self, callback):
+        """
+        Decorator for a callback, to collect the times of the stages while it runs.
+        """
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return callback(*args, **kwargs)
+            run = self.local.run = _Run(callback.__name__)
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                run.end = time.perf_counter()
+                total = run.end - run.start
+                run.stages["other"] = max(total - sum(run.stages.values()), 0.0)
+                run.stages["total"] = total
+                self._add(run.name, run.stages)
+                self.local.run = None
+                self.local.finished = run
+        return wrapper
+
+    @contextmanager
+    def stage(self, name: str):
+        run = getattr(self.local, "run", None) if self.enabled else None
+        if run is None and self.enabled:
+            # not in a callback: timed on its own
+            run = _Run(NO_CALLBACK)
+            self.local.run, outside = run, True
+        else:
+            outside = False
+        if run is None:
+            yield
+            return
+        entry = [name, time.perf_counter(), 0.0]
+        run.stack.append(entry)
+        try:
+            yield
+        finally:
+            run.stack.pop()
+            elapsed = time.perf_counter() - entry[1]
+            run.stages[name] = run.stages.get(name, 0.0) + elapsed - entry[2]
+            if run.stack:
+                run.stack[-1][2] += elapsed
+            if outside:
+                self.local.run = None
+                self._add(NO_CALLBACK, run.stages, calls=0)  # the average is per run of the stage
+
+    def finished_callback(self):
+        """
+        The last callback that finished in this thread (name, end time), once. Used after the response is built,
+        to add the time for serializing it.
+        """
+        run = getattr(self.local, "finished", None)
+        self.local.finished = None
+        return (run.name, run.end) if run is not None else (None, None)
+
+    def end_request(self):
+        """
+        Forget the callback of the request that ended in this thread, so it isn't credited to the next request.
+        """
+        self.local.run = None
+        self.local.finished = None
+
+    def add_response(self, name: str, serialize_seconds: float, nbytes: int):
+        if not self.enabled:
+            return
+        self._add(name, {"serialize": serialize_seconds}, calls=0)
+        with self.lock:
+            _add_value(self.callbacks[name].setdefault("response_bytes", {}), nbytes)
+
+    def _add(self, name: str, stages: dict, calls: int = 1):
+        with self.lock:
+            entry = self.callbacks.setdefault(name, {"calls": 0, "stages": {}})
+            entry["calls"] += calls
+            for stage, seconds in stages.items():
+                _add_value(entry["stages"].setdefault(stage, {}), seconds * 1000)
+
+    def stats(self) -> dict:
+        """
+        :return: per callback: calls, count, avg, last, max and total per stage (ms) and of the response bytes.
+            The average of a stage is per call of the callback (a stage can run several times or not at all in a call),
+            so the averages of the stages add up to the average total (plus serialize, which is after the callback).
+        """
+        with self.lock:
+            return {name: {"calls": entry["calls"],
+                           "stages": {stage: _summary(values, entry["calls"])
+                                      for stage, values in entry["stages"].items()},
+                           "response_bytes": _summary(entry.get("response_bytes", {}))}
+                    for name, entry in self.callbacks.items()}
+
+
+def _add_value(values: dict, value: float):
+    values["count"] = values.get("count", 0) + 1
+    values["total"] = values.get("total", 0) + value
+    values["last"] = value
+    values["max"] = max(values.get("max", value), value)
+
+
+def _summary(values: dict, calls: int = None) -> dict:
+    if not values:
+        return {}
+    calls = calls or values["count"]
+    return {"count": values["count"], "avg": round(values["total"] / calls, 3),
+            "last": round(values["last"], 3), "max": round(values["max"], 3), "total": round(values["total"], 3)}
+
+
+def format_table(stats: dict) -> str:
+    """
+    The average ms per stage and response bytes of every callback as text table (see CallbackTimings.stats).
+    """
+    stages = [stage for stage in STAGE_ORDER if any(stage in entry["stages"] for entry in stats.values())]
+    stages += sorted({stage for entry in stats.values() for stage in entry["stages"]} - set(stages))
+    width = max([len(name) for name in stats] + [8])
+    lines = [f"{'callback':<{width}} {'calls':>6} " + " ".join(f"{stage:>12}" for stage in stages) + f" {'bytes':>10}"]
+    for name, entry in sorted(stats.items()):
+        averages = [entry["stages"].get(stage, {}).get("avg") for stage in stages]
+        response_bytes = entry["response_bytes"].get("avg")
+        lines.append(f"{name:<{width}} {entry['calls']:>6} "
+                     + " ".join(f"{'-' if avg is None else f'{avg:.1f}':>12}" for avg in averages)
+                     + f" {'-' if response_bytes is None else round(response_bytes):>10}")
+    return "\n".join(lines)